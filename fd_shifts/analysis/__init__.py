@@ -1,8 +1,11 @@
 from __future__ import annotations
 
 from loguru import logger
+import copy
 import os
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
+from functools import cached_property
 from pathlib import Path
 from typing import Any
 
@@ -11,16 +14,48 @@ import numpy.typing as npt
 import pandas as pd
 from omegaconf import DictConfig, ListConfig, OmegaConf
 
-from .confid_scores import ConfidScore, is_external_confid
+from . import performance_metrics as performance
+from .bootstrap import bootstrap_ci, ci_metric_names
+from .confid_scores import (
+    MCD_DIST_FEATURES,
+    MCD_SOFTMAX_FEATURES,
+    SOFTMAX_FEATURES,
+    ConfidScore,
+    dist_row_blocks,
+    get_confid_feature,
+    is_external_confid,
+    mcd_dist_confids,
+    prediction_feature,
+    softmax_features,
+)
 from .eval_utils import (
     ConfidEvaluator,
     ConfidPlotter,
     ThresholdPlot,
     cifar100_classes,
     qual_plot,
+    save_plot_stats,
 )
+from .manifest import MANIFEST_NAME, AnalysisManifest, config_digest
+from .profiling import PROFILE_NAME, StageProfiler
+from .results_store import INFO_COLUMNS, KEY_COLUMNS, ResultsStore
 from .studies import get_study_iterator
 
+GROUP_RESULTS_STORE = "group_analysis_metrics.sqlite"
+RESULT_INFO_COLUMNS = KEY_COLUMNS + INFO_COLUMNS
+TEST_RISK_METRICS = [
+    "test_risk",
+    "test_cov",
+    "diff_risk",
+    "diff_cov",
+    "rstar",
+    "val_theta",
+]
+
+# render: a master plot png per study, deferred: only the plot stats, to be
+# rendered later with eval_utils.render_master_plots, none: metrics only
+PLOT_MODES = ("render", "deferred", "none")
+
 
 @dataclass
 class ExperimentData:
@@ -35,33 +70,97 @@ class ExperimentData:
     external_confids: npt.NDArray[Any] | None = None
     mcd_external_confids_dist: npt.NDArray[Any] | None = None
 
+    # HACK: OpenSet runs currently output all classes, but only train on
+    # in-classes. The holdout classes are zeroed in filtered and derived
+    # arrays, the (possibly memory-mapped) raw outputs are never written.
+    holdout_classes: list | None = None
+
+    # Derived arrays are computed on first access and handed on to filtered
+    # copies, so no study recomputes them from the (possibly huge) raw outputs.
     _mcd_correct: npt.NDArray[Any] | None = field(default=None)
     _correct: npt.NDArray[Any] | None = field(default=None)
+    _mcd_softmax_mean: npt.NDArray[Any] | None = field(default=None)
+    _features: dict[str, npt.NDArray[Any]] = field(default_factory=dict)
 
     @property
     def correct(self) -> npt.NDArray[Any]:
-        if self._correct is not None:
-            return self._correct
-        return (np.argmax(self.softmax_output, axis=1) == self.labels).astype(int)
+        if self._correct is None:
+            self._correct = (self.feature("det_predict") == self.labels).astype(int)
+        return self._correct
 
     @property
     def mcd_softmax_mean(self) -> npt.NDArray[Any] | None:
-        if self.mcd_softmax_dist is None:
-            return None
-        return np.mean(self.mcd_softmax_dist, axis=2)
+        if self._mcd_softmax_mean is None and self.mcd_softmax_dist is not None:
+            if self.holdout_classes is None:
+                self._mcd_softmax_mean = np.mean(self.mcd_softmax_dist, axis=2)
+            else:
+                self._mcd_softmax_mean = np.concatenate(
+                    [
+                        np.mean(self._zero_holdout(self.mcd_softmax_dist[rows]), axis=2)
+                        for rows in dist_row_blocks(self.mcd_softmax_dist)
+                    ]
+                )
+        return self._mcd_softmax_mean
 
     @property
     def mcd_correct(self) -> npt.NDArray[Any] | None:
-        if self._mcd_correct is not None:
-            return self._mcd_correct
-        if self.mcd_softmax_mean is None:
-            return None
-        return (np.argmax(self.mcd_softmax_mean, axis=1) == self.labels).astype(int)
+        if self._mcd_correct is None and self.mcd_softmax_mean is not None:
+            self._mcd_correct = (self.feature("mcd_predict") == self.labels).astype(int)
+        return self._mcd_correct
+
+    def _zero_holdout(self, array: npt.NDArray[Any] | None):
+        """Copy of an array with the holdout classes zeroed on its last axis
+
+        Zeroing is idempotent, so arrays already zeroed by a filter can pass
+        through again.
+        """
+        if self.holdout_classes is None or array is None:
+            return array
+        array = np.array(array)
+        array[..., self.holdout_classes] = 0
+        return array
+
+    def extract_features(self, names: list[str]):
+        """Compute per-row feature columns, one pass per source array
+
+        A pass computes all features of its source, e.g. every softmax
+        feature, so later lookups of the others are free.
+        """
+        missing = [n for n in names if n not in self._features]
+        if any(n in SOFTMAX_FEATURES for n in missing):
+            self._features.update(
+                softmax_features(self._zero_holdout(self.softmax_output), "det_")
+            )
+        if any(n in MCD_SOFTMAX_FEATURES for n in missing):
+            assert self.mcd_softmax_mean is not None
+            self._features.update(softmax_features(self.mcd_softmax_mean, "mcd_"))
+        dist_features = [n for n in missing if n in MCD_DIST_FEATURES]
+        if len(dist_features) > 0:
+            assert self.mcd_softmax_dist is not None
+            self._features.update(
+                mcd_dist_confids(
+                    self.mcd_softmax_mean,
+                    self.mcd_softmax_dist,
+                    dist_features,
+                    zero_classes=self.holdout_classes,
+                )
+            )
 
-    def dataset_name_to_idx(self, dataset_name: str) -> int:
-        if dataset_name == "val_tuning":
-            return 0
+    def feature(self, name: str) -> npt.NDArray[Any]:
+        if name not in self._features:
+            self.extract_features([name])
+        return self._features[name]
+
+    def _map_features(self, func, mcd_func=None) -> dict[str, npt.NDArray[Any]]:
+        """Apply a row selection to the features, ``mcd_func`` to MCD ones"""
+        mcd_func = func if mcd_func is None else mcd_func
+        return {
+            name: (mcd_func if name.startswith("mcd_") else func)(values)
+            for name, values in self._features.items()
+        }
 
+    @cached_property
+    def _dataset_name_indices(self) -> dict[str, int]:
         flat_test_set_list = []
         for _, datasets in self.config.eval.query_studies.items():
             if isinstance(datasets, (list, ListConfig)):
@@ -69,18 +168,50 @@ class ExperimentData:
             else:
                 flat_test_set_list.append(datasets)
 
-        dataset_idx = flat_test_set_list.index(dataset_name)
+        offset = 1 if self.config.eval.val_tuning else 0
+        name_indices: dict[str, int] = {}
+        for dataset_idx, dataset_name in enumerate(flat_test_set_list):
+            name_indices.setdefault(dataset_name, dataset_idx + offset)
+        return name_indices
+
+    def dataset_name_to_idx(self, dataset_name: str) -> int:
+        if dataset_name == "val_tuning":
+            return 0
+
+        if dataset_name not in self._dataset_name_indices:
+            raise ValueError(f"{dataset_name} is not in the query studies")
+
+        return self._dataset_name_indices[dataset_name]
+
+    @cached_property
+    def _dataset_groups(self) -> dict[int, slice | npt.NDArray[np.int64]]:
+        """Rows of every dataset, grouped in one pass over dataset_idx
 
-        if self.config.eval.val_tuning:
-            dataset_idx += 1
+        Test sets are written one after another, so a group usually is a
+        contiguous range. Those are stored as slices, which keep
+        memory-mapped arrays lazy and make filtered arrays views.
+        """
+        order = np.argsort(self.dataset_idx, kind="stable")
+        values, starts = np.unique(self.dataset_idx[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
 
-        return dataset_idx
+        groups: dict[int, slice | npt.NDArray[np.int64]] = {}
+        for value, start, end in zip(values, starts, ends):
+            rows = order[start:end]
+            if rows[-1] - rows[0] + 1 == len(rows):
+                rows = slice(rows[0], rows[-1] + 1)
+            groups[int(value)] = rows
+        return groups
+
+    def dataset_rows(self, dataset_idx: int) -> slice | npt.NDArray[np.int64]:
+        """Rows belonging to a dataset, as a slice where possible"""
+        return self._dataset_groups.get(dataset_idx, np.arange(0))
 
     def filter_dataset_by_name(self, dataset_name: str) -> ExperimentData:
         return self.filter_dataset_by_index(self.dataset_name_to_idx(dataset_name))
 
     def filter_dataset_by_index(self, dataset_idx: int) -> ExperimentData:
-        mask = np.argwhere(self.dataset_idx == dataset_idx)[:, 0]
+        mask = self.dataset_rows(dataset_idx)
 
         def _filter_if_exists(data: npt.NDArray[Any] | None):
             if data is not None:
@@ -89,22 +220,36 @@ class ExperimentData:
             return None
 
         return ExperimentData(
-            softmax_output=self.softmax_output[mask],
+            softmax_output=self._zero_holdout(self.softmax_output[mask]),
             labels=self.labels[mask],
             dataset_idx=self.dataset_idx[mask],
             mcd_softmax_dist=_filter_if_exists(self.mcd_softmax_dist),
             external_confids=_filter_if_exists(self.external_confids),
             mcd_external_confids_dist=_filter_if_exists(self.mcd_external_confids_dist),
             config=self.config,
+            holdout_classes=self.holdout_classes,
+            _correct=_filter_if_exists(self._correct),
+            _mcd_correct=_filter_if_exists(self._mcd_correct),
+            _mcd_softmax_mean=_filter_if_exists(self._mcd_softmax_mean),
+            _features=self._map_features(_filter_if_exists),
         )
 
     @staticmethod
-    def __load_npz_if_exists(path: Path) -> npt.NDArray[np.float64] | None:
-        if not path.is_file():
-            return None
+    def __load_if_exists(test_dir: Path, name: str) -> npt.NDArray[np.float64] | None:
+        """Load a raw output array, preferring the uncompressed .npy file
 
-        with np.load(path) as npz:
-            return npz.f.arr_0
+        Uncompressed outputs are memory-mapped, so only the parts a study
+        touches are ever read from disk. Compressed .npz files have to be
+        decompressed into memory as a whole.
+        """
+        if (path := test_dir / f"{name}.npy").is_file():
+            return np.load(path, mmap_mode="r")
+
+        if (path := test_dir / f"{name}.npz").is_file():
+            with np.load(path) as npz:
+                return npz.f.arr_0
+
+        return None
 
     @staticmethod
     def from_experiment(
@@ -115,38 +260,28 @@ class ExperimentData:
         if not isinstance(test_dir, Path):
             test_dir = Path(test_dir)
 
-        if not (test_dir / "raw_output.npz").is_file():
+        raw_output = ExperimentData.__load_if_exists(test_dir, "raw_output")
+        if raw_output is None:
             raise FileNotFoundError
 
-        with np.load(test_dir / "raw_output.npz") as npz:
-            raw_output = npz.f.arr_0
-
-        mcd_softmax_dist = ExperimentData.__load_npz_if_exists(
-            test_dir / "raw_output_dist.npz"
-        )
-
         if config is None:
             config = OmegaConf.load(test_dir.parent / "hydra/config.yaml")
 
-        # HACK: OpenSet runs currently output all classes, but only train on in-classes
-        if holdout_classes is not None:
-            raw_output[:, holdout_classes] = 0
-
-            if mcd_softmax_dist is not None:
-                mcd_softmax_dist[:, :, holdout_classes] = 0
-
         return ExperimentData(
             softmax_output=raw_output[:, :-2],
-            labels=raw_output[:, -2],
-            dataset_idx=raw_output[:, -1],
-            mcd_softmax_dist=mcd_softmax_dist,
-            external_confids=ExperimentData.__load_npz_if_exists(
-                test_dir / "external_confids.npz"
+            labels=np.array(raw_output[:, -2]),
+            dataset_idx=np.array(raw_output[:, -1]),
+            mcd_softmax_dist=ExperimentData.__load_if_exists(
+                test_dir, "raw_output_dist"
             ),
-            mcd_external_confids_dist=ExperimentData.__load_npz_if_exists(
-                test_dir / "external_confids_dist.npz"
+            external_confids=ExperimentData.__load_if_exists(
+                test_dir, "external_confids"
+            ),
+            mcd_external_confids_dist=ExperimentData.__load_if_exists(
+                test_dir, "external_confids_dist"
             ),
             config=config,
+            holdout_classes=holdout_classes,
         )
 
 
@@ -163,6 +298,11 @@ class Analysis:
         threshold_plot_confid,
         qual_plot_confid,
         cf,
+        n_bootstrap=0,
+        n_jobs=1,
+        plot_mode="render",
+        incremental=False,
+        profile=False,
     ):
 
         self.method_dict = {
@@ -176,7 +316,15 @@ class Analysis:
         holdout_classes: list | None = (
             kwargs.get("out_classes") if (kwargs := cf.data.get("kwargs")) else None
         )
-        self.experiment_data = ExperimentData.from_experiment(path, holdout_classes, cf)
+        self.profiler = StageProfiler(
+            Path(analysis_out_dir) / PROFILE_NAME if profile else None,
+            run=self.method_dict["name"],
+        )
+        self.profiler.reset()
+        with self.profiler.stage("load"):
+            self.experiment_data = ExperimentData.from_experiment(
+                path, holdout_classes, cf
+            )
 
         if self.method_dict["cfg"].data.num_classes is None:
             self.method_dict["cfg"].data.num_classes = self.method_dict[
@@ -202,34 +350,214 @@ class Analysis:
         self.add_val_tuning = add_val_tuning
         self.threshold_plot_confid = threshold_plot_confid
         self.qual_plot_confid = qual_plot_confid
+        self.n_bootstrap = n_bootstrap
+        self.query_ci_metrics = (
+            ci_metric_names(self.query_confid_metrics) if n_bootstrap > 0 else []
+        )
+        self.n_jobs = n_jobs
+        if plot_mode not in PLOT_MODES:
+            raise ValueError(f"plot_mode must be one of {PLOT_MODES}, got {plot_mode}")
+        self.plot_mode = plot_mode
+        self.threshold_plot_dict = {}
+
+        self.incremental = incremental
+        self.reused_results = {}
+        self.manifest_path = Path(analysis_out_dir) / MANIFEST_NAME
+        self.manifest = None
+        if incremental:
+            self.manifest = AnalysisManifest.from_experiment(
+                Path(path),
+                config_digest(
+                    self.method_dict["cfg"],
+                    query_studies=self.query_studies,
+                    add_val_tuning=add_val_tuning,
+                    n_bootstrap=n_bootstrap,
+                    calibration_bins=self.calibration_bins,
+                ),
+                AnalysisManifest.load(self.manifest_path),
+            )
+
+    @property
+    def study_metrics(self) -> list[str]:
+        """All metrics a study reports, including those added by val_tuning"""
+        test_risk_metrics = [
+            m
+            for m in (TEST_RISK_METRICS if self.add_val_tuning else [])
+            if m not in self.query_confid_metrics
+        ]
+        return (
+            self.query_performance_metrics
+            + self.query_confid_metrics
+            + test_risk_metrics
+            + self.query_ci_metrics
+        )
+
+    def __getstate__(self) -> dict[str, Any]:
+        # studies are shipped to workers with their own data already filtered
+        state = self.__dict__.copy()
+        state["experiment_data"] = None
+        return state
 
     def register_and_perform_studies(self):
 
         if self.qual_plot_confid:
             self.get_dataloader()
 
+        def iterate_studies():
+            for query_study in self.query_studies.keys():
+                yield from get_study_iterator(query_study)(query_study, self)
+
+        stale_studies = None
+        if self.incremental:
+            stale_studies = {
+                study_name
+                for study_name, _ in iterate_studies()
+                if self.manifest.missing_metrics(study_name, self.study_metrics)
+            }
+            if len(stale_studies) == 0 and not (
+                self.add_val_tuning
+                and self.manifest.missing_metrics("val_tuning", self.study_metrics)
+            ):
+                logger.info("analysis in {} is up to date", self.analysis_out_dir)
+                return
+
+        # computed once for the whole run, studies only select rows of them
+        features = [prediction_feature(c) for c in self.method_dict["query_confids"]]
+        features += [
+            f for c in self.method_dict["query_confids"] if (f := get_confid_feature(c))
+        ]
+        with self.profiler.stage("extract_features"):
+            self.experiment_data.extract_features(list(dict.fromkeys(features)))
+
+        with self.profiler.stage("filter_studies"):
+            studies = [
+                (study_name, study_data)
+                for study_name, study_data in iterate_studies()
+                if stale_studies is None or study_name in stale_studies
+            ]
+
         if self.add_val_tuning:
 
             self.rstar = self.method_dict["cfg"].eval.r_star
             self.rdelta = self.method_dict["cfg"].eval.r_delta
+            # val_tuning sets the risk thresholds all other studies are
+            # evaluated with, so it runs first and in this process
             for study_name, study_data in get_study_iterator("val_tuning")(
                 "val_tuning", self
             ):
-                self.perform_study("val_tuning", study_data)
+                self._complete_study(
+                    "val_tuning", self.perform_study("val_tuning", study_data)
+                )
 
-        for query_study in self.query_studies.keys():
-            for study_name, study_data in get_study_iterator(query_study)(
-                query_study, self
-            ):
-                self.perform_study(study_name, study_data)
+        if self.n_jobs > 1:
+            with ProcessPoolExecutor(max_workers=self.n_jobs) as executor:
+                study_results = executor.map(
+                    self.perform_isolated_study, *zip(*studies)
+                )
+                self._merge_study_results(study_results)
+        else:
+            self._merge_study_results(
+                self.perform_isolated_study(study_name, study_data)
+                for study_name, study_data in studies
+            )
 
-    def perform_study(self, study_name, study_data: ExperimentData):
+    def _complete_study(self, study_name: str, results: pd.DataFrame):
+        self.append_group_results(results)
+        if self.manifest is not None:
+            self.manifest.record_study(
+                study_name,
+                [c for c in results.columns if c not in RESULT_INFO_COLUMNS],
+            )
+            self.manifest.save(self.manifest_path)
+
+    def _merge_study_results(self, study_results):
+        # results arrive in study order, independent of the executor
+        for study_name, results, threshold_plot_dict in study_results:
+            self._complete_study(study_name, results)
+            if threshold_plot_dict:
+                self.threshold_plot_dict.update(threshold_plot_dict)
+
+    def perform_isolated_study(
+        self, study_name, study_data: ExperimentData
+    ) -> tuple[str, pd.DataFrame, dict[str, Any]]:
+        """Run a study without changing the state of this analysis
+
+        Returns:
+            the study's name, results and entries for the threshold plot
+        """
+        study = copy.copy(self)
+        study.method_dict = dict(self.method_dict)
+        study.query_confid_metrics = list(self.query_confid_metrics)
+        study.threshold_plot_dict = {}
+        results = study.perform_study(study_name, study_data)
+        return study_name, results, study.threshold_plot_dict
+
+    def perform_study(self, study_name, study_data: ExperimentData) -> pd.DataFrame:
 
         self.study_name = study_name
-        self.get_confidence_scores(study_data)
-        self.compute_confid_metrics()
-        self.create_results_csv(study_data)
-        self.create_master_plot()
+        self.reused_results = self._load_reused_results() if self.incremental else {}
+        with self._stage("get_confidence_scores"):
+            self.get_confidence_scores(study_data)
+        with self._stage("compute_confid_metrics"):
+            self.compute_confid_metrics()
+        with self._stage("create_results_csv"):
+            results = self.create_results_csv(study_data)
+        if not self.reused_results:
+            # plots only depend on the inputs, they are up to date otherwise
+            with self._stage("create_master_plot"):
+                self.create_master_plot()
+        return results
+
+    def _stage(self, stage: str, confid: str | None = None):
+        return self.profiler.stage(stage, study=self.study_name, confid=confid)
+
+    def _load_reused_results(self) -> dict[str, dict[str, Any]]:
+        """Stored metrics of the current study that are still valid
+
+        Returns:
+            metric values per confid, empty if the study has to be recomputed
+        """
+        missing = self.manifest.missing_metrics(self.study_name, self.study_metrics)
+        reusable = [m for m in self.study_metrics if m not in missing]
+        if len(reusable) == 0:
+            return {}
+
+        # stored results use the external confid's actual name
+        for query_confid in list(self.method_dict["query_confids"]):
+            self._fix_external_confid_name(query_confid)
+
+        stored = ResultsStore(
+            os.path.join(self.method_dict["cfg"].exp.group_dir, GROUP_RESULTS_STORE)
+        ).load(
+            metrics=reusable,
+            names=[self.method_dict["name"]],
+            studies=[self.study_name],
+        )
+        stored = stored.set_index("confid")[reusable]
+        if not set(self.method_dict["query_confids"]) <= set(stored.index):
+            return {}
+
+        logger.info(
+            "{}: reusing {} stored metrics, computing {}",
+            self.study_name,
+            len(reusable),
+            missing,
+        )
+        return {
+            confid: stored.loc[confid].to_dict()
+            for confid in self.method_dict["query_confids"]
+        }
+
+    def _metrics_to_compute(self, query_metrics: list[str]) -> list[str]:
+        if not self.reused_results:
+            return query_metrics
+
+        reused = next(iter(self.reused_results.values())).keys()
+        metrics = [m for m in query_metrics if m not in reused]
+        if any(m.startswith("risk@") for m in metrics):
+            # ConfidEvaluator computes all risk@XXcov together with aurc
+            metrics += [m for m in ["aurc", "risk@95cov"] if m not in metrics]
+        return metrics
 
     def _fix_external_confid_name(self, name: str):
         if not is_external_confid(name):
@@ -258,39 +586,37 @@ class Analysis:
             query_confid = self._fix_external_confid_name(query_confid)
 
             self.method_dict[query_confid] = {}
-            self.method_dict[query_confid]["confids"] = confid_score.confids
+            with self._stage("confids", query_confid):
+                self.method_dict[query_confid]["confids"] = confid_score.confids
             self.method_dict[query_confid]["correct"] = confid_score.correct
-            self.method_dict[query_confid]["metrics"] = confid_score.metrics
+            with self._stage("performance_metrics", query_confid):
+                self.method_dict[query_confid]["metrics"] = confid_score.metrics
             self.method_dict[query_confid]["predict"] = confid_score.predict
             self.method_dict[query_confid]["labels"] = confid_score.labels
 
     def compute_performance_metrics(self, softmax, labels, correct):
         performance_metrics = {}
-        num_classes = self.num_classes
-        if "nll" in self.query_performance_metrics:
+        query_performance_metrics = self._metrics_to_compute(
+            self.query_performance_metrics
+        )
+        if "nll" in query_performance_metrics:
             if "new_class" in self.study_name:
                 performance_metrics["nll"] = None
             else:
-                y_one_hot = np.eye(num_classes)[labels.astype("int")]
-                performance_metrics["nll"] = np.mean(
-                    -np.log(softmax + 1e-7) * y_one_hot
-                )
-        if "accuracy" in self.query_performance_metrics:
-            performance_metrics["accuracy"] = np.sum(correct) / correct.size
-        if "b-accuracy" in self.query_performance_metrics:
-            accuracies_list = []
-            for cla in np.unique(labels):
-                is_class = labels == cla
-                accuracy_class = np.mean(correct[is_class])
-                accuracies_list.append(accuracy_class)
-            performance_metrics["b-accuracy"] = np.mean(accuracies_list)
-        if "brier_score" in self.query_performance_metrics:
+                performance_metrics["nll"] = performance.nll(softmax, labels)
+        if "accuracy" in query_performance_metrics:
+            performance_metrics["accuracy"] = performance.accuracy(correct)
+        if "b-accuracy" in query_performance_metrics:
+            performance_metrics["b-accuracy"] = performance.balanced_accuracy(
+                labels, correct
+            )
+        if "brier_score" in query_performance_metrics:
             if "new_class" in self.study_name:
                 performance_metrics["brier_score"] = None
             else:
-                y_one_hot = np.eye(num_classes)[labels.astype("int")]  # [b, classes]
-                mse = (softmax - y_one_hot) ** 2
-                performance_metrics["brier_score"] = np.mean(np.sum(mse, axis=1))
+                performance_metrics["brier_score"] = performance.brier_score(
+                    softmax, labels
+                )
 
         return performance_metrics
 
@@ -337,18 +663,39 @@ class Analysis:
                 confids=confid_dict["confids"],
                 correct=confid_dict["correct"],
                 labels=confid_dict["labels"],
-                query_metrics=self.query_confid_metrics,
+                query_metrics=self._metrics_to_compute(self.query_confid_metrics),
                 query_plots=self.query_plots,
                 bins=self.calibration_bins,
             )
 
-            confid_dict["metrics"].update(eval.get_metrics_per_confid())
-            confid_dict["plot_stats"] = eval.get_plot_stats_per_confid()
+            with self._stage("confid_metrics", confid_key):
+                confid_dict["metrics"].update(eval.get_metrics_per_confid())
+            with self._stage("plot_stats", confid_key):
+                confid_dict["plot_stats"] = eval.get_plot_stats_per_confid()
+
+            if self.n_bootstrap > 0:
+                with self._stage("bootstrap", confid_key):
+                    confid_dict["metrics"].update(
+                        bootstrap_ci(
+                            confids=confid_dict["confids"],
+                            correct=confid_dict["correct"],
+                            query_metrics=[
+                                m
+                                for m in self.query_confid_metrics
+                                if f"{m}_ci_low"
+                                in self._metrics_to_compute(self.query_ci_metrics)
+                            ],
+                            labels=confid_dict["labels"],
+                            n_bootstrap=self.n_bootstrap,
+                            n_bins=self.calibration_bins,
+                        )
+                    )
 
             if self.study_name == "val_tuning":
-                self.val_risk_scores[confid_key] = eval.get_val_risk_scores(
-                    self.rstar, self.rdelta
-                )  # dummy, because now doing the plot and delta is a list!
+                with self._stage("risk_bound", confid_key):
+                    self.val_risk_scores[confid_key] = eval.get_val_risk_scores(
+                        self.rstar, self.rdelta
+                    )  # dummy, because now doing the plot and delta is a list!
             if self.val_risk_scores.get(confid_key) is not None:
                 val_risk_scores = self.val_risk_scores[confid_key]
                 test_risk_scores = {}
@@ -374,16 +721,7 @@ class Analysis:
                 test_risk_scores["val_theta"] = val_risk_scores["theta"]
                 confid_dict["metrics"].update(test_risk_scores)
                 if "test_risk" not in self.query_confid_metrics:
-                    self.query_confid_metrics.extend(
-                        [
-                            "test_risk",
-                            "test_cov",
-                            "diff_risk",
-                            "diff_cov",
-                            "rstar",
-                            "val_theta",
-                        ]
-                    )
+                    self.query_confid_metrics.extend(TEST_RISK_METRICS)
 
             logger.debug("checking in\n{}\n{}", self.threshold_plot_confid, confid_key)
             if (
@@ -403,10 +741,10 @@ class Analysis:
                     self.plot_threshs = []
                     self.true_covs = []
                     logger.debug("creating threshold_plot_dict....")
-                    for delta in self.rdelta:
-                        plot_val_risk_scores = eval.get_val_risk_scores(
-                            self.rstar, delta
-                        )
+                    for delta, plot_val_risk_scores in zip(
+                        self.rdelta,
+                        eval.get_val_risk_scores(self.rstar, list(self.rdelta)),
+                    ):
                         self.plot_threshs.append(plot_val_risk_scores["theta"])
                         self.true_covs.append(plot_val_risk_scores["val_cov"])
                         logger.debug(
@@ -574,9 +912,13 @@ class Analysis:
                 )
                 qual_plot(fp_dict, fn_dict, out_path)
 
-    def create_results_csv(self, study_data: ExperimentData):
+    def create_results_csv(self, study_data: ExperimentData) -> pd.DataFrame:
 
-        all_metrics = self.query_performance_metrics + self.query_confid_metrics
+        all_metrics = (
+            self.query_performance_metrics
+            + self.query_confid_metrics
+            + self.query_ci_metrics
+        )
         columns = [
             "name",
             "study",
@@ -586,7 +928,7 @@ class Analysis:
             "confid",
             "n_test",
         ] + all_metrics
-        df = pd.DataFrame(columns=columns)
+        rows = []
         network = self.method_dict["cfg"].model.network
         if network is not None:
             backbone = dict(network).get("backbone")
@@ -604,10 +946,13 @@ class Analysis:
                 if "mcd" in confid_key
                 else study_data.softmax_output.shape[0],
             ]
-            submit_list += [
-                self.method_dict[confid_key]["metrics"][x] for x in all_metrics
-            ]
-            df.loc[len(df)] = submit_list
+            metrics = {
+                **self.reused_results.get(confid_key, {}),
+                **self.method_dict[confid_key]["metrics"],
+            }
+            submit_list += [metrics[x] for x in all_metrics]
+            rows.append(submit_list)
+        df = pd.DataFrame(rows, columns=columns)
         # print("CHECK SHIFT", self.study_name, all_metrics, self.input_list[0]["det_mcp"].keys())
         df.to_csv(
             os.path.join(self.analysis_out_dir, "analysis_metrics_{}.csv").format(
@@ -623,17 +968,17 @@ class Analysis:
             ),
         )
 
-        group_file_path = os.path.join(
-            self.method_dict["cfg"].exp.group_dir, "group_analysis_metrics.csv"
-        )
-        if os.path.exists(group_file_path):
-            with open(group_file_path, "a") as f:
-                df.to_csv(f, float_format="%.5f", decimal=".", header=False)
-        else:
-            with open(group_file_path, "w") as f:
-                df.to_csv(f, float_format="%.5f", decimal=".")
+        return df
+
+    def append_group_results(self, df: pd.DataFrame):
+        ResultsStore(
+            os.path.join(self.method_dict["cfg"].exp.group_dir, GROUP_RESULTS_STORE)
+        ).write(df)
 
     def create_threshold_plot(self):
+        if not self.threshold_plot_dict:
+            return
+
         # get overall with one dict per compared_method (i.e confid)
         f = ThresholdPlot(self.threshold_plot_dict)
         f.savefig(
@@ -651,11 +996,27 @@ class Analysis:
         )
 
     def create_master_plot(self):
+        if self.plot_mode == "none":
+            return
+
         # get overall with one dict per compared_method (i.e confid)
         input_dict = {
             "{}_{}".format(self.method_dict["name"], k): self.method_dict[k]
             for k in self.method_dict["query_confids"]
         }
+
+        if self.plot_mode == "deferred":
+            out_path = os.path.join(
+                self.analysis_out_dir, "plot_stats_{}.npz".format(self.study_name)
+            )
+            save_plot_stats(
+                out_path, input_dict, self.query_plots, self.calibration_bins
+            )
+            logger.debug("saved plot stats to {}", out_path)
+            return
+
+        import matplotlib.pyplot as plt
+
         plotter = ConfidPlotter(
             input_dict, self.query_plots, self.calibration_bins, fig_scale=1
         )  # fig_scale big: 5
@@ -665,6 +1026,7 @@ class Analysis:
                 self.analysis_out_dir, "master_plot_{}.png".format(self.study_name)
             )
         )
+        plt.close(f)
         logger.debug(
             "saved masterplot to {}",
             os.path.join(
@@ -689,6 +1051,11 @@ def main(
     cf=None,
     threshold_plot_confid: str | None = "tcp_mcd",
     qual_plot_confid=None,
+    n_bootstrap: int = 0,
+    n_jobs: int = 1,
+    plot_mode: str = "render",
+    incremental: bool = False,
+    profile: bool = False,
 ):  # qual plot to false
 
     # path to the dir where the raw otuputs lie. NO SLASH AT THE END!
@@ -745,6 +1112,11 @@ def main(
         threshold_plot_confid=threshold_plot_confid,
         qual_plot_confid=qual_plot_confid,
         cf=cf,
+        n_bootstrap=n_bootstrap,
+        n_jobs=n_jobs,
+        plot_mode=plot_mode,
+        incremental=incremental,
+        profile=profile,
     )
 
     analysis.register_and_perform_studies()
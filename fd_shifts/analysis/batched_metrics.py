@@ -0,0 +1,312 @@
+"""Failure-detection metrics for many confidence scores at once.
+
+All functions take a ``(n_samples, n_confids)`` confidence matrix together
+with either one shared correctness vector or a correctness matrix of the same
+shape, and evaluate every column with batched NumPy operations (column-wise
+argsort and cumulative sums). The results match the per-confid
+implementations in :mod:`fd_shifts.analysis.metrics`.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Callable, Sequence
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+
+from .metrics import AURC_DISPLAY_SCALE
+
+_batched_metric_funcs = {}
+
+
+def register_batched_metric_func(name: str) -> Callable:
+    def _inner_wrapper(func: Callable) -> Callable:
+        _batched_metric_funcs[name] = func
+        return func
+
+    return _inner_wrapper
+
+
+def has_batched_metric_function(metric_name: str) -> bool:
+    return metric_name in _batched_metric_funcs
+
+
+def get_batched_metric_function(metric_name: str) -> Callable:
+    if metric_name not in _batched_metric_funcs:
+        raise NotImplementedError(
+            f"Batched function for {metric_name} not implemented."
+        )
+
+    return _batched_metric_funcs[metric_name]
+
+
+class BatchedStatsCache:
+    """Sorted views of a confidence matrix shared by all batched metrics.
+
+    Attributes:
+        confids (array_like): Confidence values, shape ``(n_samples, n_confids)``
+        correct (array_like): Where predictions were correct, shape
+            ``(n_samples,)`` or ``(n_samples, n_confids)``
+        n_bins (int): Number of calibration bins
+    """
+
+    def __init__(
+        self, confids: npt.NDArray[Any], correct: npt.NDArray[Any], n_bins: int = 20
+    ) -> None:
+        confids = np.asarray(confids, dtype=np.float64)
+        if confids.ndim == 1:
+            confids = confids[:, None]
+        correct = np.asarray(correct)
+        if len(correct) != len(confids):
+            raise ValueError("correct must have one entry per row of confids")
+        if correct.ndim == 1:
+            correct = np.broadcast_to(correct[:, None], confids.shape)
+
+        self.confids = confids
+        self.correct = correct
+        self.n_bins = n_bins
+        self.n_samples, self.n_confids = confids.shape
+
+        self.idx_sorted = np.argsort(confids, axis=0)
+        self.sorted_confids = np.take_along_axis(confids, self.idx_sorted, axis=0)
+        self.sorted_correct = np.take_along_axis(correct == 1, self.idx_sorted, axis=0)
+
+        # first and last position of the tie group every sorted sample belongs to
+        positions = np.arange(self.n_samples)[:, None]
+        is_start = np.ones(confids.shape, dtype=bool)
+        is_start[1:] = self.sorted_confids[1:] != self.sorted_confids[:-1]
+        is_end = np.ones(confids.shape, dtype=bool)
+        is_end[:-1] = is_start[1:]
+        self.is_group_start = is_start
+        self.is_group_end = is_end
+        self.group_start = np.maximum.accumulate(
+            np.where(is_start, positions, 0), axis=0
+        )
+        self.group_end = np.minimum.accumulate(
+            np.where(is_end, positions, self.n_samples - 1)[::-1], axis=0
+        )[::-1]
+
+        self.n_success = np.sum(correct == 1, axis=0)
+        self.n_failure = self.n_samples - self.n_success
+
+    @property
+    def residuals(self) -> npt.NDArray[Any]:
+        return 1 - self.correct
+
+
+def _average_precision(
+    group_end: npt.NDArray[Any], sorted_positives: npt.NDArray[Any]
+) -> npt.NDArray[Any]:
+    """Average precision for rankings in decreasing score order.
+
+    Every positive contributes the precision at the end of its tie group.
+    """
+    n_positives = sorted_positives.sum(axis=0)
+    tps = np.cumsum(sorted_positives, axis=0, dtype=np.float64)
+    precision = np.take_along_axis(tps, group_end, axis=0) / (group_end + 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.sum(precision * sorted_positives, axis=0) / n_positives
+
+
+@register_batched_metric_func("failauc")
+def failauc(stats: BatchedStatsCache) -> npt.NDArray[Any]:
+    # Mann-Whitney U with mid-ranks for ties equals the trapezoidal ROC area
+    mid_ranks = (stats.group_start + stats.group_end) / 2 + 1
+    rank_sum = np.sum(mid_ranks * stats.sorted_correct, axis=0)
+    n_pos, n_neg = stats.n_success, stats.n_failure
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (rank_sum - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg)
+
+
+@register_batched_metric_func("fpr@95tpr")
+def fpr_at_95_tpr(stats: BatchedStatsCache) -> npt.NDArray[Any]:
+    # ROC points are the tie group ends in decreasing confid order
+    positives = stats.sorted_correct[::-1]
+    is_point = stats.is_group_start[::-1]
+    tps = np.cumsum(positives, axis=0, dtype=np.float64)
+    fps = np.arange(1, stats.n_samples + 1)[:, None] - tps
+
+    # drop collinear intermediate points like sklearn.metrics.roc_curve
+    positions = np.arange(stats.n_samples)[:, None]
+    last_point = np.maximum.accumulate(np.where(is_point, positions, -1), axis=0)
+    prev_point = np.full(is_point.shape, -1)
+    prev_point[1:] = last_point[:-1]
+    next_point = np.full(is_point.shape, stats.n_samples)
+    next_point[:-1] = np.minimum.accumulate(
+        np.where(is_point, positions, stats.n_samples)[::-1], axis=0
+    )[::-1][1:]
+    is_inner = (prev_point >= 0) & (next_point < stats.n_samples)
+    prev_clipped = np.clip(prev_point, 0, stats.n_samples - 1)
+    next_clipped = np.clip(next_point, 0, stats.n_samples - 1)
+
+    def _second_diff(counts):
+        return (
+            np.take_along_axis(counts, next_clipped, axis=0)
+            - 2 * counts
+            + np.take_along_axis(counts, prev_clipped, axis=0)
+        )
+
+    is_kept = is_point & (
+        ~is_inner | (_second_diff(fps) != 0) | (_second_diff(tps) != 0)
+    )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tpr = tps / stats.n_success
+        fpr = fps / stats.n_failure
+
+    return np.where(
+        (stats.n_success == 0) | (stats.n_failure == 0),
+        np.nan,
+        np.min(np.where(is_kept & (tpr >= 0.9495), fpr, np.inf), axis=0),
+    )
+
+
+@register_batched_metric_func("failap_suc")
+def failap_suc(stats: BatchedStatsCache) -> npt.NDArray[Any]:
+    n = stats.n_samples - 1
+    return _average_precision(n - stats.group_start[::-1], stats.sorted_correct[::-1])
+
+
+@register_batched_metric_func("failap_err")
+def failap_err(stats: BatchedStatsCache) -> npt.NDArray[Any]:
+    # errors ranked by decreasing -confid, i.e. increasing confid
+    return _average_precision(stats.group_end, ~stats.sorted_correct)
+
+
+@register_batched_metric_func("aurc")
+def aurc(stats: BatchedStatsCache) -> npt.NDArray[Any]:
+    n = stats.n_samples
+    sorted_residuals = (~stats.sorted_correct).astype(np.float64)
+    error_sum = sorted_residuals.sum(axis=0)
+    initial_risk = error_sum / n
+    if n < 2:
+        return np.zeros(stats.n_confids)
+
+    # risk after removing the i + 1 least confident samples
+    step_risks = (error_sum - np.cumsum(sorted_residuals[:-1], axis=0)) / np.arange(
+        n - 1, 0, -1
+    )[:, None]
+    # a curve point follows the removal of the first sample of every tie group
+    is_point = stats.is_group_start[:-1]
+
+    positions = np.arange(n - 1)[:, None]
+    last_point = np.maximum.accumulate(np.where(is_point, positions, -1), axis=0)
+    prev_point = np.full(is_point.shape, -1)
+    prev_point[1:] = last_point[:-1]
+    prev_risk = np.where(
+        prev_point >= 0,
+        np.take_along_axis(step_risks, np.clip(prev_point, 0, None), axis=0),
+        initial_risk,
+    )
+    area = np.sum(
+        np.where(
+            is_point, (prev_risk + step_risks) * 0.5 * (positions - prev_point), 0
+        ),
+        axis=0,
+    )
+
+    # the final point repeats the last risk down to coverage 0
+    final_point = last_point[-1]
+    final_risk = np.take_along_axis(step_risks, final_point[None], axis=0)[0]
+    area += final_risk * (n - 2 - final_point)
+
+    return area / n * AURC_DISPLAY_SCALE
+
+
+@register_batched_metric_func("e-aurc")
+def eaurc(stats: BatchedStatsCache) -> npt.NDArray[Any]:
+    err = np.mean(stats.residuals, axis=0)
+    kappa_star_aurc = err + (1 - err) * (np.log(1 - err))
+    return aurc(stats) - kappa_star_aurc * AURC_DISPLAY_SCALE
+
+
+def _calibration_discrepancies(
+    stats: BatchedStatsCache,
+) -> tuple[npt.NDArray[Any], npt.NDArray[Any]]:
+    """Per-bin |accuracy - confid| and bin weights, shape ``(n_bins + 1, n_confids)``"""
+    calib_confids = np.clip(stats.confids, 0, 1)  # necessary for waic
+    # same quirk as label_binarize in StatsCache.calibration_stats: a single
+    # present class is binarized to all zeros
+    y_true = np.where(
+        (stats.n_success > 0) & (stats.n_failure > 0), stats.correct, 0
+    ).astype(np.float64)
+
+    bins = np.linspace(0.0, 1.0 + 1e-8, stats.n_bins + 1)
+    n_slots = len(bins)
+    binids = np.digitize(calib_confids, bins) - 1
+    flat_ids = (binids + n_slots * np.arange(stats.n_confids)).ravel()
+    shape = (stats.n_confids, n_slots)
+
+    bin_sums = np.bincount(
+        flat_ids, weights=calib_confids.ravel(), minlength=np.prod(shape)
+    ).reshape(shape)
+    bin_true = np.bincount(
+        flat_ids,
+        weights=y_true.ravel(),
+        minlength=np.prod(shape),
+    ).reshape(shape)
+    bin_total = np.bincount(flat_ids, minlength=np.prod(shape)).reshape(shape)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        discrepancies = np.abs(bin_true - bin_sums) / bin_total
+    prob_total = bin_total / stats.n_samples
+    return np.where(bin_total > 0, discrepancies, np.nan).T, prob_total.T
+
+
+@register_batched_metric_func("mce")
+def maximum_calibration_error(stats: BatchedStatsCache) -> npt.NDArray[Any]:
+    discrepancies, _ = _calibration_discrepancies(stats)
+    return np.nanmax(discrepancies, axis=0)
+
+
+@register_batched_metric_func("ece")
+def expected_calibration_error(stats: BatchedStatsCache) -> npt.NDArray[Any]:
+    discrepancies, prob_total = _calibration_discrepancies(stats)
+    return np.nansum(discrepancies * prob_total, axis=0)
+
+
+@register_batched_metric_func("fail-NLL")
+def failnll(stats: BatchedStatsCache) -> npt.NDArray[Any]:
+    correct = stats.correct
+    return -np.mean(
+        correct * np.log(stats.confids + 1e-7)
+        + (1 - correct) * np.log(1 - stats.confids + 1e-7),
+        axis=0,
+    )
+
+
+def batched_confid_metrics(
+    confids: npt.NDArray[Any],
+    correct: npt.NDArray[Any],
+    confid_names: Sequence[str] | None = None,
+    query_metrics: Sequence[str] | None = None,
+    n_bins: int = 20,
+) -> pd.DataFrame:
+    """Evaluate failure-detection metrics for every column of a confid matrix.
+
+    Args:
+        confids (array_like): Confidence values, shape ``(n_samples, n_confids)``
+        correct (array_like): Where predictions were correct, shape
+            ``(n_samples,)`` or ``(n_samples, n_confids)``
+        confid_names: Name per column, defaults to the column index
+        query_metrics: Metrics to compute, defaults to all batched metrics
+        n_bins (int): Number of calibration bins
+
+    Returns:
+        DataFrame with one row per confid and one column per metric
+    """
+    stats = BatchedStatsCache(confids, correct, n_bins)
+    if confid_names is None:
+        confid_names = [str(i) for i in range(stats.n_confids)]
+    if len(confid_names) != stats.n_confids:
+        raise ValueError("confid_names must have one entry per column of confids")
+    if query_metrics is None:
+        query_metrics = list(_batched_metric_funcs.keys())
+
+    results = {
+        metric: get_batched_metric_function(metric)(stats) for metric in query_metrics
+    }
+    return pd.DataFrame(
+        results, index=pd.Index(confid_names, name="confid")
+    ).reset_index()
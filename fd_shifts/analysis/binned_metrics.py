@@ -0,0 +1,240 @@
+"""Failure metrics from binned confids, as accumulated by an online sketch.
+
+A bin stands for all samples whose confids fall into it and is represented by
+their mean confid. The curves are the ones of :mod:`fd_shifts.analysis.metrics`
+with every bin treated as a group of tied confids, so the metrics are exact
+up to the ordering of samples within a bin.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, replace
+from functools import cached_property
+from typing import Any, Callable
+
+import numpy as np
+import numpy.typing as npt
+from sklearn import metrics as skm
+
+from fd_shifts.analysis import metrics
+
+_binned_metric_funcs: dict[str, Callable[[BinnedStats], float]] = {}
+
+
+@dataclass
+class BinnedStats:
+    """Per-bin sample counts in order of increasing confid
+
+    Attributes:
+        confids (array_like): Mean confid of the samples in each bin, ascending
+        n_correct (array_like): Number of correct predictions per bin
+        n_incorrect (array_like): Number of incorrect predictions per bin
+        min_confid (float): Smallest confid seen
+        max_confid (float): Largest confid seen
+        n_bins (int): Number of calibration bins
+    """
+
+    confids: npt.NDArray[Any]
+    n_correct: npt.NDArray[Any]
+    n_incorrect: npt.NDArray[Any]
+    min_confid: float
+    max_confid: float
+    n_bins: int = 20
+
+    @classmethod
+    def from_sums(
+        cls,
+        confid_sums: npt.NDArray[Any],
+        n_correct: npt.NDArray[Any],
+        n_incorrect: npt.NDArray[Any],
+        min_confid: float,
+        max_confid: float,
+        n_bins: int = 20,
+    ) -> BinnedStats:
+        """Drop empty bins and turn confid sums into means"""
+        n_total = n_correct + n_incorrect
+        nonempty = n_total > 0
+        return cls(
+            confids=confid_sums[nonempty] / n_total[nonempty],
+            n_correct=n_correct[nonempty],
+            n_incorrect=n_incorrect[nonempty],
+            min_confid=min_confid,
+            max_confid=max_confid,
+            n_bins=n_bins,
+        )
+
+    def normalized(self, flip: bool = False) -> BinnedStats:
+        """Scale confids to ``[0, 1]``, ``flip`` turns uncertainties into confids"""
+        confids = (self.confids - self.min_confid) / (
+            self.max_confid - self.min_confid + 1e-9
+        )
+        if not flip:
+            return replace(self, confids=confids, min_confid=0.0, max_confid=1.0)
+        return replace(
+            self,
+            confids=1 - confids[::-1],
+            n_correct=self.n_correct[::-1],
+            n_incorrect=self.n_incorrect[::-1],
+            min_confid=0.0,
+            max_confid=1.0,
+        )
+
+    @cached_property
+    def n_total(self) -> npt.NDArray[Any]:
+        return self.n_correct + self.n_incorrect
+
+    @property
+    def mean_confid(self) -> float:
+        return float(np.sum(self.confids * self.n_total) / np.sum(self.n_total))
+
+    def _check_finite(self):
+        if not np.all(np.isfinite(self.confids)):
+            raise ValueError("Input contains NaN, infinity or a value too large.")
+
+    @cached_property
+    def suc_clf_curve_stats(self) -> tuple[npt.NDArray[Any], npt.NDArray[Any]]:
+        """fps and tps with successes as positives and decreasing confids"""
+        self._check_finite()
+        return (
+            np.cumsum(self.n_incorrect[::-1], dtype=np.float64),
+            np.cumsum(self.n_correct[::-1], dtype=np.float64),
+        )
+
+    @cached_property
+    def err_clf_curve_stats(self) -> tuple[npt.NDArray[Any], npt.NDArray[Any]]:
+        """fps and tps with errors as positives and increasing confids"""
+        self._check_finite()
+        return (
+            np.cumsum(self.n_correct, dtype=np.float64),
+            np.cumsum(self.n_incorrect, dtype=np.float64),
+        )
+
+    @cached_property
+    def roc_curve_stats(self) -> tuple[npt.NDArray[Any], npt.NDArray[Any]]:
+        return metrics.roc_curve(*self.suc_clf_curve_stats)
+
+    @cached_property
+    def suc_prc_curve_stats(self) -> tuple[npt.NDArray[Any], npt.NDArray[Any]]:
+        return metrics.precision_recall_curve(*self.suc_clf_curve_stats)
+
+    @cached_property
+    def err_prc_curve_stats(self) -> tuple[npt.NDArray[Any], npt.NDArray[Any]]:
+        return metrics.precision_recall_curve(*self.err_clf_curve_stats)
+
+    @cached_property
+    def rc_curve_stats(self) -> tuple[npt.NDArray[Any], npt.NDArray[Any]]:
+        """Risks and weights of the risk-coverage curve, removing one bin per step"""
+        self._check_finite()
+        n_left = np.cumsum(self.n_total[::-1])[::-1].astype(np.float64)
+        errors_left = np.cumsum(self.n_incorrect[::-1])[::-1]
+        risks = errors_left / n_left
+        # a well-defined final point at coverage zero
+        risks = np.append(risks, risks[-1])
+        weights = self.n_total / n_left[0]
+        return risks, weights
+
+    @cached_property
+    def calibration_stats(
+        self,
+    ) -> tuple[npt.NDArray[Any], npt.NDArray[Any], npt.NDArray[Any]]:
+        """Same binning as ``StatsCache.calibration_stats``"""
+        confids = np.clip(self.confids, 0, 1)
+        bins = np.linspace(0.0, 1.0 + 1e-8, self.n_bins + 1)
+        binids = np.digitize(confids, bins) - 1
+
+        bin_sums = np.bincount(
+            binids, weights=confids * self.n_total, minlength=len(bins)
+        )
+        bin_true = np.bincount(binids, weights=self.n_correct, minlength=len(bins))
+        bin_total = np.bincount(binids, weights=self.n_total, minlength=len(bins))
+
+        nonzero = bin_total != 0
+        prob_true = bin_true[nonzero] / bin_total[nonzero]
+        prob_pred = bin_sums[nonzero] / bin_total[nonzero]
+        prob_total = bin_total[nonzero] / bin_total.sum()
+
+        return prob_total, prob_true, prob_pred
+
+    @cached_property
+    def bin_discrepancies(self) -> npt.NDArray[Any]:
+        _, bin_accs, bin_confids = self.calibration_stats
+        return np.abs(bin_accs - bin_confids)
+
+
+def register_binned_metric_func(name: str) -> Callable:
+    def _inner_wrapper(func: Callable) -> Callable:
+        _binned_metric_funcs[name] = func
+        return func
+
+    return _inner_wrapper
+
+
+def has_binned_metric_function(metric_name: str) -> bool:
+    return metric_name in _binned_metric_funcs
+
+
+def get_binned_metric_function(metric_name: str) -> Callable[[BinnedStats], float]:
+    return _binned_metric_funcs[metric_name]
+
+
+def binned_metrics(stats: BinnedStats, query_metrics: list[str]) -> dict[str, float]:
+    """Queried metrics that can be computed from binned confids"""
+    return {
+        name: get_binned_metric_function(name)(stats)
+        for name in query_metrics
+        if has_binned_metric_function(name)
+    }
+
+
+@register_binned_metric_func("failauc")
+@metrics.may_raise_sklearn_exception
+def failauc(stats: BinnedStats) -> float:
+    fpr, tpr = stats.roc_curve_stats
+    return skm.auc(fpr, tpr)
+
+
+@register_binned_metric_func("fpr@95tpr")
+@metrics.may_raise_sklearn_exception
+def fpr_at_95_tpr(stats: BinnedStats) -> float:
+    fpr, tpr = stats.roc_curve_stats
+    return np.min(fpr[np.argwhere(tpr >= 0.9495)])
+
+
+@register_binned_metric_func("failap_suc")
+@metrics.may_raise_sklearn_exception
+def failap_suc(stats: BinnedStats) -> float:
+    return metrics.average_precision(*stats.suc_prc_curve_stats)
+
+
+@register_binned_metric_func("failap_err")
+@metrics.may_raise_sklearn_exception
+def failap_err(stats: BinnedStats) -> float:
+    return metrics.average_precision(*stats.err_prc_curve_stats)
+
+
+@register_binned_metric_func("aurc")
+@metrics.may_raise_sklearn_exception
+def aurc(stats: BinnedStats) -> float:
+    risks, weights = stats.rc_curve_stats
+    return metrics.area_under_rc_curve(risks, weights) * metrics.AURC_DISPLAY_SCALE
+
+
+@register_binned_metric_func("e-aurc")
+@metrics.may_raise_sklearn_exception
+def eaurc(stats: BinnedStats) -> float:
+    err = np.sum(stats.n_incorrect) / np.sum(stats.n_total)
+    kappa_star_aurc = err + (1 - err) * (np.log(1 - err))
+    return aurc(stats) - kappa_star_aurc * metrics.AURC_DISPLAY_SCALE
+
+
+@register_binned_metric_func("mce")
+@metrics.may_raise_sklearn_exception
+def maximum_calibration_error(stats: BinnedStats) -> float:
+    return stats.bin_discrepancies.max()
+
+
+@register_binned_metric_func("ece")
+@metrics.may_raise_sklearn_exception
+def expected_calibration_error(stats: BinnedStats) -> float:
+    prob_total, _, _ = stats.calibration_stats
+    return np.dot(stats.bin_discrepancies, prob_total)
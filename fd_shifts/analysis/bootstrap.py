@@ -0,0 +1,167 @@
+"""Bootstrap confidence intervals for failure-detection metrics.
+
+Resamples are drawn as one ``(n_bootstrap, n_samples)`` index matrix. Chunks of
+resamples are evaluated as columns of a confid matrix with the batched engine in
+:mod:`fd_shifts.analysis.batched_metrics`; metrics without a batched
+implementation fall back to their function in the ``register_metric_func``
+registry, one resample at a time.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Sequence
+
+import numpy as np
+import numpy.typing as npt
+
+from .batched_metrics import (
+    BatchedStatsCache,
+    get_batched_metric_function,
+    has_batched_metric_function,
+)
+from .metrics import StatsCache, get_metric_function, has_metric_function
+
+
+def is_bootstrap_metric(metric_name: str) -> bool:
+    return has_metric_function(metric_name)
+
+
+def ci_metric_names(query_metrics: Sequence[str]) -> list[str]:
+    """Names of the CI bound columns for all bootstrappable metrics in a query"""
+    return [
+        f"{metric}_ci_{bound}"
+        for metric in query_metrics
+        if is_bootstrap_metric(metric)
+        for bound in ("low", "high")
+    ]
+
+
+def draw_bootstrap_indices(
+    n_samples: int, n_bootstrap: int, seed: int | None = 0
+) -> npt.NDArray[np.int64]:
+    """Draw resamples with replacement as an ``(n_bootstrap, n_samples)`` matrix"""
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, n_samples, size=(n_bootstrap, n_samples))
+
+
+def _evaluate_chunk(
+    confids: npt.NDArray[Any],
+    correct: npt.NDArray[Any],
+    labels: npt.NDArray[Any] | None,
+    indices: npt.NDArray[np.int64],
+    query_metrics: Sequence[str],
+    n_bins: int,
+) -> dict[str, npt.NDArray[Any]]:
+    results = {}
+
+    batched = [m for m in query_metrics if has_batched_metric_function(m)]
+    if len(batched) > 0:
+        stats = BatchedStatsCache(confids[indices.T], correct[indices.T], n_bins)
+        for metric in batched:
+            results[metric] = get_batched_metric_function(metric)(stats)
+
+    for metric in query_metrics:
+        if metric in results:
+            continue
+        metric_func = get_metric_function(metric)
+        results[metric] = np.array(
+            [
+                metric_func(
+                    StatsCache(
+                        confids[idx],
+                        correct[idx],
+                        n_bins,
+                        labels[idx] if labels is not None else None,
+                    )
+                )
+                for idx in indices
+            ]
+        )
+
+    return results
+
+
+def bootstrap_metric_samples(
+    confids: npt.NDArray[Any],
+    correct: npt.NDArray[Any],
+    query_metrics: Sequence[str],
+    labels: npt.NDArray[Any] | None = None,
+    n_bootstrap: int = 1000,
+    n_bins: int = 20,
+    chunk_size: int = 100,
+    n_jobs: int | None = None,
+    seed: int | None = 0,
+) -> dict[str, npt.NDArray[Any]]:
+    """Evaluate metrics on bootstrap resamples.
+
+    Args:
+        confids (array_like): Confidence values
+        correct (array_like): Where predictions were correct
+        query_metrics: Registered metrics to evaluate
+        labels (array_like, optional): Class labels, needed for b-aurc
+        n_bootstrap (int): Number of resamples
+        n_bins (int): Number of calibration bins
+        chunk_size (int): Resamples evaluated together, bounds memory to
+            ``chunk_size * n_samples`` values per array
+        n_jobs (int, optional): Evaluate chunks in a process pool of this size
+        seed (int, optional): Seed for the resample indices
+
+    Returns:
+        one array of ``n_bootstrap`` metric values per metric
+    """
+    query_metrics = [m for m in query_metrics if is_bootstrap_metric(m)]
+    indices = draw_bootstrap_indices(len(confids), n_bootstrap, seed)
+    chunks = [
+        indices[start : start + chunk_size]
+        for start in range(0, n_bootstrap, chunk_size)
+    ]
+
+    def _args(chunk):
+        return confids, correct, labels, chunk, query_metrics, n_bins
+
+    if n_jobs is not None and n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            chunk_results = list(
+                executor.map(_evaluate_chunk, *zip(*[_args(c) for c in chunks]))
+            )
+    else:
+        chunk_results = [_evaluate_chunk(*_args(c)) for c in chunks]
+
+    return {
+        metric: np.concatenate([r[metric] for r in chunk_results])
+        for metric in query_metrics
+    }
+
+
+def percentile_ci(
+    samples: dict[str, npt.NDArray[Any]], confidence_level: float = 0.95
+) -> dict[str, float]:
+    """Percentile interval per metric as ``<metric>_ci_low``/``<metric>_ci_high``"""
+    alpha = (1 - confidence_level) / 2
+    cis = {}
+    for metric, values in samples.items():
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            low, high = np.nan, np.nan
+        else:
+            low, high = np.percentile(values, [alpha * 100, (1 - alpha) * 100])
+        cis[f"{metric}_ci_low"] = low
+        cis[f"{metric}_ci_high"] = high
+    return cis
+
+
+def bootstrap_ci(
+    confids: npt.NDArray[Any],
+    correct: npt.NDArray[Any],
+    query_metrics: Sequence[str],
+    labels: npt.NDArray[Any] | None = None,
+    n_bootstrap: int = 1000,
+    confidence_level: float = 0.95,
+    **kwargs,
+) -> dict[str, float]:
+    """Percentile bootstrap confidence intervals for failure-detection metrics"""
+    samples = bootstrap_metric_samples(
+        confids, correct, query_metrics, labels, n_bootstrap, **kwargs
+    )
+    return percentile_ci(samples, confidence_level)
@@ -1,4 +1,6 @@
-from typing import Any, Callable, TYPE_CHECKING
+from __future__ import annotations
+
+from typing import Any, Callable, Iterator, TYPE_CHECKING
 
 import numpy as np
 import numpy.typing as npt
@@ -18,11 +20,22 @@ def is_mcd_confid(name: str):
 
 
 _confid_funcs = {}
+_confid_features = {}
+
+
+def register_confid_func(name: str, feature: str | None = None) -> Callable:
+    """Register a confid function
 
+    Args:
+        name: Name of the confid
+        feature: Column of ``ExperimentData`` features holding the same
+            values, used instead of calling the function per study
+    """
 
-def register_confid_func(name: str) -> Callable:
     def _inner_wrapper(func: Callable) -> Callable:
         _confid_funcs[name] = func
+        if feature is not None:
+            _confid_features[name] = feature
         return func
 
     return _inner_wrapper
@@ -35,64 +48,200 @@ def get_confid_function(confid_name):
     return _confid_funcs[confid_name]
 
 
-@register_confid_func("det_mcp")
+def get_confid_feature(confid_name: str) -> str | None:
+    if is_external_confid(confid_name):
+        return None
+    return _confid_features.get(confid_name)
+
+
+def prediction_feature(confid_name: str) -> str:
+    return "mcd_predict" if is_mcd_confid(confid_name) else "det_predict"
+
+
+def softmax_features(
+    softmax: npt.NDArray[Any], prefix: str
+) -> dict[str, npt.NDArray[Any]]:
+    """Per-row features of a softmax matrix, computed together
+
+    Returns:
+        ``<prefix>mcp``, ``<prefix>predict``, ``<prefix>pe`` and
+        ``<prefix>margin`` (difference of the two largest probabilities)
+    """
+    softmax = np.asarray(softmax)
+    top = np.partition(softmax, softmax.shape[1] - 2, axis=1)[:, -2:]
+    return {
+        f"{prefix}mcp": top[:, 1],
+        f"{prefix}predict": np.argmax(softmax, axis=1),
+        f"{prefix}pe": predictive_entropy(softmax),
+        f"{prefix}margin": top[:, 1] - top[:, 0],
+    }
+
+
+SOFTMAX_FEATURES = ["det_mcp", "det_predict", "det_pe", "det_margin"]
+MCD_SOFTMAX_FEATURES = ["mcd_mcp", "mcd_predict", "mcd_pe", "mcd_margin"]
+
+
+@register_confid_func("det_mcp", feature="det_mcp")
 def maximum_softmax_probability(softmax: npt.NDArray[Any]) -> npt.NDArray[Any]:
     return np.max(softmax, axis=1)
 
 
-@register_confid_func("mcd_mcp")
+@register_confid_func("mcd_mcp", feature="mcd_mcp")
 def mcd_maximum_softmax_probability(
     softmax: npt.NDArray[Any], mcd_softmax_mean: npt.NDArray
 ) -> npt.NDArray[Any]:
     return maximum_softmax_probability(softmax)
 
 
-@register_confid_func("det_pe")
+@register_confid_func("det_pe", feature="det_pe")
 def predictive_entropy(softmax: npt.NDArray[Any]) -> npt.NDArray[Any]:
     return np.sum(softmax * (-np.log(softmax + 1e-7)), axis=1)
 
 
-@register_confid_func("mcd_pe")
+@register_confid_func("mcd_pe", feature="mcd_pe")
 def mcd_predictive_entropy(
     softmax: npt.NDArray[Any], mcd_softmax_mean: npt.NDArray
 ) -> npt.NDArray[Any]:
     return predictive_entropy(softmax)
 
 
-@register_confid_func("mcd_ee")
+@register_confid_func("det_margin", feature="det_margin")
+def softmax_margin(softmax: npt.NDArray[Any]) -> npt.NDArray[Any]:
+    top = np.partition(softmax, softmax.shape[1] - 2, axis=1)[:, -2:]
+    return top[:, 1] - top[:, 0]
+
+
+@register_confid_func("mcd_margin", feature="mcd_margin")
+def mcd_softmax_margin(
+    softmax: npt.NDArray[Any], mcd_softmax_mean: npt.NDArray
+) -> npt.NDArray[Any]:
+    return softmax_margin(softmax)
+
+
+MCD_DIST_CONFIDS = ["mcd_pe", "mcd_ee", "mcd_mi", "mcd_sv", "mcd_waic"]
+# the MCD features that need a pass over mcd_softmax_dist
+MCD_DIST_FEATURES = ["mcd_ee", "mcd_mi", "mcd_sv", "mcd_waic"]
+
+# values of mcd_softmax_dist per block, bounds the temporaries to a few 100MB
+MCD_BLOCK_VALUES = 2**24
+
+
+def dist_row_blocks(
+    mcd_softmax_dist: npt.NDArray[Any], block_size: int | None = None
+) -> Iterator[slice]:
+    """Slices of rows of the MCD distribution, ``MCD_BLOCK_VALUES`` values each"""
+    n_rows, n_classes, n_samples = mcd_softmax_dist.shape
+    if block_size is None:
+        block_size = max(1, MCD_BLOCK_VALUES // (n_classes * n_samples))
+    for start in range(0, n_rows, block_size):
+        yield slice(start, start + block_size)
+
+
+def mcd_dist_confids(
+    mcd_softmax_mean: npt.NDArray[Any],
+    mcd_softmax_dist: npt.NDArray[Any],
+    confids: list[str] | None = None,
+    block_size: int | None = None,
+    dtype: npt.DTypeLike | None = None,
+    zero_classes: list | None = None,
+) -> dict[str, npt.NDArray[Any]]:
+    """Compute confids of the MCD distribution in one pass over row blocks
+
+    Args:
+        mcd_softmax_mean (array_like): Softmax mean over MCD samples
+        mcd_softmax_dist (array_like): Softmax of all MCD samples,
+            ``(n, classes, samples)``, may be memory-mapped
+        confids: Subset of ``MCD_DIST_CONFIDS`` to compute, all by default
+        block_size (int, optional): Rows per block, by default chosen so a
+            block holds ``MCD_BLOCK_VALUES`` values
+        dtype (optional): Dtype to compute in, e.g. ``np.float32`` to halve
+            memory, the dtype of ``mcd_softmax_dist`` by default
+        zero_classes (list, optional): Indices on the last axis of
+            ``mcd_softmax_dist`` zeroed in each block, the array itself is
+            not written
+
+    Returns:
+        one array of confids per requested name
+    """
+    if confids is None:
+        confids = MCD_DIST_CONFIDS
+    n_rows = len(mcd_softmax_dist)
+    dtype = np.dtype(dtype or mcd_softmax_dist.dtype)
+
+    need_ee = "mcd_ee" in confids or "mcd_mi" in confids
+    need_pe = "mcd_pe" in confids or "mcd_mi" in confids
+    need_std = "mcd_sv" in confids
+
+    def load(rows):
+        dist = np.asarray(mcd_softmax_dist[rows], dtype=dtype)
+        if zero_classes is not None:
+            dist = np.array(dist)
+            dist[..., zero_classes] = 0
+        return dist
+
+    if "mcd_waic" in confids and n_rows > 0:
+        # np.take on the flattened std only ever indexes the first row
+        waic_std = np.std(load(slice(0, 1)), axis=2)[0]
+
+    out = {name: np.empty(n_rows, dtype=dtype) for name in confids}
+    for rows in dist_row_blocks(mcd_softmax_dist, block_size):
+        dist = load(rows)
+        mean = np.asarray(mcd_softmax_mean[rows], dtype=dtype)
+        block = {}
+
+        if need_ee:
+            # dist * -log(dist + eps) with a single temporary
+            tmp = dist + dtype.type(1e-7)
+            np.log(tmp, out=tmp)
+            tmp *= dist
+            block["mcd_ee"] = -np.mean(np.sum(tmp, axis=1), axis=1)
+            del tmp
+        if need_pe:
+            block["mcd_pe"] = predictive_entropy(mean)
+        if need_ee and need_pe:
+            block["mcd_mi"] = block["mcd_pe"] - block["mcd_ee"]
+        if need_std:
+            std = np.std(dist, axis=2)
+            block["mcd_sv"] = np.mean(std, axis=1)
+        if "mcd_waic" in confids:
+            block["mcd_waic"] = np.max(mean, axis=1) - np.take(
+                waic_std, np.argmax(mean, axis=1)
+            )
+
+        for name in confids:
+            out[name][rows] = block[name]
+
+    return out
+
+
+@register_confid_func("mcd_ee", feature="mcd_ee")
 def expected_entropy(
     mcd_softmax_mean: npt.NDArray[Any], mcd_softmax_dist: npt.NDArray[Any]
 ) -> npt.NDArray[Any]:
-    return np.mean(
-        np.sum(mcd_softmax_dist * (-np.log(mcd_softmax_dist + 1e-7)), axis=1),
-        axis=1,
-    )
+    return mcd_dist_confids(mcd_softmax_mean, mcd_softmax_dist, ["mcd_ee"])["mcd_ee"]
 
 
-@register_confid_func("mcd_mi")
+@register_confid_func("mcd_mi", feature="mcd_mi")
 def mutual_information(
     mcd_softmax_mean: npt.NDArray[Any], mcd_softmax_dist: npt.NDArray[Any]
 ) -> npt.NDArray[Any]:
-    return predictive_entropy(mcd_softmax_mean) - expected_entropy(
-        mcd_softmax_mean, mcd_softmax_dist
-    )
+    return mcd_dist_confids(mcd_softmax_mean, mcd_softmax_dist, ["mcd_mi"])["mcd_mi"]
 
 
-@register_confid_func("mcd_sv")
+@register_confid_func("mcd_sv", feature="mcd_sv")
 def softmax_variance(
     mcd_softmax_mean: npt.NDArray[Any], mcd_softmax_dist: npt.NDArray[Any]
 ) -> npt.NDArray[Any]:
-    return np.mean(np.std(mcd_softmax_dist, axis=2), axis=(1))
+    return mcd_dist_confids(mcd_softmax_mean, mcd_softmax_dist, ["mcd_sv"])["mcd_sv"]
 
 
-@register_confid_func("mcd_waic")
+@register_confid_func("mcd_waic", feature="mcd_waic")
 def mcd_waic(
     mcd_softmax_mean: npt.NDArray[Any], mcd_softmax_dist: npt.NDArray[Any]
 ) -> npt.NDArray[Any]:
-    return np.max(mcd_softmax_mean, axis=1) - np.take(
-        np.std(mcd_softmax_dist, axis=2),
-        np.argmax(mcd_softmax_mean, axis=1),
-    )
+    return mcd_dist_confids(mcd_softmax_mean, mcd_softmax_dist, ["mcd_waic"])[
+        "mcd_waic"
+    ]
 
 
 @register_confid_func("ext_waic")
@@ -176,15 +325,20 @@ class ConfidScore:
                 self.confid_args = (study_data.external_confids,)
 
         self.confid_func = get_confid_function(query_confid)
+        self.confid_feature = get_confid_feature(query_confid)
+        self.prediction_feature = prediction_feature(query_confid)
+        self.study_data = study_data
         self.analysis = analysis
 
     @property
     def confids(self) -> npt.NDArray[Any]:
+        if self.confid_feature is not None:
+            return self.study_data.feature(self.confid_feature)
         return self.confid_func(*self.confid_args)
 
     @property
     def predict(self) -> npt.NDArray[Any]:
-        return np.argmax(self.softmax, axis=1)
+        return self.study_data.feature(self.prediction_feature)
 
     @property
     def metrics(self) -> dict[Any, Any]:
@@ -1,19 +1,32 @@
-import math
+import json
 import os
+from pathlib import Path
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import scipy
-import seaborn
-import torch
-from sklearn import metrics as skm
 from sklearn.calibration import calibration_curve
-from torchmetrics import Metric
 
-from .metrics import StatsCache, get_metric_function
+from .metrics import (
+    StatsCache,
+    binomial_risk_bound,
+    get_metric_function,
+    rc_curve,
+    selective_risk_thresholds,
+)
 from . import logger
 
+# torch and the plotting libraries are imported where they are used, so the
+# analysis can be imported without paying for them
+
+
+def __getattr__(name):
+    if name == "BrierScore":
+        from .torch_metrics import BrierScore
+
+        return BrierScore
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 # BUG: Replace -1 as a failure marker
 # NOTE: Use NaN? Explicitly error? Clearer warning?
 
@@ -24,6 +37,43 @@ def get_tb_hparams(cf):
     return {k: v for k, v in hparams_collection.items() if k in cf.eval.tb_hparams}
 
 
+def _stacked_numpy(values):
+    """Host copy of a TensorBuffer or of a list of per-sample tensors"""
+    if isinstance(values, list):
+        import torch
+
+        return torch.stack(values, dim=0).cpu().data.numpy()
+    return values.numpy()
+
+
+def _is_uncertainty(confid_key, ext_confid_name):
+    """Scores that are high for uncertain predictions and get flipped"""
+    return any(cfd in confid_key for cfd in ["_pe", "_ee", "_mi", "_sv"]) or (
+        confid_key == "ext" and ext_confid_name == "bpd"
+    )
+
+
+def _sketch_metrics(confid_key, sketch, query_confid_metrics, ext_confid_name, bins):
+    """Metrics of a FailureSketch, normalized like the accumulated confids"""
+    from .binned_metrics import binned_metrics
+
+    stats = sketch.binned_stats(n_bins=bins)
+    out_metrics = {}
+    if confid_key == "ext" and ext_confid_name == "bpd":
+        out_metrics["bpd_mean"] = stats.mean_confid
+
+    if _is_uncertainty(confid_key, ext_confid_name):
+        stats = stats.normalized(flip=True)
+    if confid_key == "ext" and ext_confid_name == "maha":
+        stats = stats.normalized()
+    if confid_key == "ood_ext":
+        query_confid_metrics = ["failauc"]
+
+    for metric_key, metric in binned_metrics(stats, query_confid_metrics).items():
+        out_metrics[confid_key + "_" + metric_key] = metric
+    return out_metrics
+
+
 def monitor_eval(
     running_confid_stats,
     running_perf_stats,
@@ -31,7 +81,15 @@ def monitor_eval(
     query_monitor_plots,
     do_plot=True,
     ext_confid_name=None,
+    render_plots=True,
 ):
+    """Monitor metrics and plots of the accumulated confids of an epoch
+
+    With ``render_plots=False`` the plots are returned as the keyword arguments
+    of :func:`render_monitor_plot` instead, plain host data that can be
+    rendered later or on another thread.
+    """
+    import torch
 
     out_metrics = {}
     out_plots = {}
@@ -44,16 +102,28 @@ def monitor_eval(
     cpu_confid_stats = {}
 
     for confid_key, confid_dict in running_confid_stats.items():
+        if "sketch" in confid_dict:
+            # online metrics, there are no per-sample confids to plot
+            if len(confid_dict["sketch"]) > 0:
+                out_metrics.update(
+                    _sketch_metrics(
+                        confid_key,
+                        confid_dict["sketch"],
+                        query_confid_metrics,
+                        ext_confid_name,
+                        bins,
+                    )
+                )
+            continue
+
         if len(confid_dict["confids"]) > 0:
-            confids_cpu = torch.stack(confid_dict["confids"], dim=0).cpu().data.numpy()
-            correct_cpu = torch.stack(confid_dict["correct"], dim=0).cpu().data.numpy()
+            confids_cpu = _stacked_numpy(confid_dict["confids"])
+            correct_cpu = _stacked_numpy(confid_dict["correct"])
 
             if confid_key == "ext" and ext_confid_name == "bpd":
                 out_metrics["bpd_mean"] = np.mean(confids_cpu)
 
-            if any(cfd in confid_key for cfd in ["_pe", "_ee", "_mi", "_sv"]) or (
-                confid_key == "ext" and ext_confid_name == "bpd"
-            ):
+            if _is_uncertainty(confid_key, ext_confid_name):
                 min_confid = np.min(confids_cpu)
                 max_confid = np.max(confids_cpu)
                 confids_cpu = 1 - (
@@ -90,31 +160,61 @@ def monitor_eval(
             cpu_confid_stats[confid_key]["correct"] = correct_cpu
 
     if do_plot and len(cpu_confid_stats) > 0:
-        plotter = ConfidPlotter(
-            input_dict=cpu_confid_stats,
-            query_plots=query_monitor_plots,
-            bins=20,
-            performance_metrics=out_metrics,
+        # here, render_monitor_plot may run on another thread
+        set_plot_style()
+        plot_inputs = {
+            "confid_stats": cpu_confid_stats,
+            "query_plots": query_monitor_plots,
+            "metrics": dict(out_metrics),
+            "n_total": correct_cpu.size,
+            "n_correct": np.sum(correct_cpu),
+        }
+        out_plots["default_plot"] = (
+            render_monitor_plot(**plot_inputs) if render_plots else plot_inputs
         )
 
-        f = plotter.compose_plot()
-        total = correct_cpu.size
-        correct = np.sum(correct_cpu)
-        title_string = "total: {}, corr.:{}, incorr.:{} \n".format(
-            total, correct, total - correct
-        )
+    # print(out_metrics)
+    return out_metrics, out_plots
 
-        for ix, (k, v) in enumerate(out_metrics.items()):
-            title_string += "{}: {:.3f} ".format(k, v)
-            if (ix % 5) == 0 and ix > 0:
-                title_string += "\n"
-        f.suptitle(title_string)
-        f.tight_layout()
 
-        out_plots["default_plot"] = f
+def render_monitor_plot(confid_stats, query_plots, metrics, n_total, n_correct):
+    """Figure of the monitor plots, titled with the sample counts and metrics
 
-    # print(out_metrics)
-    return out_metrics, out_plots
+    The figure is not registered with pyplot and no global style is set, so it
+    can be rendered on a background thread once :func:`set_plot_style` ran on
+    the main thread.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    plotter = ConfidPlotter(
+        input_dict=confid_stats,
+        query_plots=query_plots,
+        bins=20,
+        performance_metrics=metrics,
+    )
+
+    f = Figure()
+    FigureCanvasAgg(f)
+    plotter.compose_plot(f, apply_style=False)
+    title_string = "total: {}, corr.:{}, incorr.:{} \n".format(
+        n_total, n_correct, n_total - n_correct
+    )
+
+    for ix, (k, v) in enumerate(metrics.items()):
+        title_string += "{}: {:.3f} ".format(k, v)
+        if (ix % 5) == 0 and ix > 0:
+            title_string += "\n"
+    f.suptitle(title_string)
+    f.tight_layout()
+    return f
+
+
+def set_plot_style(fig_scale=1):
+    """Set the seaborn style of the plots, this changes matplotlib's rcParams"""
+    import seaborn
+
+    seaborn.set(font_scale=fig_scale, style="whitegrid")
 
 
 class ConfidEvaluator:
@@ -173,8 +273,7 @@ class ConfidEvaluator:
                 out_metrics["e-aurc"] = get_metric_function("e-aurc")(self.stats_cache)
 
             if "risk@95cov" in self.query_metrics:
-                coverages = np.array(self.rc_curve[0])
-                risks = np.array(self.rc_curve[1])
+                coverages, risks = self.rc_curve
                 out_metrics["risk@100cov"] = (
                     np.min(risks[np.argwhere(coverages >= 1)]) * 100
                 )
@@ -237,8 +336,8 @@ class ConfidEvaluator:
         if "rc_curve" in self.query_plots:
             if self.rc_curve is None:
                 self.get_rc_curve_stats()
-            plot_stats_dict["coverage_list"] = np.array(self.rc_curve[0])
-            plot_stats_dict["selective_risk_list"] = np.array(self.rc_curve[1])
+            plot_stats_dict["coverage_list"] = self.rc_curve[0]
+            plot_stats_dict["selective_risk_list"] = self.rc_curve[1]
 
         if "prc_curve" in self.query_plots:
             if self.precision_list is None:
@@ -250,7 +349,7 @@ class ConfidEvaluator:
 
     def get_roc_curve_stats(self):
         try:
-            self.fpr_list, self.tpr_list, _ = skm.roc_curve(self.correct, self.confids)
+            self.fpr_list, self.tpr_list = self.stats_cache.roc_curve_stats
         except:
             logger.debug(
                 "FAIL CHECK\n{}\n{}\n{}\n{}\n{}\n{}",
@@ -263,14 +362,11 @@ class ConfidEvaluator:
             )
 
     def get_rc_curve_stats(self):
-        self.rc_curve, self.aurc, self.eaurc = RC_curve(
-            (1 - self.correct), self.confids
-        )
+        coverages, risks, _ = self.stats_cache.rc_curve_stats
+        self.rc_curve = (coverages, risks)
 
     def get_err_prc_curve_stats(self):
-        self.precision_list, self.recall_list, _ = skm.precision_recall_curve(
-            self.correct, -self.confids, pos_label=0
-        )
+        self.precision_list, self.recall_list = self.stats_cache.err_prc_curve_stats
 
     def get_calibration_stats(self):
         calib_confids = np.clip(self.confids, 0, 1)  # necessary for waic
@@ -279,78 +375,66 @@ class ConfidEvaluator:
         )
 
     def calculate_bound(self, delta, m, erm):
-        # This function is a solver for the inverse of binomial CDF based on binary search.
-        precision = 1e-9
-
-        def func(b):
-            return (-1 * delta) + scipy.stats.binom.cdf(int(m * erm), m, b)
-
-        a = erm  # start binary search from the empirical risk
-        c = 1  # the upper bound is 1
-        b = (a + c) / 2  # mid point
-        funcval = func(b)
-        while abs(funcval) > precision:
-            if a == 1.0 and c == 1.0:
-                b = 1.0
-                break
-            elif funcval > 0:
-                a = b
-            else:
-                c = b
-            b = (a + c) / 2
-            funcval = func(b)
-        return b
+        # Inverse of the binomial CDF in closed form, see binomial_risk_bound.
+        return float(binomial_risk_bound(delta, m, erm))
 
     def get_val_risk_scores(self, rstar, delta, no_bound_mode=False):
         # A function to calculate the risk bound proposed in the paper, the algorithm is based on algorithm 1 from the paper.
         # Input: rstar - the requested risk bound
-        #       delta - the desired delta
+        #       delta - the desired delta, or a list of deltas
         #       kappa - rating function over the points (higher values is more confident prediction)
         #       residuals - a vector of the residuals of the samples 0 is correct prediction and 1 corresponding to an error
-        #       split - is a boolean controls whether to split train and test
-        # Output - [theta, bound] (also prints latex text for the tables in the paper)
-
-        val_risk_scores = {}
-        probs = self.confids
-        FY = 1 - self.correct
-
-        m = len(FY)
-
-        probs_idx_sorted = np.argsort(probs)
-
-        a = 0
-        b = m - 1
-        deltahat = delta / math.ceil(math.log2(m))
-
-        for q in range(math.ceil(math.log2(m)) + 1):
-            # the for runs log(m)+1 iterations but actually the bound calculated on only log(m) different candidate thetas
-            mid = math.ceil((a + b) / 2)
-
-            mi = len(FY[probs_idx_sorted[mid:]])
-            theta = probs[probs_idx_sorted[mid]]
-            risk = sum(FY[probs_idx_sorted[mid:]]) / mi
-            bound = self.calculate_bound(deltahat, mi, risk)
-            coverage = mi / m
-            if no_bound_mode:
-                bound = risk
-            if bound > rstar:
-                a = mid
-            else:
-                b = mid
-
-        val_risk_scores["val_risk"] = risk
-        val_risk_scores["val_cov"] = coverage
-        val_risk_scores["theta"] = theta
-        logger.debug(
-            "STRAIGHT FROM THRESH CALCULATION\n{}\n{}\n{}\n{}\n{}\n{}",
-            risk,
-            coverage,
-            theta,
+        # Output - dict with theta, val_risk and val_cov, or a list of these dicts if delta is a list
+
+        thresholds = selective_risk_thresholds(
+            self.confids,
+            1 - self.correct,
             rstar,
             delta,
-            bound,
+            no_bound_mode=no_bound_mode,
+            idx_sorted=self.stats_cache.idx_sorted,
         )
-        return val_risk_scores
+
+        val_risk_scores_per_delta = []
+        for ix, delta_ in enumerate(np.atleast_1d(delta)):
+            val_risk_scores = {}
+            val_risk_scores["val_risk"] = thresholds["val_risk"][ix]
+            val_risk_scores["val_cov"] = thresholds["val_cov"][ix]
+            val_risk_scores["theta"] = thresholds["theta"][ix]
+            logger.debug(
+                "STRAIGHT FROM THRESH CALCULATION\n{}\n{}\n{}\n{}\n{}\n{}",
+                val_risk_scores["val_risk"],
+                val_risk_scores["val_cov"],
+                val_risk_scores["theta"],
+                rstar,
+                delta_,
+                thresholds["bound"][ix],
+            )
+            val_risk_scores_per_delta.append(val_risk_scores)
+
+        if np.ndim(delta) == 0:
+            return val_risk_scores_per_delta[0]
+        return val_risk_scores_per_delta
+
+
+def hist_plot_stats(confids, correct, bins, custom_range=False):
+    """Histograms and summary stats of the confids of correct and incorrect
+    predictions, all plot_hist_per_confid draws
+
+    Args:
+        custom_range (bool): Bin between the smallest and largest confid
+            instead of over ``[0, 1]``
+    """
+    hist_range = (np.min(confids), np.max(confids)) if custom_range else (0, 1)
+    stats = {"n_total": correct.size, "n_correct": correct.sum()}
+    for name, is_correct in [("correct", 1), ("incorrect", 0)]:
+        values = confids[correct == is_correct]
+        stats[f"hist_{name}"], stats["hist_edges"] = np.histogram(
+            values, bins=bins, range=hist_range
+        )
+        stats[f"{name}_mean"] = np.mean(values)
+        stats[f"{name}_median"] = np.median(values)
+    return stats
 
 
 class ConfidPlotter:
@@ -381,9 +465,10 @@ class ConfidPlotter:
 
         for confid_key, confid_dict in self.input_dict.items():
             self.confid_keys_list.append(confid_key)
-            self.confids_list.append(confid_dict["confids"])
+            # persisted plot stats only hold the histograms of the confids
+            self.confids_list.append(confid_dict.get("confids"))
             self.metrics_list.append(confid_dict["metrics"])
-            self.correct_list.append(confid_dict["correct"])
+            self.correct_list.append(confid_dict.get("correct"))
 
         if "hist_per_confid" in self.query_plots:
             self.query_plots = [x for x in self.query_plots if x != "hist_per_confid"]
@@ -392,17 +477,30 @@ class ConfidPlotter:
         self.num_plots = len(self.query_plots)
         self.threshold = None
 
-    def compose_plot(self):
-        seaborn.set(font_scale=self.fig_scale, style="whitegrid")
+    def compose_plot(self, f=None, apply_style=True):
+        """Compose the master plot, optionally into an existing figure
+
+        Passing a figure clears and reuses it, which avoids building a new
+        figure per plot when rendering many of them. ``apply_style=False``
+        leaves matplotlib's global style as it is.
+        """
+        import seaborn
+
+        if apply_style:
+            set_plot_style(self.fig_scale)
         self.colors_list = seaborn.hls_palette(len(self.confid_keys_list)).as_hex()
         n_columns = 2
         n_rows = int(np.ceil(self.num_plots / n_columns))
         n_columns += 1
-        f, axs = plt.subplots(
-            nrows=n_rows,
-            ncols=n_columns,
-            figsize=(5 * n_columns * self.fig_scale, 3 * n_rows * self.fig_scale),
-        )
+        figsize = (5 * n_columns * self.fig_scale, 3 * n_rows * self.fig_scale)
+        if f is None:
+            import matplotlib.pyplot as plt
+
+            f, axs = plt.subplots(nrows=n_rows, ncols=n_columns, figsize=figsize)
+        else:
+            f.clf()
+            f.set_size_inches(*figsize)
+            axs = f.subplots(nrows=n_rows, ncols=n_columns)
         plot_ix = 0
         for ix in range(len(f.axes)):
 
@@ -440,55 +538,45 @@ class ConfidPlotter:
 
     def plot_hist_per_confid(self, confid_key):
         min_plot_x = 0
-        confids = self.confids_list[self.confid_keys_list.index(confid_key)]
-        correct = self.correct_list[self.confid_keys_list.index(confid_key)]
-
-        if confid_key == "ood_ext" or self.threshold is not None:
-            custom_range = (np.min(confids), np.max(confids))
-            (n_correct, binsc, patchesc) = self.ax.hist(
-                confids[np.argwhere(correct == 1)],
-                color="g",
-                bins=self.bins,
-                range=custom_range,
-                alpha=0.3,
-                label="correct",
+        confid_dict = self.input_dict[confid_key]
+        custom_range = confid_key == "ood_ext" or self.threshold is not None
+        stats = confid_dict.get("hist_stats")
+        if stats is None:
+            stats = hist_plot_stats(
+                confid_dict["confids"], confid_dict["correct"], self.bins, custom_range
             )
 
-            (n_incorrect, bins, patches) = self.ax.hist(
-                confids[np.argwhere(correct == 0)],
-                color="r",
-                bins=self.bins,
-                range=custom_range,
-                alpha=0.3,
-                label="incorrect",
-            )
-        else:
-            (n_correct, binsc, patchesc) = self.ax.hist(
-                confids[np.argwhere(correct == 1)],
-                color="g",
-                bins=self.bins,
-                range=(min_plot_x, 1),
-                width=0.9 * (1 - min_plot_x) / (self.bins),
-                alpha=0.3,
-                label="correct",
-            )
+        # the histograms are drawn from their counts, one weighted sample per bin
+        edges = stats["hist_edges"]
+        bar_kwargs = (
+            {} if custom_range else {"width": 0.9 * (1 - min_plot_x) / (self.bins)}
+        )
+        (n_correct, binsc, patchesc) = self.ax.hist(
+            edges[:-1],
+            weights=stats["hist_correct"],
+            color="g",
+            bins=edges,
+            alpha=0.3,
+            label="correct",
+            **bar_kwargs,
+        )
 
-            (n_incorrect, bins, patches) = self.ax.hist(
-                confids[np.argwhere(correct == 0)],
-                color="r",
-                bins=self.bins,
-                range=(min_plot_x, 1),
-                width=0.9 * (1 - min_plot_x) / (self.bins),
-                alpha=0.3,
-                label="incorrect",
-            )
+        (n_incorrect, bins, patches) = self.ax.hist(
+            edges[:-1],
+            weights=stats["hist_incorrect"],
+            color="r",
+            bins=edges,
+            alpha=0.3,
+            label="incorrect",
+            **bar_kwargs,
+        )
 
         max_y_data = np.max([np.max(n_correct), np.max(n_incorrect)])
         if not confid_key == "ood_ext":
             self.ax.set_xlim(min_plot_x - 0.1, 1.1)
             self.ax.set_ylim(0.1, max_y_data)
         self.ax.vlines(
-            np.mean(confids[np.argwhere(correct == 0)]),
+            stats["incorrect_mean"],
             ymin=0,
             ymax=max_y_data,
             color="r",
@@ -496,7 +584,7 @@ class ConfidPlotter:
             label="incorrect mean",
         )
         self.ax.vlines(
-            np.median(confids[np.argwhere(correct == 0)]),
+            stats["incorrect_median"],
             ymin=0,
             ymax=max_y_data,
             color="r",
@@ -504,7 +592,7 @@ class ConfidPlotter:
             label="incorrect median",
         )
         self.ax.vlines(
-            np.mean(confids[np.argwhere(correct == 1)]),
+            stats["correct_mean"],
             ymin=0,
             ymax=max_y_data,
             color="g",
@@ -512,7 +600,7 @@ class ConfidPlotter:
             label="correct mean",
         )
         self.ax.vlines(
-            np.median(confids[np.argwhere(correct == 1)]),
+            stats["correct_median"],
             ymin=0,
             ymax=max_y_data,
             color="g",
@@ -534,7 +622,7 @@ class ConfidPlotter:
         self.ax.set_xlabel("Confid")
         title_string = confid_key
         title_string += " (incorr.:{}, tot:{})".format(
-            correct.size - correct.sum(), correct.size
+            stats["n_total"] - stats["n_correct"], stats["n_total"]
         )
         self.ax.set_title("{}".format(title_string))
 
@@ -673,39 +761,107 @@ class ConfidPlotter:
         self.ax.set_xlabel("Coverage")
 
 
+# points kept of every persisted curve, plenty for a line plot
+PLOT_STATS_CURVE_POINTS = 2000
+
+
+def _thin_curve(values, n_points=PLOT_STATS_CURVE_POINTS):
+    """Evenly spaced points of a curve, always keeping both ends
+
+    Paired curve arrays have the same length and so keep the same points.
+    """
+    if len(values) <= n_points:
+        return values
+    return values[np.linspace(0, len(values) - 1, n_points).round().astype(int)]
+
+
+def save_plot_stats(path, input_dict, query_plots, bins):
+    """Persist what ConfidPlotter needs to render a master plot later
+
+    Only histograms of the confids and thinned curves are stored, so the
+    stats stay small however many samples a study has.
+    """
+    arrays = {}
+    for confid_key, confid_dict in input_dict.items():
+        hist_stats = hist_plot_stats(
+            confid_dict["confids"],
+            confid_dict["correct"],
+            bins,
+            custom_range=confid_key == "ood_ext",
+        )
+        for name, stat in hist_stats.items():
+            arrays[f"{confid_key}/hist_stats/{name}"] = stat
+        for name, stat in confid_dict["plot_stats"].items():
+            arrays[f"{confid_key}/plot_stats/{name}"] = _thin_curve(np.asarray(stat))
+
+    meta = {
+        "confid_keys": list(input_dict.keys()),
+        "query_plots": list(query_plots),
+        "bins": bins,
+        "metrics": {k: dict(v["metrics"]) for k, v in input_dict.items()},
+    }
+    np.savez_compressed(
+        path, __meta__=np.array(json.dumps(meta, default=float)), **arrays
+    )
+
+
+def load_plot_stats(path):
+    """Load plot stats written by save_plot_stats
+
+    Returns:
+        ConfidPlotter input dict, query plots and number of calibration bins
+    """
+
+    def _group(npz, prefix):
+        return {
+            key[len(prefix) :]: npz[key] for key in npz.files if key.startswith(prefix)
+        }
+
+    with np.load(path) as npz:
+        meta = json.loads(str(npz["__meta__"]))
+        input_dict = {
+            confid_key: {
+                "metrics": meta["metrics"][confid_key],
+                "hist_stats": _group(npz, f"{confid_key}/hist_stats/"),
+                "plot_stats": _group(npz, f"{confid_key}/plot_stats/"),
+            }
+            for confid_key in meta["confid_keys"]
+        }
+
+    return input_dict, meta["query_plots"], meta["bins"]
+
+
+def render_master_plots(plot_stats_paths, fig_scale=1):
+    """Render master plots from persisted plot stats, reusing one Agg figure
+
+    Each ``plot_stats_<study>.npz`` is rendered to ``master_plot_<study>.png``
+    next to it.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    f = Figure()
+    FigureCanvasAgg(f)
+    for path in plot_stats_paths:
+        path = Path(path)
+        input_dict, query_plots, bins = load_plot_stats(path)
+        plotter = ConfidPlotter(input_dict, query_plots, bins, fig_scale=fig_scale)
+        plotter.compose_plot(f)
+        out_path = path.with_name(
+            path.name.replace("plot_stats_", "master_plot_", 1)
+        ).with_suffix(".png")
+        f.savefig(out_path)
+        logger.debug("saved masterplot to {}", out_path)
+
+
 def RC_curve(residuals, confidence):
-    coverages = []
-    risks = []
-    n = len(residuals)
-    idx_sorted = np.argsort(confidence)
-    cov = n
-    error_sum = sum(residuals[idx_sorted])
-    coverages.append(cov / n),
-    risks.append(error_sum / n)
-    weights = []
-    tmp_weight = 0
-    for i in range(0, len(idx_sorted) - 1):
-        cov = cov - 1
-        error_sum = error_sum - residuals[idx_sorted[i]]
-        selective_risk = error_sum / (n - 1 - i)
-        tmp_weight += 1
-        if i == 0 or confidence[idx_sorted[i]] != confidence[idx_sorted[i - 1]]:
-            coverages.append(cov / n)
-            risks.append(selective_risk)
-            weights.append(tmp_weight / n)
-            tmp_weight = 0
-
-    # add a well-defined final point to the RC-curve.
-    if tmp_weight > 0:
-        coverages.append(0)
-        risks.append(risks[-1])
-        weights.append(tmp_weight / n)
+    coverages, risks, weights = rc_curve(confidence, residuals)
 
     # aurc is computed as a weighted average over risk scores analogously to the average precision score.
-    aurc = sum([a * w for a, w in zip(risks, weights)])
+    aurc = np.sum(risks[:-1] * weights)
 
     # TODO: Switch to new aurc calculation
-    # aurc = sum([(risks[i] + risks[i+1]) * 0.5 * weights[i] for i in range(len(weights)) ])
+    # aurc = area_under_rc_curve(risks, weights)
 
     # compute e-aurc
     err = np.mean(residuals)
@@ -716,32 +872,6 @@ def RC_curve(residuals, confidence):
     return curve, aurc, e_aurc
 
 
-class BrierScore(Metric):
-    def __init__(self, num_classes, dist_sync_on_step=False):
-        # call `self.add_state`for every internal state that is needed for the metrics computations
-        # dist_reduce_fx indicates the function that should be used to reduce
-        # state from multiple processes
-        super().__init__(dist_sync_on_step=dist_sync_on_step)
-
-        self.num_classes = num_classes
-        self.add_state("brier_score", default=torch.tensor(0.0), dist_reduce_fx="sum")
-        self.add_state("total", default=torch.tensor(0), dist_reduce_fx="sum")
-
-    def update(self, preds: torch.Tensor, target: torch.Tensor):
-        # update metric states
-        #      preds, target = self._input_format(preds, target)
-
-        y_one_hot = torch.nn.functional.one_hot(target, num_classes=self.num_classes)
-        assert preds.shape == y_one_hot.shape
-
-        self.brier_score += ((preds - y_one_hot) ** 2).sum(1).mean()
-        self.total += 1
-
-    def compute(self):
-        # compute final result
-        return self.brier_score.float() / self.total
-
-
 def clean_logging(log_dir):
     try:
         df = pd.read_csv(os.path.join(log_dir, "metrics.csv"))
@@ -753,6 +883,8 @@ def clean_logging(log_dir):
 
 def plot_input_imgs(x, y, out_path):
 
+    import matplotlib.pyplot as plt
+
     logger.debug(
         "{}\n{}\n{}\n{}",
         x.mean().item(),
@@ -773,6 +905,8 @@ def plot_input_imgs(x, y, out_path):
 
 def qual_plot(fp_dict, fn_dict, out_path):
 
+    import matplotlib.pyplot as plt
+
     n_rows = len(fp_dict["images"])
     f, axs = plt.subplots(nrows=n_rows, ncols=2, figsize=(6, 13))
     title_pad = 0.85
@@ -808,6 +942,8 @@ def qual_plot(fp_dict, fn_dict, out_path):
 
 def ThresholdPlot(plot_dict):
 
+    import matplotlib.pyplot as plt
+
     scale = 10
     n_cols = len(plot_dict)
     n_rows = 1
@@ -0,0 +1,142 @@
+"""Manifest of what an analysis computed, used to skip up-to-date work.
+
+The manifest lives next to the analysis outputs and records the size and
+modification time of the raw test outputs, a hash of the config sections the
+results depend on and, per study, the metrics that were computed. An analysis
+whose inputs and config are unchanged only needs to compute the metrics a
+study is missing. Inputs are only content-hashed once their size or
+modification time changed, so a touched but identical file can be told apart
+from a changed one the next time around.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Sequence
+
+from omegaconf import DictConfig, ListConfig, OmegaConf
+
+MANIFEST_NAME = "analysis_manifest.json"
+INPUT_FILES = [
+    f"{name}{suffix}"
+    for name in [
+        "raw_output",
+        "raw_output_dist",
+        "external_confids",
+        "external_confids_dist",
+    ]
+    for suffix in [".npy", ".npz"]
+]
+
+
+def file_digest(path: Path, chunk_size: int = 2**24) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def config_digest(config: DictConfig | ListConfig, **settings: Any) -> str:
+    """Hash the config sections and analysis settings results depend on"""
+    sections = {
+        "confids": config.eval.confidence_measures.test,
+        "query_studies": config.eval.query_studies,
+        "val_tuning": config.eval.val_tuning,
+        "r_star": config.eval.get("r_star"),
+        "r_delta": config.eval.get("r_delta"),
+        "ext_confid_name": config.eval.get("ext_confid_name"),
+        "num_classes": config.data.num_classes,
+        "data_kwargs": config.data.get("kwargs"),
+        "model": config.model.name,
+        "fold": config.exp.fold,
+    }
+    content = {
+        # unresolved, env interpolations may not be resolvable here
+        k: OmegaConf.to_container(v) if OmegaConf.is_config(v) else v
+        for k, v in sections.items()
+    }
+    content.update(settings)
+    return hashlib.sha256(
+        json.dumps(content, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def _same_key(a: dict[str, Any], b: dict[str, Any]) -> bool:
+    return a["size"] == b["size"] and a["mtime"] == b["mtime"]
+
+
+def _same_file(a: dict[str, Any], b: dict[str, Any]) -> bool:
+    """Compare content hashes where both are known, else size and mtime"""
+    if "sha256" in a and "sha256" in b:
+        return a["sha256"] == b["sha256"]
+    return _same_key(a, b)
+
+
+@dataclass
+class AnalysisManifest:
+    inputs: dict[str, dict[str, Any]]
+    config: str
+    studies: dict[str, list[str]] = field(default_factory=dict)
+
+    @staticmethod
+    def load(path: Path) -> AnalysisManifest | None:
+        if not path.is_file():
+            return None
+        with open(path) as f:
+            return AnalysisManifest(**json.load(f))
+
+    def save(self, path: Path):
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(asdict(self), f, indent=2)
+        tmp_path.replace(path)
+
+    @staticmethod
+    def from_experiment(
+        test_dir: Path, config_hash: str, previous: AnalysisManifest | None = None
+    ) -> AnalysisManifest:
+        """Describe the current inputs of an analysis
+
+        Files are only hashed when their size or modification time differs
+        from the previous manifest, never on a first run.
+        """
+        inputs = {}
+        for name in INPUT_FILES:
+            path = test_dir / name
+            if not path.is_file():
+                continue
+            stat = path.stat()
+            entry = {"size": stat.st_size, "mtime": stat.st_mtime}
+            known = previous.inputs.get(name) if previous is not None else None
+            if known is not None and _same_key(known, entry):
+                entry = dict(known)
+            elif known is not None:
+                entry["sha256"] = file_digest(path)
+            inputs[name] = entry
+
+        manifest = AnalysisManifest(inputs, config_hash)
+        if previous is not None and previous.has_same_inputs(manifest):
+            manifest.studies = previous.studies
+        return manifest
+
+    def has_same_inputs(self, other: AnalysisManifest) -> bool:
+        return (
+            self.config == other.config
+            and self.inputs.keys() == other.inputs.keys()
+            and all(
+                _same_file(entry, other.inputs[name])
+                for name, entry in self.inputs.items()
+            )
+        )
+
+    def missing_metrics(self, study_name: str, metrics: Sequence[str]) -> list[str]:
+        """Metrics of a study that still have to be computed"""
+        computed = self.studies.get(study_name, [])
+        return [m for m in metrics if m not in computed]
+
+    def record_study(self, study_name: str, metrics: Sequence[str]):
+        self.studies[study_name] = list(metrics)
@@ -1,12 +1,14 @@
 from __future__ import annotations
 
 import logging
+import math
 from dataclasses import dataclass
 from functools import cached_property
 from typing import Any, Callable, TypeVar, cast
 
 import numpy as np
 import numpy.typing as npt
+from scipy import special
 from sklearn import calibration as skc
 from sklearn import metrics as skm
 from sklearn import preprocessing as skp
@@ -34,9 +36,307 @@ def may_raise_sklearn_exception(func: Callable[P, T]) -> Callable[P, T]:
     return _inner_wrapper
 
 
+def _rc_curve_points(
+    sorted_confids: npt.NDArray[Any],
+    initial_risk: float,
+    step_risks: npt.NDArray[Any],
+) -> tuple[npt.NDArray[Any], npt.NDArray[Any], npt.NDArray[Any]]:
+    """Reduce per-removal-step risks to the points of a risk-coverage curve.
+
+    Samples are removed in order of ascending confidence. A curve point is
+    recorded after removing the first sample of every group of tied confids,
+    the weight of a point is the fraction of samples removed since the previous
+    point.
+
+    Args:
+        sorted_confids (array_like): Confidence values in ascending order
+        initial_risk (float): Risk at full coverage
+        step_risks (array_like): Risk after removing the ``i + 1`` least
+            confident samples, for all but the last sample
+
+    Returns:
+        coverages, risks and weights of the curve
+    """
+    n_samples = len(sorted_confids)
+    coverages = np.array([1.0])
+    risks = np.array([initial_risk])
+    weights = np.array([], dtype=np.float64)
+    if n_samples < 2:
+        return coverages, risks, weights
+
+    is_group_start = np.ones(n_samples - 1, dtype=bool)
+    is_group_start[1:] = sorted_confids[1:-1] != sorted_confids[:-2]
+    steps = np.flatnonzero(is_group_start)
+
+    coverages = np.concatenate([coverages, (n_samples - 1 - steps) / n_samples])
+    risks = np.concatenate([risks, step_risks[steps]])
+    weights = np.diff(steps, prepend=-1) / n_samples
+
+    # add a well-defined final point to the RC-curve.
+    tail_weight = n_samples - 2 - steps[-1]
+    if tail_weight > 0:
+        coverages = np.append(coverages, 0)
+        risks = np.append(risks, risks[-1])
+        weights = np.append(weights, tail_weight / n_samples)
+
+    return coverages, risks, weights
+
+
+def rc_curve(
+    confids: npt.NDArray[Any],
+    residuals: npt.NDArray[Any],
+    idx_sorted: npt.NDArray[Any] | None = None,
+) -> tuple[npt.NDArray[Any], npt.NDArray[Any], npt.NDArray[Any]]:
+    """Compute the risk-coverage curve with a single sort and cumulative sums.
+
+    Args:
+        confids (array_like): Confidence values
+        residuals (array_like): 1 where the prediction is wrong, 0 otherwise
+        idx_sorted (array_like, optional): Precomputed ascending argsort of confids
+
+    Returns:
+        coverages, risks and weights of the curve
+    """
+    n_residuals = len(residuals)
+    if idx_sorted is None:
+        idx_sorted = np.argsort(confids)
+    sorted_residuals = residuals[idx_sorted]
+
+    error_sum = np.sum(sorted_residuals)
+    # errors and samples remaining after each removal step
+    remaining_errors = error_sum - np.cumsum(sorted_residuals[:-1])
+    n_remaining = np.arange(n_residuals - 1, 0, -1)
+
+    return _rc_curve_points(
+        confids[idx_sorted], error_sum / n_residuals, remaining_errors / n_remaining
+    )
+
+
+def brc_curve(
+    confids: npt.NDArray[Any],
+    residuals: npt.NDArray[Any],
+    labels: npt.NDArray[Any],
+    idx_sorted: npt.NDArray[Any] | None = None,
+) -> tuple[npt.NDArray[Any], npt.NDArray[Any], npt.NDArray[Any]]:
+    """Compute the balanced risk-coverage curve with per-class cumulative sums.
+
+    The balanced risk is the mean risk over all classes that still have samples
+    left. Every removal step only changes the risk of the class of the removed
+    sample, so the sum over class risks is tracked as a cumulative sum of these
+    changes instead of re-averaging all classes per step.
+
+    Args:
+        confids (array_like): Confidence values
+        residuals (array_like): 1 where the prediction is wrong, 0 otherwise
+        labels (array_like): Class label per sample
+        idx_sorted (array_like, optional): Precomputed ascending argsort of confids
+
+    Returns:
+        coverages, balanced risks and weights of the curve
+    """
+    if idx_sorted is None:
+        idx_sorted = np.argsort(confids)
+    classes, class_idx = np.unique(labels, return_inverse=True)
+    class_idx = class_idx.reshape(-1)
+    n_per_class = np.bincount(class_idx, minlength=len(classes))
+    errors_per_class = np.bincount(class_idx, weights=residuals, minlength=len(classes))
+    risk_per_class = errors_per_class / n_per_class
+
+    # class and residual of the sample removed in each step
+    removed_class = class_idx[idx_sorted[:-1]]
+    removed_residuals = residuals[idx_sorted[:-1]]
+
+    # running number of removed samples and errors within the removed sample's class
+    by_class = np.argsort(removed_class, kind="stable")
+    group_start = np.searchsorted(removed_class[by_class], removed_class[by_class])
+    n_removed = np.empty(len(by_class), dtype=np.int64)
+    n_removed[by_class] = np.arange(1, len(by_class) + 1) - group_start
+    cum_errors = np.cumsum(removed_residuals[by_class])
+    errors_removed = np.empty(len(by_class), dtype=np.float64)
+    errors_removed[by_class] = (
+        cum_errors - cum_errors[group_start] + removed_residuals[by_class][group_start]
+    )
+
+    n_left = n_per_class[removed_class] - n_removed
+    errors_left = errors_per_class[removed_class] - errors_removed
+    risk_before = (errors_left + removed_residuals) / (n_left + 1)
+    # classes without remaining samples drop out of the mean
+    with np.errstate(divide="ignore", invalid="ignore"):
+        risk_after = np.where(n_left > 0, errors_left / n_left, 0.0)
+
+    risk_sum = np.sum(risk_per_class) + np.cumsum(risk_after - risk_before)
+    n_active_classes = len(classes) - np.cumsum(n_left == 0)
+
+    return _rc_curve_points(
+        confids[idx_sorted],
+        np.mean(risk_per_class),
+        risk_sum / n_active_classes,
+    )
+
+
+def binary_clf_curve(
+    sorted_confids: npt.NDArray[Any], sorted_positives: npt.NDArray[Any]
+) -> tuple[npt.NDArray[Any], npt.NDArray[Any]]:
+    """False and true positive counts per distinct threshold.
+
+    Mirrors ``sklearn.metrics._ranking._binary_clf_curve`` for inputs that are
+    already sorted by decreasing score.
+
+    Args:
+        sorted_confids (array_like): Scores in decreasing order
+        sorted_positives (array_like): Boolean positive indicator in the same order
+
+    Returns:
+        fps and tps at every distinct score
+    """
+    distinct_value_indices = np.flatnonzero(np.diff(sorted_confids))
+    threshold_idxs = np.r_[distinct_value_indices, sorted_positives.size - 1]
+    tps = np.cumsum(sorted_positives, dtype=np.float64)[threshold_idxs]
+    fps = 1 + threshold_idxs - tps
+    return fps, tps
+
+
+def roc_curve(
+    fps: npt.NDArray[Any], tps: npt.NDArray[Any]
+) -> tuple[npt.NDArray[Any], npt.NDArray[Any]]:
+    """ROC curve from cumulative counts, see ``sklearn.metrics.roc_curve``"""
+    if len(fps) > 2:
+        optimal_idxs = np.flatnonzero(
+            np.r_[True, np.logical_or(np.diff(fps, 2), np.diff(tps, 2)), True]
+        )
+        fps = fps[optimal_idxs]
+        tps = tps[optimal_idxs]
+
+    fps = np.r_[0, fps]
+    tps = np.r_[0, tps]
+
+    fpr = fps / fps[-1] if fps[-1] > 0 else np.repeat(np.nan, fps.shape)
+    tpr = tps / tps[-1] if tps[-1] > 0 else np.repeat(np.nan, tps.shape)
+    return fpr, tpr
+
+
+def precision_recall_curve(
+    fps: npt.NDArray[Any], tps: npt.NDArray[Any]
+) -> tuple[npt.NDArray[Any], npt.NDArray[Any]]:
+    """Precision-recall curve from cumulative counts, see
+    ``sklearn.metrics.precision_recall_curve``
+    """
+    precision = tps / (tps + fps)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        recall = tps / tps[-1]
+
+    # stop when full recall attained and reverse the outputs so recall is decreasing
+    last_ind = tps.searchsorted(tps[-1])
+    sl = slice(last_ind, None, -1)
+    return np.r_[precision[sl], 1], np.r_[recall[sl], 0]
+
+
+def average_precision(precision: npt.NDArray[Any], recall: npt.NDArray[Any]) -> float:
+    """Step-wise area under a precision-recall curve, see
+    ``sklearn.metrics.average_precision_score``
+    """
+    return -np.sum(np.diff(recall) * precision[:-1])
+
+
+def area_under_rc_curve(risks: npt.NDArray[Any], weights: npt.NDArray[Any]) -> float:
+    """Trapezoidal area under a risk-coverage curve"""
+    return float(np.sum((risks[:-1] + risks[1:]) * 0.5 * weights))
+
+
+def binomial_risk_bound(
+    delta: npt.ArrayLike, m: npt.ArrayLike, erm: npt.ArrayLike
+) -> npt.NDArray[Any]:
+    """Upper risk bound solving ``binom.cdf(int(m * erm), m, bound) == delta``.
+
+    Closed-form (Clopper-Pearson) inverse of the binomial CDF through the
+    inverse regularized incomplete beta function, elementwise over broadcast
+    inputs.
+
+    Args:
+        delta (array_like): Confidence parameter
+        m (array_like): Number of selected samples
+        erm (array_like): Empirical risk on the selected samples
+
+    Returns:
+        risk bound in ``[erm, 1]``
+    """
+    delta, m, erm = np.broadcast_arrays(
+        np.asarray(delta, dtype=np.float64),
+        np.asarray(m, dtype=np.float64),
+        np.asarray(erm, dtype=np.float64),
+    )
+    k = np.floor(m * erm)
+    with np.errstate(invalid="ignore"):
+        bound = 1 - special.betaincinv(m - k, k + 1, delta)
+    bound = np.where(k >= m, 1.0, bound)
+    return np.clip(bound, erm, 1.0)
+
+
+def selective_risk_thresholds(
+    confids: npt.NDArray[Any],
+    residuals: npt.NDArray[Any],
+    rstar: float,
+    deltas: npt.ArrayLike,
+    no_bound_mode: bool = False,
+    idx_sorted: npt.NDArray[Any] | None = None,
+) -> dict[str, npt.NDArray[Any]]:
+    """Selection threshold guaranteeing risk ``rstar`` with probability ``1 - delta``.
+
+    Binary search over the sorted confids (algorithm 1 of Geifman & El-Yaniv,
+    "Selective Classification for Deep Neural Networks"), run for all deltas
+    at once. Each of the ``ceil(log2(m))`` search steps evaluates the risk bound
+    of the current candidate for every delta in a single array call.
+
+    Args:
+        confids (array_like): Confidence values
+        residuals (array_like): 1 where the prediction is wrong, 0 otherwise
+        rstar (float): Requested risk
+        deltas (array_like): Desired deltas
+        no_bound_mode (bool): Compare the empirical risk instead of its bound
+        idx_sorted (array_like, optional): Precomputed ascending argsort of confids
+
+    Returns:
+        theta, val_risk, val_cov and bound with one entry per delta
+    """
+    if idx_sorted is None:
+        idx_sorted = np.argsort(confids)
+    deltas = np.atleast_1d(np.asarray(deltas, dtype=np.float64))
+
+    m = len(residuals)
+    n_steps = math.ceil(math.log2(m))
+    deltahat = deltas / n_steps
+
+    # errors among the samples selected when thresholding at each sorted position
+    sorted_residuals = residuals[idx_sorted]
+    errors_selected = np.cumsum(sorted_residuals[::-1])[::-1]
+
+    a = np.zeros(len(deltas), dtype=np.int64)
+    b = np.full(len(deltas), m - 1, dtype=np.int64)
+    for _ in range(n_steps + 1):
+        # the loop runs log(m)+1 iterations but actually the bound is calculated
+        # on only log(m) different candidate thetas
+        mid = (a + b + 1) // 2
+        mi = m - mid
+        risk = errors_selected[mid] / mi
+        bound = risk if no_bound_mode else binomial_risk_bound(deltahat, mi, risk)
+        too_risky = bound > rstar
+        a = np.where(too_risky, mid, a)
+        b = np.where(too_risky, b, mid)
+
+    return {
+        "theta": confids[idx_sorted[mid]],
+        "val_risk": risk,
+        "val_cov": mi / m,
+        "bound": bound,
+    }
+
+
 @dataclass
 class StatsCache:
-    """Cache for stats computed by scikit used by multiple metrics.
+    """Cache for stats used by multiple metrics.
+
+    The confids are sorted once and all curves (ROC, PRC, RC and balanced RC)
+    are derived from cumulative counts over that order.
 
     Attributes:
         confids (array_like): Confidence values
@@ -48,126 +348,58 @@ class StatsCache:
     n_bins: int
     labels: npt.NDArray[Any]
 
+    @cached_property
+    def idx_sorted(self) -> npt.NDArray[Any]:
+        return np.argsort(self.confids)
+
+    def _check_finite(self):
+        if not np.all(np.isfinite(self.confids)):
+            raise ValueError("Input contains NaN, infinity or a value too large.")
+
+    @cached_property
+    def suc_clf_curve_stats(self) -> tuple[npt.NDArray[Any], npt.NDArray[Any]]:
+        """fps and tps with successes as positives and decreasing confids"""
+        self._check_finite()
+        idx_sorted = self.idx_sorted[::-1]
+        return binary_clf_curve(self.confids[idx_sorted], self.correct[idx_sorted] == 1)
+
+    @cached_property
+    def err_clf_curve_stats(self) -> tuple[npt.NDArray[Any], npt.NDArray[Any]]:
+        """fps and tps with errors as positives and increasing confids"""
+        self._check_finite()
+        idx_sorted = self.idx_sorted
+        return binary_clf_curve(self.confids[idx_sorted], self.correct[idx_sorted] == 0)
+
     @cached_property
     def roc_curve_stats(self) -> tuple[npt.NDArray[Any], npt.NDArray[Any]]:
-        fpr, tpr, _ = skm.roc_curve(self.correct, self.confids)
-        return fpr, tpr
+        return roc_curve(*self.suc_clf_curve_stats)
+
+    @cached_property
+    def suc_prc_curve_stats(self) -> tuple[npt.NDArray[Any], npt.NDArray[Any]]:
+        return precision_recall_curve(*self.suc_clf_curve_stats)
+
+    @cached_property
+    def err_prc_curve_stats(self) -> tuple[npt.NDArray[Any], npt.NDArray[Any]]:
+        return precision_recall_curve(*self.err_clf_curve_stats)
 
     @property
     def residuals(self) -> npt.NDArray[Any]:
         return 1 - self.correct
 
     @cached_property
-    def brc_curve_stats(self) -> tuple[list[float], list[float], list[float]]:
-        coverages = []
-        balanced_risks = []
-        error_per_class = {}
-        risk_per_class = {}
+    def brc_curve_stats(
+        self,
+    ) -> tuple[npt.NDArray[Any], npt.NDArray[Any], npt.NDArray[Any]]:
         assert len(self.labels) == len(
             self.confids
         ), "labels must be same size as confids"
-        # calculate risk per class
-        n_residuals = len(self.residuals)
-        idx_sorted = np.argsort(self.confids)
-        n_remaining_per_class = {}
-        # coverage = number samples
-        coverage = n_residuals
-        # calcualte baselines:
-        # errors per class, residuals per class (total amount of images/errors from that class)
-        # risk per class: errors per class by remaining images in this class
-        # if there are no more images of a class risk is set to None and then filtered out before calculating mean
-        for label in np.unique(self.labels):
-            # remaining_labels = self.labels[idx_sorted]
-            idx_class = np.where(self.labels == label)[0]
-            error_per_class[label] = sum(self.residuals[idx_class])
-            n_remaining_per_class[label] = len(idx_class)
-            if n_remaining_per_class[label] == 0:
-                risk_per_class[label] = None
-            else:
-                risk_per_class[label] = (
-                    error_per_class[label] / n_remaining_per_class[label]
-                )
-        # coverage and risk point on the curve. starting point
-        coverages.append(coverage / n_residuals)
-        balanced_risks.append(
-            np.array([x for x in risk_per_class.values() if x is not None]).mean()
-        )
-        weights = []
-        tmp_weight = 0
-        for i in range(0, len(idx_sorted) - 1):
-            coverage = coverage - 1
-            # Decide which class the images is taken from
-            label = int(self.labels[idx_sorted[i]])
-            # from that class subtract 1 if an error is taken out and 0 if no error is taken out
-            error_per_class[label] = (
-                error_per_class[label] - self.residuals[idx_sorted[i]]
-            )
-            # reduce the remaining amount of images in the class an images was taken out
-            n_remaining_per_class[label] = n_remaining_per_class[label] - 1
-            assert (
-                n_remaining_per_class[label] >= 0
-            ), "Remaining images should be larger 0"
-            # if there is one or no more images remaining in a class risk is set to 0
-            # otherwise risk of the class is errors remaining divided by number images remaining
-            if n_remaining_per_class[label] < 1:
-                risk_per_class[label] = None
-            else:
-                risk_per_class[label] = error_per_class[label] / (
-                    n_remaining_per_class[label]
-                )
-                assert risk_per_class[label] >= 0, "Risk can never be below 0"
-            tmp_weight += 1
-            if i == 0 or self.confids[idx_sorted[i]] != self.confids[idx_sorted[i - 1]]:
-                coverages.append(coverage / n_residuals)
-                balanced_risks.append(
-                    np.array(
-                        [x for x in risk_per_class.values() if x is not None]
-                    ).mean()
-                )
-                weights.append(tmp_weight / n_residuals)
-                tmp_weight = 0
-        # add a well-defined final point to the RC-curve.
-        if tmp_weight > 0:
-            coverages.append(0)
-            balanced_risks.append(balanced_risks[-1])
-            weights.append(tmp_weight / n_residuals)
-        return coverages, balanced_risks, weights
+        return brc_curve(self.confids, self.residuals, self.labels, self.idx_sorted)
 
     @cached_property
-    def rc_curve_stats(self) -> tuple[list[float], list[float], list[float]]:
-        coverages = []
-        risks = []
-
-        n_residuals = len(self.residuals)
-        idx_sorted = np.argsort(self.confids)
-
-        coverage = n_residuals
-        error_sum = sum(self.residuals[idx_sorted])
-
-        coverages.append(coverage / n_residuals)
-        risks.append(error_sum / n_residuals)
-
-        weights = []
-
-        tmp_weight = 0
-        for i in range(0, len(idx_sorted) - 1):
-            coverage = coverage - 1
-            error_sum = error_sum - self.residuals[idx_sorted[i]]
-            selective_risk = error_sum / (n_residuals - 1 - i)
-            tmp_weight += 1
-            if i == 0 or self.confids[idx_sorted[i]] != self.confids[idx_sorted[i - 1]]:
-                coverages.append(coverage / n_residuals)
-                risks.append(selective_risk)
-                weights.append(tmp_weight / n_residuals)
-                tmp_weight = 0
-
-        # add a well-defined final point to the RC-curve.
-        if tmp_weight > 0:
-            coverages.append(0)
-            risks.append(risks[-1])
-            weights.append(tmp_weight / n_residuals)
-
-        return coverages, risks, weights
+    def rc_curve_stats(
+        self,
+    ) -> tuple[npt.NDArray[Any], npt.NDArray[Any], npt.NDArray[Any]]:
+        return rc_curve(self.confids, self.residuals, self.idx_sorted)
 
     @cached_property
     def calibration_stats(self):
@@ -223,6 +455,10 @@ def register_metric_func(name: str) -> Callable:
     return _inner_wrapper
 
 
+def has_metric_function(metric_name: str) -> bool:
+    return metric_name in _metric_funcs
+
+
 def get_metric_function(metric_name: str) -> Callable[[StatsCache], float]:
     if metric_name not in _metric_funcs:
         return _metric_funcs["*"]
@@ -247,43 +483,29 @@ def fpr_at_95_tpr(stats_cache: StatsCache) -> float:
 @register_metric_func("failap_suc")
 @may_raise_sklearn_exception
 def failap_suc(stats_cache: StatsCache) -> float:
-    return cast(
-        float,
-        skm.average_precision_score(
-            stats_cache.correct, stats_cache.confids, pos_label=1
-        ),
-    )
+    precision, recall = stats_cache.suc_prc_curve_stats
+    return average_precision(precision, recall)
 
 
 @register_metric_func("failap_err")
 @may_raise_sklearn_exception
 def failap_err(stats_cache: StatsCache):
-    return cast(
-        float,
-        skm.average_precision_score(
-            stats_cache.correct, -stats_cache.confids, pos_label=0
-        ),
-    )
+    precision, recall = stats_cache.err_prc_curve_stats
+    return average_precision(precision, recall)
 
 
 @register_metric_func("aurc")
 @may_raise_sklearn_exception
 def aurc(stats_cache: StatsCache):
     _, risks, weights = stats_cache.rc_curve_stats
-    return (
-        sum([(risks[i] + risks[i + 1]) * 0.5 * weights[i] for i in range(len(weights))])
-        * AURC_DISPLAY_SCALE
-    )
+    return area_under_rc_curve(risks, weights) * AURC_DISPLAY_SCALE
 
 
 @register_metric_func("b-aurc")
 @may_raise_sklearn_exception
 def baurc(stats_cache: StatsCache):
     _, risks, weights = stats_cache.brc_curve_stats
-    return (
-        sum([(risks[i] + risks[i + 1]) * 0.5 * weights[i] for i in range(len(weights))])
-        * AURC_DISPLAY_SCALE
-    )
+    return area_under_rc_curve(risks, weights) * AURC_DISPLAY_SCALE
 
 
 @register_metric_func("e-aurc")
@@ -0,0 +1,49 @@
+"""Classifier performance metrics computed from the softmax of a study.
+
+All metrics gather the probability of the true class per row instead of
+building a one-hot label matrix, so memory stays ``O(n)`` on top of the
+softmax independent of the number of classes.
+"""
+
+from __future__ import annotations
+
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+
+
+def _true_class_probabilities(
+    softmax: npt.NDArray[Any], labels: npt.NDArray[Any]
+) -> npt.NDArray[Any]:
+    return softmax[np.arange(len(softmax)), labels.astype(int)]
+
+
+def nll(softmax: npt.NDArray[Any], labels: npt.NDArray[Any]) -> float:
+    """Negative log-likelihood of the true class
+
+    Averaged over all ``n * classes`` entries of the softmax, like the mean
+    of ``-log(softmax) * one_hot(labels)``.
+    """
+    p_true = _true_class_probabilities(softmax, labels)
+    return float(np.sum(-np.log(p_true + 1e-7)) / softmax.size)
+
+
+def brier_score(softmax: npt.NDArray[Any], labels: npt.NDArray[Any]) -> float:
+    """Mean over rows of ``sum((softmax - one_hot(labels))**2)``"""
+    p_true = _true_class_probabilities(softmax, labels)
+    squared = np.einsum("ij,ij->i", softmax, softmax)
+    return float(np.mean(squared - 2 * p_true + 1))
+
+
+def accuracy(correct: npt.NDArray[Any]) -> float:
+    return np.sum(correct) / correct.size
+
+
+def balanced_accuracy(labels: npt.NDArray[Any], correct: npt.NDArray[Any]) -> float:
+    """Mean of the per-class accuracies of all classes present in labels"""
+    _, class_idx = np.unique(labels, return_inverse=True)
+    class_idx = class_idx.reshape(-1)
+    counts = np.bincount(class_idx)
+    hits = np.bincount(class_idx, weights=correct.reshape(-1))
+    return float(np.mean(hits / counts))
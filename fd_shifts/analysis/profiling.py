@@ -0,0 +1,109 @@
+"""Opt-in timing and memory records of the analysis stages.
+
+Every stage appends one JSON line with the run, study, confid, wall time and
+memory of the process. Studies running in a process pool append to the same
+file, lines are short enough to be written atomically.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import pandas as pd
+
+PROFILE_NAME = "analysis_profile.jsonl"
+
+
+def _rss() -> int:
+    import psutil
+
+    return psutil.Process().memory_info().rss
+
+
+class StageProfiler:
+    def __init__(self, path: str | Path | None = None, run: str | None = None):
+        """
+        Args:
+            path: JSON lines file to append records to, profiling is disabled
+                when not given
+            run: Name of the run the records belong to
+        """
+        self.path = Path(path) if path is not None else None
+        self.run = run
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def reset(self):
+        if self.enabled and self.path.is_file():
+            self.path.unlink()
+
+    @contextmanager
+    def stage(
+        self, stage: str, study: str | None = None, confid: str | None = None
+    ) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+
+        rss_before = _rss()
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        rss = _rss()
+        record = {
+            "run": self.run,
+            "study": study,
+            "confid": confid,
+            "stage": stage,
+            "seconds": seconds,
+            "rss_mib": rss / 2**20,
+            "rss_delta_mib": (rss - rss_before) / 2**20,
+            "pid": os.getpid(),
+        }
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def load_profiles(paths: Iterable[str | Path]) -> pd.DataFrame:
+    records = []
+    for path in paths:
+        with open(path) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return pd.DataFrame.from_records(
+        records,
+        columns=[
+            "run",
+            "study",
+            "confid",
+            "stage",
+            "seconds",
+            "rss_mib",
+            "rss_delta_mib",
+            "pid",
+        ],
+    )
+
+
+def summarize_profiles(profiles: pd.DataFrame) -> pd.DataFrame:
+    """Time and memory per stage, summed over runs, studies and confids
+
+    Returns:
+        one row per stage, slowest first
+    """
+    summary = profiles.groupby("stage").agg(
+        calls=("seconds", "size"),
+        runs=("run", "nunique"),
+        total_s=("seconds", "sum"),
+        mean_s=("seconds", "mean"),
+        max_s=("seconds", "max"),
+        max_rss_mib=("rss_mib", "max"),
+        max_rss_delta_mib=("rss_delta_mib", "max"),
+    )
+    return summary.sort_values("total_s", ascending=False).reset_index()
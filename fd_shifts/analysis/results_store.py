@@ -0,0 +1,157 @@
+"""SQLite store for analysis results of a whole experiment group.
+
+Results are kept in long format, one row per (run, study, confid, metric)
+cell, next to one row of run information per (run, study, confid). Writes
+are upserts in a single transaction, so analyses running in parallel can
+share one store and rerunning a study replaces its rows instead of appending
+duplicates. SQLite's file locking serializes concurrent writers.
+"""
+
+from __future__ import annotations
+
+import math
+import sqlite3
+from pathlib import Path
+from typing import Any, Sequence
+
+import numpy as np
+import pandas as pd
+
+KEY_COLUMNS = ["name", "study", "confid"]
+INFO_COLUMNS = ["model", "network", "fold", "n_test"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS studies (
+    name TEXT NOT NULL,
+    study TEXT NOT NULL,
+    confid TEXT NOT NULL,
+    model TEXT,
+    network TEXT,
+    fold INTEGER,
+    n_test INTEGER,
+    PRIMARY KEY (name, study, confid)
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    name TEXT NOT NULL,
+    study TEXT NOT NULL,
+    confid TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (name, study, confid, metric)
+);
+"""
+
+
+def _to_sql_value(value: Any) -> Any:
+    if value is None:
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def _where(filters: dict[str, Sequence[str] | None]) -> tuple[str, list[Any]]:
+    clauses, params = [], []
+    for column, values in filters.items():
+        if values is None:
+            continue
+        values = list(values)
+        clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+        params.extend(values)
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+class ResultsStore:
+    def __init__(self, path: str | Path, timeout: float = 600):
+        self.path = Path(path)
+        self.timeout = timeout
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=self.timeout)
+
+    def write(self, df: pd.DataFrame):
+        """Insert the results of a study table, replacing earlier results
+
+        Args:
+            df: Table as built by ``Analysis.create_results_csv``, one row per
+                confid. Every column that is not a key or run information
+                column is stored as a metric.
+        """
+        metric_columns = [c for c in df.columns if c not in KEY_COLUMNS + INFO_COLUMNS]
+        study_rows = [
+            tuple(_to_sql_value(v) for v in row)
+            for row in df[KEY_COLUMNS + INFO_COLUMNS].itertuples(index=False)
+        ]
+        metric_rows = [
+            (*keys, metric, _to_sql_value(value))
+            for keys, values in zip(
+                df[KEY_COLUMNS].itertuples(index=False),
+                df[metric_columns].itertuples(index=False),
+            )
+            for metric, value in zip(metric_columns, values)
+        ]
+
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    "DELETE FROM metrics WHERE name = ? AND study = ? AND confid = ?",
+                    [row[: len(KEY_COLUMNS)] for row in study_rows],
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO studies VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    study_rows,
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?, ?)",
+                    metric_rows,
+                )
+        finally:
+            conn.close()
+
+    def load(
+        self,
+        metrics: Sequence[str] | None = None,
+        names: Sequence[str] | None = None,
+        studies: Sequence[str] | None = None,
+        confids: Sequence[str] | None = None,
+    ) -> pd.DataFrame:
+        """Load results as one row per (run, study, confid)
+
+        Only the requested metrics and partitions are read, all of them when
+        not given.
+
+        Returns:
+            table with the key and run information columns and one column per
+            metric, metrics in the order requested or first stored
+        """
+        where, params = _where(
+            {"name": names, "study": studies, "confid": confids, "metric": metrics}
+        )
+        conn = self._connect()
+        try:
+            long_df = pd.read_sql_query(
+                f"SELECT * FROM metrics{where} ORDER BY rowid", conn, params=params
+            )
+            where, params = _where({"name": names, "study": studies, "confid": confids})
+            info_df = pd.read_sql_query(
+                f"SELECT * FROM studies{where} ORDER BY rowid", conn, params=params
+            )
+        finally:
+            conn.close()
+
+        if metrics is None:
+            metrics = list(dict.fromkeys(long_df["metric"]))
+        wide_df = long_df.pivot(index=KEY_COLUMNS, columns="metric", values="value")
+        wide_df = wide_df.reindex(columns=list(metrics))
+        wide_df.columns.name = None
+        return info_df.merge(
+            wide_df.reset_index(), on=KEY_COLUMNS, how="left", sort=False
+        )[KEY_COLUMNS + INFO_COLUMNS + list(metrics)]
@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-from copy import deepcopy
 from typing import TYPE_CHECKING, Any, Callable, Iterator, Tuple
 
 import numpy as np
@@ -90,37 +89,38 @@ def filter_new_class_study_data(
     iid_set_ix = data.dataset_name_to_idx(iid_set_name)
     new_class_set_ix = data.dataset_name_to_idx(dataset_name)
 
-    select_ix_in = np.argwhere(data.dataset_idx == iid_set_ix)[:, 0]
-    select_ix_out = np.argwhere(data.dataset_idx == new_class_set_ix)[:, 0]
+    # only the rows of both sets are touched, in their original order
+    all_ix = np.arange(len(data.dataset_idx))
+    select_ix = np.union1d(
+        all_ix[data.dataset_rows(iid_set_ix)],
+        all_ix[data.dataset_rows(new_class_set_ix)],
+    )
+    is_out = data.dataset_idx[select_ix] == new_class_set_ix
 
     assert data.correct is not None
 
-    correct = deepcopy(data.correct)
-    correct[select_ix_out] = 0
+    correct = data.correct[select_ix]
+    correct[is_out] = 0
     if mode == "original_mode":
         correct[
-            select_ix_in
+            ~is_out
         ] = 1  # nice to see so visual how little practical sense the current protocol makes!
-    labels = deepcopy(data.labels)
-    labels[select_ix_out] = -99
+    labels = data.labels[select_ix]
+    labels[is_out] = -99
 
-    select_ix_all = np.argwhere(
-        (data.dataset_idx == new_class_set_ix)
-        | ((data.dataset_idx == iid_set_ix) & (correct == 1))
-    )[
-        :, 0
-    ]  # de-select incorrect inlier predictions.
+    keep = is_out | (correct == 1)  # de-select incorrect inlier predictions.
+    select_ix_all = select_ix[keep]
 
-    mcd_correct = deepcopy(data.mcd_correct)
+    mcd_correct = data.mcd_correct
     if mcd_correct is not None:
-        mcd_correct[select_ix_out] = 0
+        mcd_correct = mcd_correct[select_ix]
+        mcd_correct[is_out] = 0
         if mode == "original_mode":
-            mcd_correct[select_ix_in] = 1
+            mcd_correct[~is_out] = 1
 
-        select_ix_all_mcd = np.argwhere(
-            (data.dataset_idx == new_class_set_ix)
-            | ((data.dataset_idx == iid_set_ix) & (mcd_correct == 1))
-        )[:, 0]
+        keep_mcd = is_out | (mcd_correct == 1)
+        select_ix_all_mcd = select_ix[keep_mcd]
+        mcd_correct = mcd_correct[keep_mcd]
     else:
         select_ix_all_mcd = None
 
@@ -131,8 +131,8 @@ def filter_new_class_study_data(
         return None
 
     return data.__class__(
-        softmax_output=data.softmax_output[select_ix_all],
-        labels=labels[select_ix_all],
+        softmax_output=data._zero_holdout(data.softmax_output[select_ix_all]),
+        labels=labels[keep],
         dataset_idx=data.dataset_idx[select_ix_all],
         mcd_softmax_dist=__filter_if_exists(data.mcd_softmax_dist, select_ix_all_mcd),
         external_confids=__filter_if_exists(data.external_confids, select_ix_all),
@@ -140,8 +140,13 @@ def filter_new_class_study_data(
             data.mcd_external_confids_dist, select_ix_all_mcd
         ),
         config=data.config,
-        _correct=__filter_if_exists(correct, select_ix_all),
-        _mcd_correct=__filter_if_exists(mcd_correct, select_ix_all_mcd),
+        holdout_classes=data.holdout_classes,
+        _correct=correct[keep],
+        _mcd_correct=mcd_correct,
+        _mcd_softmax_mean=__filter_if_exists(data.mcd_softmax_mean, select_ix_all_mcd),
+        _features=data._map_features(
+            lambda a: a[select_ix_all], lambda a: a[select_ix_all_mcd]
+        ),
     )
 
 
@@ -167,54 +172,47 @@ def iterate_new_class_study_data(
 def filter_noise_study_data(
     data: "ExperimentData", dataset_name: str, noise_level: int = 1
 ) -> "ExperimentData":
-    noise_set_ix = data.dataset_name_to_idx(dataset_name)
-
-    select_ix = np.argwhere(data.dataset_idx == noise_set_ix)[:, 0]
+    # a view of the noise set, the intensity selection below copies only
+    # the selected fifth of it
+    data = data.filter_dataset_by_name(dataset_name)
 
-    def __filter_intensity_3d(data, mask, noise_level):
+    def __filter_intensity_3d(data, noise_level):
         if data is None:
             return None
 
-        data = data[mask]
-
         return data.reshape(15, 5, -1, data.shape[-2], data.shape[-1])[
             :, noise_level
         ].reshape(-1, data.shape[-2], data.shape[-1])
 
-    def __filter_intensity_2d(data, mask, noise_level):
+    def __filter_intensity_2d(data, noise_level):
         if data is None:
             return None
 
-        data = data[mask]
-
         return data.reshape(15, 5, -1, data.shape[-1])[:, noise_level].reshape(
             -1, data.shape[-1]
         )
 
-    def __filter_intensity_1d(data, mask, noise_level):
+    def __filter_intensity_1d(data, noise_level):
         if data is None:
             return None
 
-        data = data[mask]
-
         return data.reshape(15, 5, -1)[:, noise_level].reshape(-1)
 
     return data.__class__(
-        softmax_output=__filter_intensity_2d(
-            data.softmax_output, select_ix, noise_level
-        ),
-        labels=__filter_intensity_1d(data.labels, select_ix, noise_level),
-        dataset_idx=__filter_intensity_1d(data.dataset_idx, select_ix, noise_level),
-        external_confids=__filter_intensity_1d(
-            data.external_confids, select_ix, noise_level
-        ),
+        softmax_output=__filter_intensity_2d(data.softmax_output, noise_level),
+        labels=__filter_intensity_1d(data.labels, noise_level),
+        dataset_idx=__filter_intensity_1d(data.dataset_idx, noise_level),
+        external_confids=__filter_intensity_1d(data.external_confids, noise_level),
         mcd_external_confids_dist=__filter_intensity_2d(
-            data.mcd_external_confids_dist, select_ix, noise_level
-        ),
-        mcd_softmax_dist=__filter_intensity_3d(
-            data.mcd_softmax_dist, select_ix, noise_level
+            data.mcd_external_confids_dist, noise_level
         ),
+        mcd_softmax_dist=__filter_intensity_3d(data.mcd_softmax_dist, noise_level),
         config=data.config,
+        holdout_classes=data.holdout_classes,
+        _correct=__filter_intensity_1d(data._correct, noise_level),
+        _mcd_correct=__filter_intensity_1d(data._mcd_correct, noise_level),
+        _mcd_softmax_mean=__filter_intensity_2d(data._mcd_softmax_mean, noise_level),
+        _features=data._map_features(lambda a: __filter_intensity_1d(a, noise_level)),
     )
 
 
@@ -0,0 +1,28 @@
+import torch
+from torchmetrics import Metric
+
+
+class BrierScore(Metric):
+    def __init__(self, num_classes, dist_sync_on_step=False):
+        # call `self.add_state`for every internal state that is needed for the metrics computations
+        # dist_reduce_fx indicates the function that should be used to reduce
+        # state from multiple processes
+        super().__init__(dist_sync_on_step=dist_sync_on_step)
+
+        self.num_classes = num_classes
+        self.add_state("brier_score", default=torch.tensor(0.0), dist_reduce_fx="sum")
+        self.add_state("total", default=torch.tensor(0), dist_reduce_fx="sum")
+
+    def update(self, preds: torch.Tensor, target: torch.Tensor):
+        # update metric states
+        #      preds, target = self._input_format(preds, target)
+
+        y_one_hot = torch.nn.functional.one_hot(target, num_classes=self.num_classes)
+        assert preds.shape == y_one_hot.shape
+
+        self.brier_score += ((preds - y_one_hot) ** 2).sum(1).mean()
+        self.total += 1
+
+    def compute(self):
+        # compute final result
+        return self.brier_score.float() / self.total
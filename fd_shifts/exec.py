@@ -206,18 +206,19 @@ def test(cf):
         callbacks=[progress] + get_callbacks(cf),
         precision=32,
         replace_sampler_ddp=False,
-        # accelerator="ddp",
-        accelerator=None,
+        accelerator=accelerator,
     )
     trainer.test(model=module, datamodule=datamodule)
-    analysis.main(
-        in_path=cf.test.dir,
-        out_path=cf.test.dir,
-        query_studies=cf.eval.query_studies,
-        add_val_tuning=cf.eval.val_tuning,
-        threshold_plot_confid=None,
-        cf=cf,
-    )
+    # test outputs are gathered and written by the first process only
+    if trainer.is_global_zero:
+        analysis.main(
+            in_path=cf.test.dir,
+            out_path=cf.test.dir,
+            query_studies=cf.eval.query_studies,
+            add_val_tuning=cf.eval.val_tuning,
+            threshold_plot_confid=None,
+            cf=cf,
+        )
 
 
 @hydra.main(config_path="configs", config_name="config")
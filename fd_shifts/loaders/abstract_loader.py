@@ -408,15 +408,22 @@ class AbstractDataLoader(pl.LightningDataModule):
     ):  # todo missing val sampler for val_tuning in cv mode! only devries mode implemented for val tuning!
         test_loaders = []
         for ix, test_dataset in enumerate(self.test_datasets):
-            # sampler = torch.utils.data.distributed.DistributedSampler(
-            #     test_dataset, shuffle=False
-            # )
+            # sharded in a fixed order, ConfidMonitor gathers the outputs back
+            # into dataset order
+            sampler = (
+                torch.utils.data.distributed.DistributedSampler(
+                    test_dataset, shuffle=False
+                )
+                if torch.distributed.is_available()
+                and torch.distributed.is_initialized()
+                else None
+            )
             test_loaders.append(
                 torch.utils.data.DataLoader(
                     test_dataset,
                     batch_size=self.batch_size,
                     shuffle=False,
-                    # sampler=sampler,
+                    sampler=sampler,
                     pin_memory=self.pin_memory,
                     num_workers=self.num_workers,
                 )
@@ -2,9 +2,21 @@ from pytorch_lightning.callbacks import Callback
 from pytorch_lightning.trainer.connectors.logger_connector.logger_connector import (
     LoggerConnector,
 )
+import os
+
 import torch
 import numpy as np
 from fd_shifts.analysis import eval_utils
+from fd_shifts.utils.background_worker import BackgroundWorker
+from fd_shifts.utils.confid_sketch import FailureSketch
+from fd_shifts.utils.distributed import (
+    all_gather_rows,
+    is_distributed,
+    sample_indices,
+    sample_order,
+)
+from fd_shifts.utils.output_writer import ArrayStreamWriter, close_all
+from fd_shifts.utils.tensor_buffer import TensorBuffer
 from tqdm import tqdm
 from rich import print
 
@@ -24,25 +36,39 @@ class ConfidMonitor(Callback):
         self.query_confid_metrics = cf.eval.confid_metrics
         self.query_monitor_plots = cf.eval.monitor_plots
         self.query_confids = cf.eval.confidence_measures
+        # splits whose confid metrics come from mergeable per-batch histograms
+        # instead of all confids of the epoch, cheap enough for training
+        self.online_confid_metrics = cf.eval.get("online_confid_metrics", [])
+        # monitor plots are rendered on a background thread, so epoch ends do
+        # not wait for matplotlib, plots that cannot keep up get dropped
+        self.async_monitor_plots = cf.eval.get("async_monitor_plots", True)
+        self.plot_worker = BackgroundWorker(
+            max_pending=cf.eval.get("monitor_plot_queue_size", 2)
+        )
 
         self.output_paths = cf.exp.output_paths
+        self.raw_output_format = cf.exp.get("raw_output_format", "npz")
+        self.raw_output_dtype = cf.exp.get("raw_output_dtype", "float64")
+        self.raw_output_compression_workers = cf.exp.get(
+            "raw_output_compression_workers", 1
+        )
         self.version_dir = cf.exp.version_dir
         self.val_every_n_epoch = cf.trainer.val_every_n_epoch
-        self.running_test_encoded = []
-        self.running_test_softmax = []
-        self.running_test_softmax_dist = []
-        self.running_test_labels = []
-        self.running_test_dataset_idx = []
-        self.running_test_external_confids = []
-        self.running_test_external_confids_dist = []
+        # outputs of the last validation epoch
+        self.running_test_softmax = TensorBuffer()
+        self.running_test_labels = TensorBuffer()
+        self.running_test_external_confids = TensorBuffer()
+        self.running_test_sample_keys = TensorBuffer()
+        self.test_output_writers = {}
+        # samples drawn per split and dataloader on this rank, and whether the
+        # samples of a split are sharded across ranks
+        self.sample_counts = {"val": {}, "test": {}}
+        self.batch_sample_keys = {}
+        self.sharded = {}
         self.running_confid_stats = {}
         self.running_perf_stats = {}
-        self.running_confid_stats["train"] = {
-            k: {"confids": [], "correct": []} for k in self.query_confids["train"]
-        }
-        self.running_confid_stats["val"] = {
-            k: {"confids": [], "correct": []} for k in self.query_confids["val"]
-        }
+        self.running_confid_stats["train"] = self._new_confid_stats("train")
+        self.running_confid_stats["val"] = self._new_confid_stats("val")
         self.running_train_correct_sum_sanity = 0
         self.running_val_correct_sum_sanity = 0
         self.running_perf_stats["train"] = {
@@ -52,6 +78,85 @@ class ConfidMonitor(Callback):
             k: [] for k in self.query_performance_metrics["val"]
         }
 
+    def _new_confid_stats(self, split):
+        if split in self.online_confid_metrics:
+            return {k: {"sketch": FailureSketch()} for k in self.query_confids[split]}
+        # batches are appended on device and read back in one copy per epoch
+        return {
+            k: {"confids": TensorBuffer(), "correct": TensorBuffer()}
+            for k in self.query_confids[split]
+        }
+
+    def _sample_keys(self, trainer, split, dataloader_idx, batch_size, device):
+        """Dataloader and dataset index of each sample of a batch
+
+        Only known for distributed runs with an unshuffled DistributedSampler,
+        padding samples of the sampler get the dataset index -1.
+        """
+        if not is_distributed():
+            return None
+        dataloader_idx = dataloader_idx or 0
+        dataloaders = (
+            trainer.val_dataloaders if split == "val" else trainer.test_dataloaders
+        )
+        if not isinstance(dataloaders, (list, tuple)):
+            dataloaders = [dataloaders]
+        start = self.sample_counts[split].get(dataloader_idx, 0)
+        self.sample_counts[split][dataloader_idx] = start + batch_size
+        indices = sample_indices(dataloaders[dataloader_idx], start, batch_size, device)
+        if indices is None:
+            return None
+        return torch.stack([torch.full_like(indices, dataloader_idx), indices], dim=1)
+
+    def _gather(self, tensors, keys=None):
+        """Tensors of all ranks, in dataset order if the sample keys are given"""
+        tensors = {k: all_gather_rows(v) for k, v in tensors.items()}
+        if keys is not None:
+            order = sample_order(all_gather_rows(keys))
+            tensors = {k: v[order] for k, v in tensors.items()}
+        return tensors
+
+    def _add_confid_stats(self, split, confid_key, confids, correct):
+        confid_dict = self.running_confid_stats[split][confid_key]
+        keys = self.batch_sample_keys.get(split)
+        if keys is not None:
+            # drop the padding of the sampler, other ranks hold these samples
+            keep = keys[:, 1] >= 0
+            confids, correct, keys = confids[keep], correct[keep], keys[keep]
+        if "sketch" in confid_dict:
+            confid_dict["sketch"].update(confids, correct)
+        else:
+            confid_dict["confids"].append(confids)
+            confid_dict["correct"].append(correct)
+            if keys is not None:
+                confid_dict.setdefault("keys", TensorBuffer()).append(keys)
+
+    def _gather_confid_stats(self, split):
+        """Replace the confid stats of this rank with those of all ranks"""
+        if not self.sharded.get(split, False):
+            return
+        for confid_key in sorted(self.running_confid_stats[split]):
+            confid_dict = self.running_confid_stats[split][confid_key]
+            if "sketch" in confid_dict:
+                confid_dict["sketch"].sync()
+                continue
+            # all ranks see the same number of batches, so empty on all of them
+            if len(confid_dict["confids"]) == 0:
+                continue
+            keys = confid_dict.pop("keys", None)
+            gathered = self._gather(
+                {k: buffer.tensor() for k, buffer in confid_dict.items()},
+                keys.tensor() if keys is not None else None,
+            )
+            for k, rows in gathered.items():
+                confid_dict[k].clear()
+                confid_dict[k].append(rows)
+
+    def _clear_confid_stats(self, split):
+        for confid_dict in self.running_confid_stats[split].values():
+            for stats in confid_dict.values():
+                stats.clear()
+
     def on_train_start(self, trainer, pl_module):
         if self.fast_dev_run is False:
             hp_metrics = {
@@ -71,6 +176,8 @@ class ConfidMonitor(Callback):
         loss = outputs["loss"]
         softmax = outputs["softmax"]
         y = outputs["labels"]
+        # the shuffled training samples cannot be ordered, only gathered
+        self.sharded["train"] = is_distributed()
 
         tmp_correct = None
         if len(self.running_perf_stats["train"].keys()) > 0:
@@ -108,30 +215,15 @@ class ConfidMonitor(Callback):
                 )
             if "det_mcp" in stat_keys:
                 tmp_confids = torch.max(softmax, dim=1)[0]
-                self.running_confid_stats["train"]["det_mcp"]["confids"].extend(
-                    tmp_confids
-                )
-                self.running_confid_stats["train"]["det_mcp"]["correct"].extend(
-                    tmp_correct
-                )
+                self._add_confid_stats("train", "det_mcp", tmp_confids, tmp_correct)
             if "det_pe" in stat_keys:
                 tmp_confids = torch.sum(softmax * (-torch.log(softmax + 1e-7)), dim=1)
-                self.running_confid_stats["train"]["det_pe"]["confids"].extend(
-                    tmp_confids
-                )
-                self.running_confid_stats["train"]["det_pe"]["correct"].extend(
-                    tmp_correct
-                )
+                self._add_confid_stats("train", "det_pe", tmp_confids, tmp_correct)
 
             if "ext" in stat_keys:
                 tmp_confids = outputs["confid"]
                 if tmp_confids is not None:
-                    self.running_confid_stats["train"]["ext"]["confids"].extend(
-                        tmp_confids
-                    )
-                    self.running_confid_stats["train"]["ext"]["correct"].extend(
-                        tmp_correct
-                    )
+                    self._add_confid_stats("train", "ext", tmp_confids, tmp_correct)
 
             if "imgs" in outputs.keys():
                 eval_utils.plot_input_imgs(
@@ -140,7 +232,24 @@ class ConfidMonitor(Callback):
                     self.output_paths.fit.input_imgs_plot,
                 )
 
+    def _add_figure(self, tensorboard, tag, plot, step):
+        if not self.async_monitor_plots:
+            tensorboard.add_figure(tag, plot, step)
+            return
+        if not self.plot_worker.submit(
+            self._render_figure, tensorboard, tag, plot, step
+        ):
+            tqdm.write(
+                f"monitor plots lag behind, dropped {self.plot_worker.dropped} so far"
+            )
+
+    @staticmethod
+    def _render_figure(tensorboard, tag, plot_inputs, step):
+        tensorboard.add_figure(tag, eval_utils.render_monitor_plot(**plot_inputs), step)
+
     def on_train_epoch_end(self, trainer, pl_module):
+        # before any rank-dependent branching, all ranks have to take part
+        self._gather_confid_stats("train")
 
         if (
             len(self.running_confid_stats["train"].keys()) > 0
@@ -160,6 +269,7 @@ class ConfidMonitor(Callback):
                 self.query_monitor_plots,
                 do_plot=do_plot,
                 ext_confid_name=pl_module.ext_confid_name,
+                render_plots=not self.async_monitor_plots,
             )
             tqdm.write(f"CHECK TRAIN METRICS {str(monitor_metrics)}")
             tensorboard = pl_module.logger[0].experiment
@@ -172,13 +282,11 @@ class ConfidMonitor(Callback):
 
             if do_plot:
                 for k, v in monitor_plots.items():
-                    tensorboard.add_figure(
-                        "train/{}".format(k), v, pl_module.current_epoch
+                    self._add_figure(
+                        tensorboard, "train/{}".format(k), v, pl_module.current_epoch
                     )
 
-        self.running_confid_stats["train"] = {
-            k: {"confids": [], "correct": []} for k in self.query_confids["train"]
-        }
+        self._clear_confid_stats("train")
         self.running_perf_stats["train"] = {
             k: [] for k in self.query_performance_metrics["train"]
         }
@@ -195,6 +303,9 @@ class ConfidMonitor(Callback):
         softmax = outputs["softmax"]
         y = outputs["labels"]
         softmax_dist = outputs.get("softmax_dist")
+        keys = self._sample_keys(trainer, "val", dataloader_idx, len(y), y.device)
+        self.batch_sample_keys["val"] = keys
+        self.sharded["val"] = keys is not None
         perf_keys = self.running_perf_stats["val"].keys()
         confid_keys = self.running_confid_stats["val"].keys()
         if dataloader_idx is None or dataloader_idx == 0:
@@ -235,32 +346,17 @@ class ConfidMonitor(Callback):
                 self.running_val_correct_sum_sanity += tmp_correct.sum()
                 if "det_mcp" in confid_keys:
                     tmp_confids = torch.max(softmax, dim=1)[0]
-                    self.running_confid_stats["val"]["det_mcp"]["confids"].extend(
-                        tmp_confids
-                    )
-                    self.running_confid_stats["val"]["det_mcp"]["correct"].extend(
-                        tmp_correct
-                    )
+                    self._add_confid_stats("val", "det_mcp", tmp_confids, tmp_correct)
                 if "det_pe" in confid_keys:
                     tmp_confids = torch.sum(
                         softmax * (-torch.log(softmax + 1e-7)), dim=1
                     )
-                    self.running_confid_stats["val"]["det_pe"]["confids"].extend(
-                        tmp_confids
-                    )
-                    self.running_confid_stats["val"]["det_pe"]["correct"].extend(
-                        tmp_correct
-                    )
+                    self._add_confid_stats("val", "det_pe", tmp_confids, tmp_correct)
 
                 if "ext" in confid_keys:
                     tmp_confids = outputs["confid"]
                     if tmp_confids is not None:
-                        self.running_confid_stats["val"]["ext"]["confids"].extend(
-                            tmp_confids
-                        )
-                        self.running_confid_stats["val"]["ext"]["correct"].extend(
-                            tmp_correct
-                        )
+                        self._add_confid_stats("val", "ext", tmp_confids, tmp_correct)
 
             if softmax_dist is not None:
 
@@ -271,49 +367,30 @@ class ConfidMonitor(Callback):
 
                 if "mcd_mcp" in confid_keys:
                     tmp_confids = torch.max(mean_softmax, dim=1)[0]
-                    self.running_confid_stats["val"]["mcd_mcp"]["confids"].extend(
-                        tmp_confids
-                    )
-                    self.running_confid_stats["val"]["mcd_mcp"]["correct"].extend(
-                        tmp_mcd_correct
+                    self._add_confid_stats(
+                        "val", "mcd_mcp", tmp_confids, tmp_mcd_correct
                     )
                 if "mcd_pe" in confid_keys:
                     pe_confids = torch.sum(
                         mean_softmax * (-torch.log(mean_softmax + 1e-7)), dim=1
                     )
-                    self.running_confid_stats["val"]["mcd_pe"]["confids"].extend(
-                        pe_confids
-                    )
-                    self.running_confid_stats["val"]["mcd_pe"]["correct"].extend(
-                        tmp_mcd_correct
-                    )
+                    self._add_confid_stats("val", "mcd_pe", pe_confids, tmp_mcd_correct)
                 if "mcd_ee" in confid_keys:
                     ee_confids = torch.sum(
                         softmax_dist * (-torch.log(softmax_dist + 1e-7)), dim=1
                     ).mean(1)
-                    self.running_confid_stats["val"]["mcd_ee"]["confids"].extend(
-                        ee_confids
-                    )
-                    self.running_confid_stats["val"]["mcd_ee"]["correct"].extend(
-                        tmp_mcd_correct
-                    )
+                    self._add_confid_stats("val", "mcd_ee", ee_confids, tmp_mcd_correct)
                 if "mcd_mi" in confid_keys:
                     tmp_confids = pe_confids - ee_confids
-                    self.running_confid_stats["val"]["mcd_mi"]["confids"].extend(
-                        tmp_confids
-                    )
-                    self.running_confid_stats["val"]["mcd_mi"]["correct"].extend(
-                        tmp_mcd_correct
+                    self._add_confid_stats(
+                        "val", "mcd_mi", tmp_confids, tmp_mcd_correct
                     )
                 if "mcd_sv" in confid_keys:
                     tmp_confids = (
                         (softmax_dist - mean_softmax.unsqueeze(2)) ** 2
                     ).mean((1, 2))
-                    self.running_confid_stats["val"]["mcd_sv"]["confids"].extend(
-                        tmp_confids
-                    )
-                    self.running_confid_stats["val"]["mcd_sv"]["correct"].extend(
-                        tmp_mcd_correct
+                    self._add_confid_stats(
+                        "val", "mcd_sv", tmp_confids, tmp_mcd_correct
                     )
 
         if "ood_ext" in confid_keys:
@@ -324,22 +401,29 @@ class ConfidMonitor(Callback):
                 else torch.ones_like(tmp_confids)
             )
             if tmp_confids is not None:
-                self.running_confid_stats["val"]["ood_ext"]["confids"].extend(
-                    -tmp_confids
-                )
-                self.running_confid_stats["val"]["ood_ext"]["correct"].extend(
-                    tmp_correct
-                )
+                self._add_confid_stats("val", "ood_ext", -tmp_confids, tmp_correct)
 
         if pl_module.current_epoch == self.num_epochs - 1:
-            self.running_test_softmax.extend(
-                softmax_dist if softmax_dist is not None else softmax
-            )
-            self.running_test_labels.extend(y)
+            last_outputs = {
+                "softmax": softmax_dist if softmax_dist is not None else softmax,
+                "labels": y,
+            }
             if outputs.get("confid") is not None:
-                self.running_test_external_confids.extend(outputs["confid"])
+                last_outputs["external_confids"] = outputs["confid"]
+            if keys is not None:
+                keep = keys[:, 1] >= 0
+                last_outputs = {k: v[keep] for k, v in last_outputs.items()}
+                self.running_test_sample_keys.append(keys[keep])
+            self.running_test_softmax.append(last_outputs["softmax"])
+            self.running_test_labels.append(last_outputs["labels"])
+            if "external_confids" in last_outputs:
+                self.running_test_external_confids.append(
+                    last_outputs["external_confids"]
+                )
 
     def on_validation_epoch_end(self, trainer, pl_module):
+        self._gather_confid_stats("val")
+        self.sample_counts["val"] = {}
 
         monitor_metrics = None
         if (
@@ -353,7 +437,7 @@ class ConfidMonitor(Callback):
                 else False
             )
             tqdm.write(
-                f'{self.running_confid_stats["val"].keys()} {[len(ix["confids"]) for ix in self.running_confid_stats["val"].values()]}'
+                f'{self.running_confid_stats["val"].keys()} {[len(next(iter(ix.values()))) for ix in self.running_confid_stats["val"].values()]}'
             )
             monitor_metrics, monitor_plots = eval_utils.monitor_eval(
                 self.running_confid_stats["val"],
@@ -362,6 +446,7 @@ class ConfidMonitor(Callback):
                 self.query_monitor_plots,
                 do_plot=do_plot,
                 ext_confid_name=pl_module.ext_confid_name,
+                render_plots=not self.async_monitor_plots,
             )
             tensorboard = pl_module.logger[0].experiment
             pl_module.log("step", pl_module.current_epoch, sync_dist=self.sync_dist)
@@ -373,8 +458,8 @@ class ConfidMonitor(Callback):
 
             if do_plot:
                 for k, v in monitor_plots.items():
-                    tensorboard.add_figure(
-                        "val/{}".format(k), v, pl_module.current_epoch
+                    self._add_figure(
+                        tensorboard, "val/{}".format(k), v, pl_module.current_epoch
                     )
 
         tqdm.write(f"CHECK VAL METRICS {str(monitor_metrics)}")
@@ -394,101 +479,158 @@ class ConfidMonitor(Callback):
                     )
                     pl_module.log("{}".format(metric), dummy, sync_dist=self.sync_dist)
 
-        self.running_confid_stats["val"] = {
-            k: {"confids": [], "correct": []} for k in self.query_confids["val"]
-        }
+        self._clear_confid_stats("val")
         self.running_perf_stats["val"] = {
             k: [] for k in self.query_performance_metrics["val"]
         }
         self.running_val_correct_sum_sanity = 0
 
-    def on_train_end(self, trainer, pl_module):
-        if len(self.running_test_softmax) > 0:
-            stacked_softmax = torch.stack(self.running_test_softmax, dim=0)
-            stacked_labels = torch.stack(self.running_test_labels, dim=0).unsqueeze(1)
-            stacked_dataset_idx = torch.zeros_like(stacked_labels)
-            raw_output = torch.cat(
-                [
-                    stacked_softmax.reshape(stacked_softmax.size()[0], -1),
-                    stacked_labels,
-                    stacked_dataset_idx,
-                ],
-                dim=1,
+    def _save_last_val_outputs(self, last_outputs):
+        stacked_softmax = last_outputs["softmax"]
+        stacked_labels = last_outputs["labels"].unsqueeze(1)
+        stacked_dataset_idx = torch.zeros_like(stacked_labels)
+        raw_output = torch.cat(
+            [
+                stacked_softmax.reshape(stacked_softmax.size()[0], -1),
+                stacked_labels,
+                stacked_dataset_idx,
+            ],
+            dim=1,
+        )
+        np.save(self.output_paths.fit.raw_output, raw_output.cpu().data.numpy())
+        tqdm.write(
+            "saved raw validation outputs to {}".format(
+                self.output_paths.fit.raw_output
+            )
+        )
+
+        if "external_confids" in last_outputs:
+            np.save(
+                self.output_paths.fit.external_confids,
+                last_outputs["external_confids"].cpu().data.numpy(),
             )
-            np.save(self.output_paths.fit.raw_output, raw_output.cpu().data.numpy())
             tqdm.write(
-                "saved raw validation outputs to {}".format(
-                    self.output_paths.fit.raw_output
+                "saved external confids validation outputs to {}".format(
+                    self.output_paths.fit.external_confids
                 )
             )
 
+    def on_train_end(self, trainer, pl_module):
+        if len(self.running_test_softmax) > 0:
+            last_outputs = {
+                "softmax": self.running_test_softmax.tensor(),
+                "labels": self.running_test_labels.tensor(),
+            }
             if len(self.running_test_external_confids) > 0:
-                stacked_external_confids = torch.stack(
-                    self.running_test_external_confids, dim=0
-                )
-                np.save(
-                    self.output_paths.fit.external_confids,
-                    stacked_external_confids.cpu().data.numpy(),
-                )
-                tqdm.write(
-                    "saved external confids validation outputs to {}".format(
-                        self.output_paths.fit.external_confids
-                    )
+                last_outputs[
+                    "external_confids"
+                ] = self.running_test_external_confids.tensor()
+            if len(self.running_test_sample_keys) > 0:
+                last_outputs = self._gather(
+                    last_outputs, self.running_test_sample_keys.tensor()
                 )
 
-            self.running_test_softmax = []
-            self.running_test_labels = []
-            self.running_test_external_confids = []
+            if trainer.is_global_zero:
+                self._save_last_val_outputs(last_outputs)
+
+            self.running_test_softmax.clear()
+            self.running_test_labels.clear()
+            self.running_test_external_confids.clear()
+            self.running_test_sample_keys.clear()
 
+        self.plot_worker.close()
         eval_utils.clean_logging(self.version_dir)
 
+    def _test_output_writer(self, name, dtype=None, compressed=None):
+        path = self.output_paths.test[name]
+        if compressed is None:
+            compressed = self.raw_output_format != "npy"
+        if not compressed:
+            # uncompressed, so analysis can memory-map instead of decompressing
+            path = os.path.splitext(path)[0] + ".npy"
+        return ArrayStreamWriter(path, dtype=dtype, compressed=compressed)
+
+    def on_test_start(self, trainer, pl_module):
+        self.sample_counts["test"] = {}
+        self.test_output_writers = {}
+        if not trainer.is_global_zero:
+            return
+        # outputs are streamed to disk per batch instead of being kept in memory
+        self.test_output_writers = {
+            "encoded_output": self._test_output_writer(
+                "encoded_output", dtype=np.float16, compressed=True
+            ),
+            "raw_output": self._test_output_writer(
+                "raw_output", dtype=self.raw_output_dtype
+            ),
+            "raw_output_dist": self._test_output_writer(
+                "raw_output_dist", dtype=self.raw_output_dtype
+            ),
+            "external_confids": self._test_output_writer("external_confids"),
+            "external_confids_dist": self._test_output_writer("external_confids_dist"),
+        }
+
     def on_test_batch_end(
         self, trainer, pl_module, outputs, batch, batch_idx, dataloader_idx
     ):
         outputs = pl_module.test_results
-        self.running_test_encoded.extend(
-            outputs["encoded"].to(dtype=torch.float16).cpu()
-        )
-        self.running_test_softmax.extend(
-            outputs["softmax"].to(dtype=torch.float64).cpu()
-        )
-        self.running_test_labels.extend(outputs["labels"].cpu())
+        batch_outputs = {
+            "encoded": outputs["encoded"].to(dtype=torch.float16),
+            "softmax": outputs["softmax"],
+            "labels": outputs["labels"],
+        }
         if "ext" in self.query_confids["test"]:
-            self.running_test_external_confids.extend(outputs["confid"].cpu())
-        if outputs.get("softmax_dist") is not None:
-            self.running_test_softmax_dist.extend(
-                outputs["softmax_dist"].to(dtype=torch.float64).cpu()
+            batch_outputs["confid"] = outputs["confid"]
+        for k in ["softmax_dist", "confid_dist"]:
+            if outputs.get(k) is not None:
+                batch_outputs[k] = outputs[k]
+
+        keys = self._sample_keys(
+            trainer,
+            "test",
+            dataloader_idx,
+            len(outputs["labels"]),
+            outputs["labels"].device,
+        )
+        if keys is not None:
+            # every rank holds a shard, gather the batch of all ranks in order
+            keep = keys[:, 1] >= 0
+            batch_outputs = self._gather(
+                {k: v[keep] for k, v in batch_outputs.items()}, keys[keep]
             )
-        if outputs.get("confid_dist") is not None:
-            self.running_test_external_confids_dist.extend(outputs["confid_dist"].cpu())
+        if not trainer.is_global_zero:
+            return
 
-        self.running_test_dataset_idx.extend(
-            torch.ones_like(outputs["labels"].cpu()) * dataloader_idx
-        )
+        batch_outputs = {k: v.cpu().numpy() for k, v in batch_outputs.items()}
+        writers = self.test_output_writers
+        labels = batch_outputs["labels"]
+        dataset_idx = np.full_like(labels, dataloader_idx)
+        softmax = batch_outputs["softmax"]
 
-    def on_test_end(self, trainer, pl_module):
-        stacked_encoded = torch.stack(self.running_test_encoded, dim=0)
-        # mit torch .cat dataset index dranpacken
-        stacked_softmax = torch.stack(self.running_test_softmax, dim=0)
-        stacked_labels = torch.stack(self.running_test_labels, dim=0).unsqueeze(1)
-        stacked_dataset_idx = torch.stack(
-            self.running_test_dataset_idx, dim=0
-        ).unsqueeze(1)
-        raw_output = torch.cat(
-            [
-                stacked_softmax.reshape(stacked_softmax.size()[0], -1),
-                stacked_labels,
-                stacked_dataset_idx,
-            ],
-            dim=1,
+        writers["encoded_output"].append(
+            np.concatenate([batch_outputs["encoded"], dataset_idx[:, None]], axis=1)
         )
-        encoded_output = torch.cat(
-            [
-                stacked_encoded,
-                stacked_dataset_idx,
-            ],
-            dim=1,
+        writers["raw_output"].append(
+            np.concatenate(
+                [
+                    softmax.reshape(len(softmax), -1),
+                    labels[:, None],
+                    dataset_idx[:, None],
+                ],
+                axis=1,
+            )
         )
+        if "confid" in batch_outputs:
+            writers["external_confids"].append(batch_outputs["confid"])
+        if "softmax_dist" in batch_outputs:
+            writers["raw_output_dist"].append(batch_outputs["softmax_dist"])
+        if "confid_dist" in batch_outputs:
+            writers["external_confids_dist"].append(batch_outputs["confid_dist"])
+
+    def on_test_end(self, trainer, pl_module):
+        if not trainer.is_global_zero:
+            return
+
         # try:
         #    trainer.datamodule.test_datasets[0].csv.to_csv(
         #        self.output_paths.test.attributions_output
@@ -501,52 +643,10 @@ class ConfidMonitor(Callback):
 
         except:
             pass
-        np.savez_compressed(
-            self.output_paths.test.encoded_output, encoded_output.cpu().data.numpy()
-        )
-        np.savez_compressed(
-            self.output_paths.test.raw_output, raw_output.cpu().data.numpy()
-        )
-        tqdm.write(
-            "saved raw test outputs to {}".format(self.output_paths.test.raw_output)
-        )
 
-        if len(self.running_test_softmax_dist) > 0:
-            stacked_softmax = torch.stack(self.running_test_softmax_dist, dim=0)
-            np.savez_compressed(
-                self.output_paths.test.raw_output_dist,
-                stacked_softmax.cpu().data.numpy(),
-            )
-            tqdm.write(
-                "saved softmax dist raw test outputs to {}".format(
-                    self.output_paths.test.raw_output_dist
-                )
-            )
-
-        if len(self.running_test_external_confids) > 0:
-            stacked_external_confids = torch.stack(
-                self.running_test_external_confids, dim=0
-            )
-            np.savez_compressed(
-                self.output_paths.test.external_confids,
-                stacked_external_confids.cpu().data.numpy(),
-            )
-            tqdm.write(
-                "saved ext confid raw test outputs to {}".format(
-                    self.output_paths.test.external_confids
-                )
-            )
-
-        if len(self.running_test_external_confids_dist) > 0:
-            stacked_external_confids_dist = torch.stack(
-                self.running_test_external_confids_dist, dim=0
-            )
-            np.savez_compressed(
-                self.output_paths.test.external_confids_dist,
-                stacked_external_confids_dist.cpu().data.numpy(),
-            )
-            tqdm.write(
-                "saved ext confid dist raw test outputs to {}".format(
-                    self.output_paths.test.external_confids_dist
-                )
-            )
+        written = close_all(
+            self.test_output_writers.values(), self.raw_output_compression_workers
+        )
+        for writer in written:
+            tqdm.write(f"saved {len(writer)} test outputs to {writer.path}")
+        self.test_output_writers = {}
@@ -1,13 +1,19 @@
 # TODO: Implement unit tests as we refactor
 import filecmp
+import os
 import shutil
+import subprocess
+import sys
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
 from PIL import Image
 import pytest
 from omegaconf import OmegaConf
 
 from fd_shifts import analysis
+from fd_shifts.analysis.results_store import KEY_COLUMNS, ResultsStore
 from fd_shifts.utils import exp_utils
 
 DATA_DIR = Path(__file__).absolute().parent / "data"
@@ -51,6 +57,20 @@ def mock_env(monkeypatch, tmp_test_dir):
     monkeypatch.setenv("DATASET_ROOT_DIR", "")
 
 
+def _check_group_results(store_path: Path, csv_dir: Path):
+    """The group store holds the values of all per-study csvs"""
+    stored = ResultsStore(store_path).load().set_index(KEY_COLUMNS).sort_index()
+    written = pd.concat(
+        pd.read_csv(path, index_col=0)
+        for path in sorted(csv_dir.glob("analysis_metrics_*.csv"))
+    ).set_index(KEY_COLUMNS)
+    assert sorted(written.columns) == sorted(stored.columns)
+    written = written[stored.columns].sort_index()
+    # the csvs do not tell None from nan and are rounded to 5 decimals
+    stored = stored.where(stored.notna(), np.nan)
+    pd.testing.assert_frame_equal(stored, written, check_dtype=False, rtol=0, atol=1e-5)
+
+
 def _check_dir_content(test_dir: Path, expected_dir: Path, snapshot):
     dcmp = filecmp.dircmp(test_dir, expected_dir, [".pytest_cache"])
 
@@ -59,6 +79,11 @@ def _check_dir_content(test_dir: Path, expected_dir: Path, snapshot):
             # these were copied over as input
             continue
 
+        if file == analysis.GROUP_RESULTS_STORE:
+            # group_dir is the test dir, the store has to match the csvs
+            _check_group_results(test_dir / file, test_dir)
+            continue
+
         if ".png" in file:
             # HACK: Matplotlib produces inconsistent pngs on different platforms
             assert Image.open(test_dir / file).size == snapshot
@@ -91,3 +116,497 @@ def test_analysis_blackbox(tmp_test_dir, data_dir, snapshot, mock_env):
 
 def test_ece():
     pass
+
+
+def test_analysis_import_skips_torch_and_plotting():
+    heavy = ["torch", "torchmetrics", "seaborn", "matplotlib"]
+    loaded = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; import fd_shifts.analysis, fd_shifts.analysis.eval_utils; "
+            f"print([m for m in {heavy!r} if m in sys.modules])",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+    assert loaded == "[]"
+
+
+def _write_raw_outputs(test_dir: Path, compressed: bool):
+    rng = np.random.default_rng(0)
+    n_samples, n_classes = 60, 4
+    softmax = rng.dirichlet(np.ones(n_classes), size=n_samples)
+    labels = rng.integers(0, n_classes, size=(n_samples, 1))
+    dataset_idx = np.repeat(np.arange(3), n_samples // 3)[:, None]
+    arrays = {
+        "raw_output": np.concatenate([softmax, labels, dataset_idx], axis=1),
+        "raw_output_dist": rng.dirichlet(np.ones(n_classes), size=(n_samples, 5))
+        .transpose(0, 2, 1)
+        .copy(),
+    }
+
+    test_dir.mkdir()
+    for name, array in arrays.items():
+        if compressed:
+            np.savez_compressed(test_dir / f"{name}.npz", array)
+        else:
+            np.save(test_dir / f"{name}.npy", array)
+    return arrays
+
+
+@pytest.mark.parametrize("holdout_classes", [None, [3]])
+def test_experiment_data_mmap_matches_npz(tmp_path, holdout_classes):
+    from fd_shifts.analysis.confid_scores import expected_entropy
+
+    _write_raw_outputs(tmp_path / "npz", compressed=True)
+    arrays = _write_raw_outputs(tmp_path / "npy", compressed=False)
+
+    from_npz = analysis.ExperimentData.from_experiment(
+        tmp_path / "npz", holdout_classes, config=OmegaConf.create()
+    )
+    from_npy = analysis.ExperimentData.from_experiment(
+        tmp_path / "npy", holdout_classes, config=OmegaConf.create()
+    )
+
+    # holdout runs read the files without a private copy as well
+    assert isinstance(from_npy.mcd_softmax_dist, np.memmap)
+    assert from_npy.mcd_softmax_dist.mode == "r"
+
+    softmax = arrays["raw_output"][:, :-2].copy()
+    mcd_softmax_dist = arrays["raw_output_dist"].copy()
+    if holdout_classes is not None:
+        softmax[:, holdout_classes] = 0
+        mcd_softmax_dist[:, :, holdout_classes] = 0
+    dataset_idx = arrays["raw_output"][:, -1]
+
+    for idx in range(3):
+        expected = from_npz.filter_dataset_by_index(idx)
+        actual = from_npy.filter_dataset_by_index(idx)
+        np.testing.assert_array_equal(
+            actual.softmax_output, softmax[dataset_idx == idx]
+        )
+        np.testing.assert_array_equal(actual.softmax_output, expected.softmax_output)
+        np.testing.assert_array_equal(actual.labels, expected.labels)
+        dist = mcd_softmax_dist[dataset_idx == idx]
+        np.testing.assert_array_equal(actual.mcd_softmax_mean, np.mean(dist, axis=2))
+        np.testing.assert_array_equal(
+            actual.feature("mcd_ee"), expected_entropy(np.mean(dist, axis=2), dist)
+        )
+        np.testing.assert_array_equal(actual.correct, expected.correct)
+
+    np.testing.assert_array_equal(
+        np.load(tmp_path / "npy" / "raw_output.npy"), arrays["raw_output"]
+    )
+
+
+def test_experiment_data_propagates_derived_arrays(tmp_path):
+    _write_raw_outputs(tmp_path / "npy", compressed=False)
+    data = analysis.ExperimentData.from_experiment(
+        tmp_path / "npy", config=OmegaConf.create()
+    )
+    assert data.correct is not None
+    assert data.mcd_correct is not None
+
+    filtered = data.filter_dataset_by_index(1)
+    assert filtered._correct is not None
+    assert filtered._mcd_softmax_mean is not None
+    assert filtered._mcd_correct is not None
+
+    fresh = analysis.ExperimentData(
+        softmax_output=filtered.softmax_output,
+        labels=filtered.labels,
+        dataset_idx=filtered.dataset_idx,
+        mcd_softmax_dist=filtered.mcd_softmax_dist,
+        config=filtered.config,
+    )
+    np.testing.assert_array_equal(filtered.correct, fresh.correct)
+    np.testing.assert_array_equal(filtered.mcd_softmax_mean, fresh.mcd_softmax_mean)
+    np.testing.assert_array_equal(filtered.mcd_correct, fresh.mcd_correct)
+
+
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_study_filters_use_dataset_groups(shuffle):
+    from fd_shifts.analysis.studies import (
+        filter_new_class_study_data,
+        filter_noise_study_data,
+    )
+
+    rng = np.random.default_rng(0)
+    n_per_set, n_classes = 150, 3
+    dataset_idx = np.repeat(np.arange(4), n_per_set).astype(float)
+    if shuffle:
+        dataset_idx = rng.permutation(dataset_idx)
+    config = OmegaConf.create(
+        {
+            "eval": {
+                "val_tuning": True,
+                "query_studies": {
+                    "iid_study": "iid",
+                    "new_class_study": ["new"],
+                    "noise_study": ["noise"],
+                },
+            }
+        }
+    )
+    data = analysis.ExperimentData(
+        softmax_output=rng.dirichlet(np.ones(n_classes), size=len(dataset_idx)),
+        labels=rng.integers(0, n_classes, size=len(dataset_idx)).astype(float),
+        dataset_idx=dataset_idx,
+        config=config,
+    )
+
+    for mode in ["original_mode", "proposed_mode"]:
+        study = filter_new_class_study_data(data, "iid", "new", mode)
+        is_out = dataset_idx == 2
+        correct = np.where(is_out, 0, data.correct)
+        if mode == "original_mode":
+            correct[dataset_idx == 1] = 1
+        select = is_out | ((dataset_idx == 1) & (correct == 1))
+        np.testing.assert_array_equal(study.softmax_output, data.softmax_output[select])
+        np.testing.assert_array_equal(study.correct, correct[select])
+        np.testing.assert_array_equal(
+            study.labels, np.where(is_out, -99, data.labels)[select]
+        )
+
+    study = filter_noise_study_data(data, "noise", noise_level=2)
+    noise_softmax = data.softmax_output[dataset_idx == 3]
+    np.testing.assert_array_equal(
+        study.softmax_output,
+        noise_softmax.reshape(15, 5, -1, n_classes)[:, 2].reshape(-1, n_classes),
+    )
+
+
+def test_study_filters_propagate_features():
+    from fd_shifts.analysis.confid_scores import (
+        MCD_DIST_FEATURES,
+        MCD_SOFTMAX_FEATURES,
+        SOFTMAX_FEATURES,
+        ConfidScore,
+        get_confid_function,
+    )
+    from fd_shifts.analysis.studies import (
+        filter_new_class_study_data,
+        filter_noise_study_data,
+    )
+
+    rng = np.random.default_rng(0)
+    n_per_set, n_classes, n_mcd = 150, 3, 4
+    dataset_idx = rng.permutation(np.repeat(np.arange(4), n_per_set)).astype(float)
+    mcd_softmax_dist = (
+        rng.dirichlet(np.ones(n_classes), size=(len(dataset_idx), n_mcd))
+        .transpose(0, 2, 1)
+        .copy()
+    )
+    config = OmegaConf.create(
+        {
+            "eval": {
+                "val_tuning": True,
+                "query_studies": {
+                    "iid_study": "iid",
+                    "new_class_study": ["new"],
+                    "noise_study": ["noise"],
+                },
+            }
+        }
+    )
+    data = analysis.ExperimentData(
+        softmax_output=mcd_softmax_dist.mean(axis=2),
+        labels=rng.integers(0, n_classes, size=len(dataset_idx)).astype(float),
+        dataset_idx=dataset_idx,
+        mcd_softmax_dist=mcd_softmax_dist,
+        config=config,
+    )
+    features = SOFTMAX_FEATURES + MCD_SOFTMAX_FEATURES + MCD_DIST_FEATURES
+    data.extract_features(features)
+
+    studies = [
+        filter_new_class_study_data(data, "iid", "new", "proposed_mode"),
+        filter_noise_study_data(data, "noise", noise_level=2),
+        data.filter_dataset_by_name("iid"),
+    ]
+    for study in studies:
+        assert sorted(study._features) == sorted(features)
+        for confid in ["det_mcp", "det_pe", "det_margin", "mcd_mcp", "mcd_ee"]:
+            score = ConfidScore(study, confid, analysis=None)
+            np.testing.assert_allclose(
+                score.confids, get_confid_function(confid)(*score.confid_args)
+            )
+            np.testing.assert_array_equal(
+                score.predict, np.argmax(score.softmax, axis=1)
+            )
+
+
+@pytest.fixture
+def synthetic_experiment(tmp_path, monkeypatch):
+    """Small experiment in the layout the analysis expects, with MCD outputs"""
+    rng = np.random.default_rng(0)
+    n_classes, n_mcd = 10, 5
+    set_sizes = [60, 60, 15 * 5 * 4, 60]  # val_tuning, iid, noise, new class
+
+    dataset_idx = np.repeat(np.arange(len(set_sizes)), set_sizes)
+    labels = rng.integers(0, n_classes, size=len(dataset_idx))
+    logits = rng.normal(size=(len(dataset_idx), n_classes))
+    logits[np.arange(len(labels)), labels] += 2
+    mcd_logits = logits[:, :, None] + rng.normal(size=(*logits.shape, n_mcd))
+    mcd_softmax = np.exp(mcd_logits) / np.exp(mcd_logits).sum(axis=1, keepdims=True)
+    # same predictions with and without MCD, new-class studies assume this
+    softmax = mcd_softmax.mean(axis=2)
+
+    test_dir = tmp_path / "experiment" / "test_results"
+    test_dir.mkdir(parents=True)
+    np.savez_compressed(
+        test_dir / "raw_output.npz",
+        np.concatenate([softmax, labels[:, None], dataset_idx[:, None]], axis=1),
+    )
+    np.savez_compressed(test_dir / "raw_output_dist.npz", mcd_softmax)
+    np.savez_compressed(
+        test_dir / "external_confids.npz", rng.uniform(size=len(dataset_idx))
+    )
+    np.savez_compressed(
+        test_dir / "external_confids_dist.npz",
+        rng.uniform(size=(len(dataset_idx), n_mcd)),
+    )
+
+    monkeypatch.setenv("EXPERIMENT_ROOT_DIR", str(tmp_path))
+    monkeypatch.setenv("DATASET_ROOT_DIR", "")
+    cf = OmegaConf.load(
+        DATA_DIR / "cifar10_modeldg_bbvit_lr0.01_bs128_run0_do0_rew6" / "config.yaml"
+    )
+    cf.exp.group_name = ""
+    cf.test.dir = str(test_dir)
+    cf.eval.query_studies = {
+        "iid_study": "cifar10_384",
+        "noise_study": ["corrupt_cifar10_384"],
+        "new_class_study": ["cifar100_384"],
+    }
+    cf.eval.confidence_measures.test = ["det_mcp", "ext", "mcd_pe"]
+    return cf
+
+
+def _run_synthetic_analysis(
+    cf,
+    out_dir: Path,
+    query_confid_metrics=("failauc", "aurc", "ece", "risk@95cov", "fpr@95tpr"),
+    plot_mode="none",
+    **kwargs,
+):
+    out_dir.mkdir(exist_ok=True)
+    experiment = analysis.Analysis(
+        path=cf.test.dir,
+        query_performance_metrics=["accuracy", "b-accuracy", "nll", "brier_score"],
+        query_confid_metrics=list(query_confid_metrics),
+        query_plots=["roc_curve", "rc_curve", "hist_per_confid"],
+        query_studies=cf.eval.query_studies,
+        analysis_out_dir=str(out_dir),
+        add_val_tuning=cf.eval.val_tuning,
+        threshold_plot_confid=None,
+        qual_plot_confid=None,
+        cf=cf,
+        plot_mode=plot_mode,
+        **kwargs,
+    )
+    experiment.register_and_perform_studies()
+    return experiment
+
+
+def test_parallel_studies_match_sequential(synthetic_experiment, tmp_path):
+    group_store = tmp_path / analysis.GROUP_RESULTS_STORE
+
+    _run_synthetic_analysis(synthetic_experiment, tmp_path / "sequential")
+    _check_group_results(group_store, tmp_path / "sequential")
+    sequential_results = ResultsStore(group_store).load()
+    group_store.unlink()
+
+    _run_synthetic_analysis(synthetic_experiment, tmp_path / "parallel", n_jobs=2)
+
+    pd.testing.assert_frame_equal(ResultsStore(group_store).load(), sequential_results)
+    csv_files = sorted(p.name for p in (tmp_path / "sequential").glob("*.csv"))
+    assert len(csv_files) == 9
+    for name in csv_files:
+        assert (tmp_path / "parallel" / name).read_text() == (
+            tmp_path / "sequential" / name
+        ).read_text()
+
+
+def test_deferred_master_plots(synthetic_experiment, tmp_path):
+    from fd_shifts.analysis.eval_utils import load_plot_stats, render_master_plots
+
+    out_dir = tmp_path / "deferred"
+    _run_synthetic_analysis(synthetic_experiment, out_dir, plot_mode="deferred")
+
+    assert not list(out_dir.glob("*.png"))
+    stats_paths = sorted(out_dir.glob("plot_stats_*.npz"))
+    assert len(stats_paths) == 9
+
+    input_dict, query_plots, bins = load_plot_stats(
+        out_dir / "plot_stats_iid_study.npz"
+    )
+    assert list(input_dict) == [
+        "experiment_det_mcp",
+        "experiment_dg",
+        "experiment_mcd_pe",
+    ]
+    assert "roc_curve" in query_plots and bins == 20
+    assert set(input_dict["experiment_dg"]["plot_stats"]) >= {"fpr_list", "tpr_list"}
+    # compact stats only, no per-sample confids
+    hist_stats = input_dict["experiment_dg"]["hist_stats"]
+    assert "confids" not in input_dict["experiment_dg"]
+    assert len(hist_stats["hist_edges"]) == bins + 1
+    assert hist_stats["hist_correct"].sum() == hist_stats["n_correct"]
+    assert (
+        hist_stats["hist_correct"].sum() + hist_stats["hist_incorrect"].sum()
+        == hist_stats["n_total"]
+    )
+    assert isinstance(input_dict["experiment_dg"]["metrics"]["failauc"], float)
+
+    render_master_plots(stats_paths[:2])
+    assert sorted(p.name for p in out_dir.glob("*.png")) == sorted(
+        p.name.replace("plot_stats_", "master_plot_").replace(".npz", ".png")
+        for p in stats_paths[:2]
+    )
+
+
+def test_plot_stats_thin_curves():
+    from fd_shifts.analysis.eval_utils import _thin_curve
+
+    curve = np.arange(10_001)
+    thinned = _thin_curve(curve, n_points=100)
+    assert len(thinned) == 100
+    assert thinned[0] == 0 and thinned[-1] == 10_000
+    assert np.all(np.diff(thinned) > 0)
+    np.testing.assert_array_equal(_thin_curve(curve[:50], n_points=100), curve[:50])
+
+
+def test_results_store_upserts_and_loads_partitions(tmp_path):
+    store = ResultsStore(tmp_path / "results.sqlite")
+    columns = ["name", "study", "model", "network", "fold", "confid", "n_test"]
+
+    def _study_df(study, aurc):
+        return pd.DataFrame(
+            [
+                ["run0", study, "vit", None, 0, "det_mcp", 100, aurc, None],
+                ["run0", study, "vit", None, 0, "mcd_pe", 100, aurc + 1, 0.5],
+            ],
+            columns=columns + ["aurc", "nll"],
+        )
+
+    store.write(_study_df("iid_study", 10.0))
+    store.write(_study_df("val_tuning", 20.0))
+    store.write(_study_df("iid_study", 30.0))  # rerun replaces
+
+    results = store.load()
+    assert len(results) == 4
+    assert list(results.columns) == [
+        "name",
+        "study",
+        "confid",
+        "model",
+        "network",
+        "fold",
+        "n_test",
+        "aurc",
+        "nll",
+    ]
+    assert np.isnan(
+        results.set_index(["study", "confid"]).loc[("val_tuning", "det_mcp"), "nll"]
+    )
+
+    iid = store.load(metrics=["aurc"], studies=["iid_study"])
+    assert list(iid.columns[-2:]) == ["n_test", "aurc"]
+    assert iid.set_index("confid")["aurc"].to_dict() == {
+        "det_mcp": 30.0,
+        "mcd_pe": 31.0,
+    }
+
+
+def test_incremental_analysis_computes_only_missing_metrics(
+    synthetic_experiment, tmp_path, monkeypatch
+):
+    metrics = ["failauc", "aurc", "risk@95cov", "risk@90cov", "ece"]
+    _run_synthetic_analysis(synthetic_experiment, tmp_path / "full", metrics)
+    assert not (tmp_path / "full" / analysis.MANIFEST_NAME).exists()
+
+    computed = []
+    get_metrics_per_confid = analysis.ConfidEvaluator.get_metrics_per_confid
+
+    def _record(self):
+        computed.append(tuple(self.query_metrics))
+        return get_metrics_per_confid(self)
+
+    monkeypatch.setattr(analysis.ConfidEvaluator, "get_metrics_per_confid", _record)
+
+    out_dir = tmp_path / "incremental"
+    _run_synthetic_analysis(
+        synthetic_experiment, out_dir, metrics[:2], incremental=True
+    )
+    computed.clear()
+    _run_synthetic_analysis(synthetic_experiment, out_dir, metrics, incremental=True)
+
+    assert len(computed) > 0
+    assert set(computed) == {("risk@95cov", "risk@90cov", "ece", "aurc")}
+    for path in sorted((tmp_path / "full").glob("*.csv")):
+        assert (out_dir / path.name).read_text() == path.read_text()
+
+    computed.clear()
+    _run_synthetic_analysis(synthetic_experiment, out_dir, metrics, incremental=True)
+    assert computed == []
+
+
+def test_manifest_invalidated_by_changed_inputs(synthetic_experiment, tmp_path):
+    from fd_shifts.analysis.manifest import AnalysisManifest
+
+    test_dir = Path(synthetic_experiment.test.dir)
+    manifest = AnalysisManifest.from_experiment(test_dir, "config")
+    manifest.record_study("iid_study", ["aurc"])
+
+    unchanged = AnalysisManifest.from_experiment(test_dir, "config", manifest)
+    assert unchanged.missing_metrics("iid_study", ["aurc", "ece"]) == ["ece"]
+    assert unchanged.inputs == manifest.inputs
+
+    other_config = AnalysisManifest.from_experiment(test_dir, "other", manifest)
+    assert other_config.missing_metrics("iid_study", ["aurc"]) == ["aurc"]
+
+    # nothing is hashed until a file's size or mtime changes
+    assert all("sha256" not in entry for entry in manifest.inputs.values())
+
+    path = test_dir / "external_confids.npz"
+    np.savez_compressed(path, np.zeros(3))
+    changed = AnalysisManifest.from_experiment(test_dir, "config", manifest)
+    assert changed.missing_metrics("iid_study", ["aurc"]) == ["aurc"]
+    assert "sha256" in changed.inputs["external_confids.npz"]
+
+    # touched but identical content keeps the recorded studies
+    changed.record_study("iid_study", ["aurc"])
+    os.utime(path, (0, 0))
+    touched = AnalysisManifest.from_experiment(test_dir, "config", changed)
+    assert touched.missing_metrics("iid_study", ["aurc"]) == []
+
+
+def test_profile_records_stages(synthetic_experiment, tmp_path):
+    from fd_shifts.analysis.profiling import (
+        PROFILE_NAME,
+        load_profiles,
+        summarize_profiles,
+    )
+
+    out_dir = tmp_path / "analysis"
+    _run_synthetic_analysis(synthetic_experiment, out_dir)
+    assert not (out_dir / PROFILE_NAME).exists()
+
+    _run_synthetic_analysis(synthetic_experiment, out_dir, profile=True)
+    profiles = load_profiles([out_dir / PROFILE_NAME])
+
+    assert {"load", "extract_features", "filter_studies", "risk_bound"} <= set(
+        profiles.stage
+    )
+    confid_metrics = profiles[profiles.stage == "confid_metrics"]
+    assert set(confid_metrics.study) == set(profiles.study.dropna())
+    assert set(confid_metrics.confid) == set(
+        synthetic_experiment.eval.confidence_measures.test
+    ) - {"ext"} | {synthetic_experiment.eval.ext_confid_name}
+
+    summary = summarize_profiles(profiles)
+    assert summary.set_index("stage").loc["load", "calls"] == 1
+    assert summary.total_s.is_monotonic_decreasing
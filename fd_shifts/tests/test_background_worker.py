@@ -0,0 +1,90 @@
+import threading
+
+import matplotlib
+import numpy as np
+import pytest
+import torch
+from matplotlib.figure import Figure
+
+from fd_shifts.analysis.eval_utils import monitor_eval, render_monitor_plot
+from fd_shifts.utils.background_worker import BackgroundWorker
+from fd_shifts.utils.tensor_buffer import TensorBuffer
+
+
+def _blocked_worker(drop):
+    worker = BackgroundWorker(max_pending=2, drop=drop)
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait()
+
+    worker.submit(block)
+    started.wait()
+    return worker, release
+
+
+@pytest.mark.parametrize("drop, expected", [("oldest", [2, 3]), ("newest", [0, 1])])
+def test_full_queue_drops_jobs(drop, expected):
+    worker, release = _blocked_worker(drop)
+    done = []
+
+    accepted = [worker.submit(done.append, i) for i in range(4)]
+    release.set()
+    worker.close()
+
+    assert accepted == [True, True, False, False]
+    assert worker.dropped == 2
+    assert done == expected
+
+
+def test_failing_job_does_not_stop_worker():
+    worker = BackgroundWorker()
+    done = []
+
+    worker.submit(lambda: 1 / 0)
+    worker.submit(done.append, 1)
+    worker.join()
+    assert done == [1]
+
+    worker.close()
+    worker.submit(done.append, 2)
+    worker.close()
+    assert done == [1, 2]
+
+
+def test_unknown_drop_policy():
+    with pytest.raises(ValueError):
+        BackgroundWorker(drop="random")
+
+
+def test_monitor_plot_rendered_from_plot_inputs():
+    rng = np.random.default_rng(0)
+    correct = torch.from_numpy((rng.uniform(size=200) < 0.8).astype(np.int64))
+    buffers = {"confids": TensorBuffer(), "correct": TensorBuffer()}
+    buffers["confids"].append(torch.from_numpy(rng.uniform(size=200)))
+    buffers["correct"].append(correct)
+
+    metrics, plots = monitor_eval(
+        {"det_mcp": buffers},
+        {},
+        ["failauc", "aurc"],
+        ["hist_per_confid", "rc_curve"],
+        render_plots=False,
+    )
+    plot_inputs = plots["default_plot"]
+
+    assert plot_inputs["metrics"] == metrics
+    assert plot_inputs["n_total"] == 200
+    assert plot_inputs["n_correct"] == int(correct.sum())
+
+    # the style is set while submitting, rendering must not touch it
+    rc_params = dict(matplotlib.rcParams)
+    worker = BackgroundWorker()
+    figures = []
+    worker.submit(lambda: figures.append(render_monitor_plot(**plot_inputs)))
+    worker.close()
+    assert dict(matplotlib.rcParams) == rc_params
+    assert isinstance(figures[0], Figure)
+    assert "total: 200" in figures[0]._suptitle.get_text()
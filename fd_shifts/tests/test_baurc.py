@@ -161,3 +161,71 @@ def test_lowprev_front_order_class_imbalance_low_lowerer_acc():
 
     print(baurc_value_front, baurc_value_rand)
     assert baurc_value_front < baurc_value_rand
+
+
+def _brc_curve_reference(confids, residuals, labels):
+    """Sample-by-sample implementation the vectorized curve has to reproduce"""
+    coverages = []
+    balanced_risks = []
+    error_per_class = {}
+    risk_per_class = {}
+    n_residuals = len(residuals)
+    idx_sorted = np.argsort(confids)
+    n_remaining_per_class = {}
+    coverage = n_residuals
+    for label in np.unique(labels):
+        idx_class = np.where(labels == label)[0]
+        error_per_class[label] = sum(residuals[idx_class])
+        n_remaining_per_class[label] = len(idx_class)
+        risk_per_class[label] = error_per_class[label] / n_remaining_per_class[label]
+    coverages.append(coverage / n_residuals)
+    balanced_risks.append(
+        np.array([x for x in risk_per_class.values() if x is not None]).mean()
+    )
+    weights = []
+    tmp_weight = 0
+    for i in range(0, len(idx_sorted) - 1):
+        coverage = coverage - 1
+        label = labels[idx_sorted[i]]
+        error_per_class[label] = error_per_class[label] - residuals[idx_sorted[i]]
+        n_remaining_per_class[label] = n_remaining_per_class[label] - 1
+        if n_remaining_per_class[label] < 1:
+            risk_per_class[label] = None
+        else:
+            risk_per_class[label] = error_per_class[label] / (
+                n_remaining_per_class[label]
+            )
+        tmp_weight += 1
+        if i == 0 or confids[idx_sorted[i]] != confids[idx_sorted[i - 1]]:
+            coverages.append(coverage / n_residuals)
+            balanced_risks.append(
+                np.array([x for x in risk_per_class.values() if x is not None]).mean()
+            )
+            weights.append(tmp_weight / n_residuals)
+            tmp_weight = 0
+    if tmp_weight > 0:
+        coverages.append(0)
+        balanced_risks.append(balanced_risks[-1])
+        weights.append(tmp_weight / n_residuals)
+    return coverages, balanced_risks, weights
+
+
+@pytest.mark.baurc
+@pytest.mark.parametrize("n_samples", [1, 2, 3, 1000])
+@pytest.mark.parametrize("n_classes", [1, 3, 50])
+@pytest.mark.parametrize("n_unique_confids", [None, 4])
+def test_brc_curve_parity(n_samples, n_classes, n_unique_confids):
+    rng = np.random.default_rng(n_samples * n_classes)
+    if n_unique_confids is None:
+        confids = rng.uniform(size=n_samples)
+    else:
+        confids = rng.integers(n_unique_confids, size=n_samples) / n_unique_confids
+    correct = rng.integers(2, size=n_samples)
+    labels = rng.integers(n_classes, size=n_samples).astype(float)
+
+    stat = StatsCache(confids=confids, correct=correct, n_bins=10, labels=labels)
+    expected = _brc_curve_reference(confids, 1 - correct, labels)
+
+    for exp, act in zip(expected, stat.brc_curve_stats):
+        assert len(exp) == len(act)
+        np.testing.assert_allclose(act, exp)
@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+import torch
+
+from fd_shifts.analysis import metrics
+from fd_shifts.analysis.binned_metrics import binned_metrics
+from fd_shifts.analysis.eval_utils import monitor_eval
+from fd_shifts.utils.confid_sketch import FailureSketch
+from fd_shifts.utils.tensor_buffer import TensorBuffer
+
+QUERY_METRICS = [
+    "failauc",
+    "fpr@95tpr",
+    "failap_suc",
+    "failap_err",
+    "aurc",
+    "e-aurc",
+    "ece",
+    "mce",
+]
+
+
+def _confids_and_correct(n_samples=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    correct = rng.uniform(size=n_samples) < 0.8
+    confids = np.clip(rng.normal(0.6 + 0.2 * correct, 0.15), 0, 1)
+    return confids, correct.astype(np.int64)
+
+
+def _sketch(confids, correct, batch_size=512):
+    sketch = FailureSketch()
+    for start in range(0, len(confids), batch_size):
+        sketch.update(
+            torch.from_numpy(confids[start : start + batch_size]),
+            torch.from_numpy(correct[start : start + batch_size]),
+        )
+    return sketch
+
+
+def _exact_metrics(confids, correct):
+    stats_cache = metrics.StatsCache(confids, correct, 20, None)
+    return {
+        name: metrics.get_metric_function(name)(stats_cache) for name in QUERY_METRICS
+    }
+
+
+def test_binned_metrics_exact_for_distinct_bucket_values():
+    # values that are exactly representable never share a bucket
+    rng = np.random.default_rng(0)
+    confids = rng.integers(1, 33, size=2000) / 32
+    correct = (rng.uniform(size=2000) < confids).astype(np.int64)
+
+    expected = _exact_metrics(confids, correct)
+    actual = binned_metrics(_sketch(confids, correct).binned_stats(), QUERY_METRICS)
+
+    for name in ["failauc", "fpr@95tpr", "failap_suc", "failap_err", "ece", "mce"]:
+        assert actual[name] == pytest.approx(expected[name], abs=1e-12), name
+
+
+def test_binned_metrics_approximate_continuous_confids():
+    confids, correct = _confids_and_correct()
+
+    expected = _exact_metrics(confids, correct)
+    actual = binned_metrics(_sketch(confids, correct).binned_stats(), QUERY_METRICS)
+
+    assert actual.keys() == expected.keys()
+    for name in ["failauc", "failap_suc", "failap_err", "fpr@95tpr", "ece"]:
+        assert actual[name] == pytest.approx(expected[name], abs=5e-3), name
+    for name in ["aurc", "e-aurc"]:
+        assert actual[name] == pytest.approx(expected[name], rel=2e-2), name
+
+
+def test_sketch_merge_matches_single_pass():
+    confids, correct = _confids_and_correct()
+    merged = _sketch(confids[:1234], correct[:1234])
+    merged.merge(_sketch(confids[1234:], correct[1234:]))
+    single = _sketch(confids, correct)
+
+    assert len(merged) == len(confids)
+    merged_stats, single_stats = merged.binned_stats(), single.binned_stats()
+    np.testing.assert_array_equal(merged_stats.n_correct, single_stats.n_correct)
+    np.testing.assert_allclose(merged_stats.confids, single_stats.confids)
+    assert merged_stats.min_confid == confids.min()
+    assert merged_stats.max_confid == confids.max()
+
+    merged.clear()
+    assert len(merged) == 0
+
+
+def test_sketch_orders_negative_and_large_values():
+    confids = np.array([-1e6, -3.5, -1e-3, 0.0, 2e-7, 0.5, 7.0, 1e9])
+    sketch = _sketch(confids, np.ones(len(confids), dtype=np.int64))
+
+    np.testing.assert_allclose(sketch.binned_stats().confids, confids)
+
+
+def test_monitor_eval_sketch_matches_buffers():
+    confids, correct = _confids_and_correct(seed=1)
+    # an uncertainty score, flipped and normalized in monitor_eval
+    entropy = -(confids * np.log(confids + 1e-7))
+    buffers = {"confids": TensorBuffer(), "correct": TensorBuffer()}
+    buffers["confids"].append(torch.from_numpy(entropy))
+    buffers["correct"].append(torch.from_numpy(correct))
+
+    expected, _ = monitor_eval(
+        {"det_pe": buffers}, {}, QUERY_METRICS, [], do_plot=False
+    )
+    actual, plots = monitor_eval(
+        {"det_pe": {"sketch": _sketch(entropy, correct)}},
+        {},
+        QUERY_METRICS,
+        [],
+        do_plot=True,
+    )
+
+    assert plots == {}
+    assert actual.keys() == expected.keys()
+    assert actual["det_pe_failauc"] == pytest.approx(
+        expected["det_pe_failauc"], abs=5e-3
+    )
+    assert actual["det_pe_aurc"] == pytest.approx(expected["det_pe_aurc"], rel=2e-2)
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from fd_shifts.analysis.confid_scores import (
+    MCD_DIST_CONFIDS,
+    get_confid_function,
+    mcd_dist_confids,
+)
+
+
+def _reference_confids(mcd_softmax_mean, mcd_softmax_dist):
+    """Full-array implementations the blockwise pass has to reproduce"""
+    entropy = mcd_softmax_dist * (-np.log(mcd_softmax_dist + 1e-7))
+    expected_entropy = np.mean(np.sum(entropy, axis=1), axis=1)
+    predictive_entropy = np.sum(
+        mcd_softmax_mean * (-np.log(mcd_softmax_mean + 1e-7)), axis=1
+    )
+    std = np.std(mcd_softmax_dist, axis=2)
+    return {
+        "mcd_pe": predictive_entropy,
+        "mcd_ee": expected_entropy,
+        "mcd_mi": predictive_entropy - expected_entropy,
+        "mcd_sv": np.mean(std, axis=1),
+        "mcd_waic": np.max(mcd_softmax_mean, axis=1)
+        - np.take(std, np.argmax(mcd_softmax_mean, axis=1)),
+    }
+
+
+@pytest.fixture
+def mcd_outputs():
+    rng = np.random.default_rng(0)
+    n_rows, n_classes, n_samples = 103, 7, 11
+    mcd_softmax_dist = (
+        rng.dirichlet(np.ones(n_classes), size=(n_rows, n_samples))
+        .transpose(0, 2, 1)
+        .copy()
+    )
+    return mcd_softmax_dist.mean(axis=2), mcd_softmax_dist
+
+
+@pytest.mark.parametrize("block_size", [None, 1, 10, 1000])
+def test_mcd_dist_confids_match_reference(mcd_outputs, block_size):
+    expected = _reference_confids(*mcd_outputs)
+    confids = mcd_dist_confids(*mcd_outputs, block_size=block_size)
+
+    assert list(confids) == MCD_DIST_CONFIDS
+    for name in MCD_DIST_CONFIDS:
+        np.testing.assert_allclose(confids[name], expected[name], rtol=1e-12)
+        np.testing.assert_allclose(
+            get_confid_function(name)(*mcd_outputs), expected[name], rtol=1e-12
+        )
+
+
+def test_mcd_dist_confids_float32(mcd_outputs):
+    expected = _reference_confids(*mcd_outputs)
+    confids = mcd_dist_confids(*mcd_outputs, block_size=16, dtype=np.float32)
+
+    for name in MCD_DIST_CONFIDS:
+        assert confids[name].dtype == np.float32
+        np.testing.assert_allclose(confids[name], expected[name], atol=1e-5)
+
+
+def test_mcd_dist_confids_subset(mcd_outputs):
+    confids = mcd_dist_confids(*mcd_outputs, ["mcd_sv"])
+
+    assert list(confids) == ["mcd_sv"]
+
+
+@pytest.mark.parametrize("block_size", [None, 1, 10])
+def test_mcd_waic_unchanged(mcd_outputs, block_size):
+    mcd_softmax_mean, mcd_softmax_dist = mcd_outputs
+    expected = np.max(mcd_softmax_mean, axis=1) - np.take(
+        np.std(mcd_softmax_dist, axis=2), np.argmax(mcd_softmax_mean, axis=1)
+    )
+
+    confids = mcd_dist_confids(*mcd_outputs, ["mcd_waic"], block_size=block_size)
+
+    np.testing.assert_array_equal(confids["mcd_waic"], expected)
@@ -0,0 +1,92 @@
+import os
+import socket
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader, DistributedSampler
+
+from fd_shifts.utils.distributed import all_gather_rows, sample_indices, sample_order
+
+N_SAMPLES = 11
+BATCH_SIZE = 3
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _sharded_run(rank, world_size, port, results):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+    try:
+        dataset = torch.arange(N_SAMPLES, dtype=torch.float64) * 10
+        loader = DataLoader(
+            dataset,
+            batch_size=BATCH_SIZE,
+            sampler=DistributedSampler(dataset, shuffle=False),
+        )
+        outputs, keys, seen = [], [], 0
+        for batch in loader:
+            indices = sample_indices(loader, seen, len(batch))
+            seen += len(batch)
+            keep = indices >= 0
+            outputs.append(batch[keep])
+            keys.append(torch.stack([torch.zeros_like(indices), indices], 1)[keep])
+
+        gathered = all_gather_rows(torch.cat(outputs))
+        order = sample_order(all_gather_rows(torch.cat(keys)))
+        if rank == 0:
+            results.put(gathered[order].tolist())
+    finally:
+        dist.destroy_process_group()
+
+
+def test_sharded_outputs_gather_into_dataset_order():
+    # more ranks than divide the dataset evenly, so the sampler pads
+    world_size = 3
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    port = _free_port()
+    processes = [
+        ctx.Process(target=_sharded_run, args=(rank, world_size, port, results))
+        for rank in range(world_size)
+    ]
+    for process in processes:
+        process.start()
+    gathered = results.get(timeout=120)
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    assert gathered == [10.0 * i for i in range(N_SAMPLES)]
+
+
+def test_sample_indices_mark_padding():
+    dataset = list(range(5))
+    loader = DataLoader(
+        dataset, sampler=DistributedSampler(dataset, 2, rank=1, shuffle=False)
+    )
+
+    assert sample_indices(loader, 0, 3).tolist() == [1, 3, -1]
+    assert sample_indices(DataLoader(dataset), 0, 3) is None
+
+
+def test_sample_order_sorts_by_dataloader_then_index():
+    keys = torch.tensor([[1, 0], [0, 2], [1, 1], [0, 0], [0, 1]])
+
+    assert keys[sample_order(keys)].tolist() == [
+        [0, 0],
+        [0, 1],
+        [0, 2],
+        [1, 0],
+        [1, 1],
+    ]
+
+
+def test_all_gather_rows_without_process_group():
+    rows = torch.ones(4, 2)
+    assert all_gather_rows(rows) is rows
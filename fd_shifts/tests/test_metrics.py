@@ -0,0 +1,244 @@
+import numpy as np
+import pytest
+from sklearn import metrics as skm
+
+from fd_shifts.analysis.metrics import (
+    StatsCache,
+    aurc,
+    failap_err,
+    failap_suc,
+    failauc,
+    fpr_at_95_tpr,
+    rc_curve,
+)
+
+
+def _rc_curve_reference(confids, residuals):
+    """Sample-by-sample implementation the vectorized curve has to reproduce"""
+    coverages = []
+    risks = []
+
+    n_residuals = len(residuals)
+    idx_sorted = np.argsort(confids)
+
+    coverage = n_residuals
+    error_sum = sum(residuals[idx_sorted])
+
+    coverages.append(coverage / n_residuals)
+    risks.append(error_sum / n_residuals)
+
+    weights = []
+
+    tmp_weight = 0
+    for i in range(0, len(idx_sorted) - 1):
+        coverage = coverage - 1
+        error_sum = error_sum - residuals[idx_sorted[i]]
+        selective_risk = error_sum / (n_residuals - 1 - i)
+        tmp_weight += 1
+        if i == 0 or confids[idx_sorted[i]] != confids[idx_sorted[i - 1]]:
+            coverages.append(coverage / n_residuals)
+            risks.append(selective_risk)
+            weights.append(tmp_weight / n_residuals)
+            tmp_weight = 0
+
+    if tmp_weight > 0:
+        coverages.append(0)
+        risks.append(risks[-1])
+        weights.append(tmp_weight / n_residuals)
+
+    return coverages, risks, weights
+
+
+@pytest.mark.parametrize("n_samples", [1, 2, 3, 100, 5000])
+@pytest.mark.parametrize("n_unique_confids", [None, 1, 2, 17])
+def test_rc_curve_parity(n_samples, n_unique_confids):
+    rng = np.random.default_rng(n_samples)
+    if n_unique_confids is None:
+        confids = rng.uniform(size=n_samples)
+    else:
+        confids = rng.integers(n_unique_confids, size=n_samples) / n_unique_confids
+    residuals = rng.integers(2, size=n_samples)
+
+    expected = _rc_curve_reference(confids, residuals)
+    actual = rc_curve(confids, residuals)
+
+    for exp, act in zip(expected, actual):
+        assert len(exp) == len(act)
+        np.testing.assert_allclose(act, exp)
+
+
+def test_aurc_parity():
+    rng = np.random.default_rng(0)
+    confids = np.round(rng.uniform(size=10000), 2)
+    correct = rng.integers(2, size=10000)
+    labels = rng.integers(5, size=10000)
+
+    _, risks, weights = _rc_curve_reference(confids, 1 - correct)
+    expected = sum(
+        [(risks[i] + risks[i + 1]) * 0.5 * weights[i] for i in range(len(weights))]
+    )
+
+    stats = StatsCache(confids=confids, correct=correct, n_bins=10, labels=labels)
+    assert aurc(stats) == pytest.approx(expected * 1000)
+
+
+@pytest.mark.parametrize("n_samples", [3, 100, 5000])
+@pytest.mark.parametrize("n_unique_confids", [None, 2, 17])
+def test_sorted_curves_match_sklearn(n_samples, n_unique_confids):
+    rng = np.random.default_rng(n_samples)
+    if n_unique_confids is None:
+        confids = rng.uniform(size=n_samples)
+    else:
+        confids = rng.integers(n_unique_confids, size=n_samples) / n_unique_confids
+    correct = np.r_[0, 1, rng.integers(2, size=n_samples - 2)]
+    labels = rng.integers(5, size=n_samples)
+
+    stats = StatsCache(confids=confids, correct=correct, n_bins=10, labels=labels)
+
+    fpr, tpr, _ = skm.roc_curve(correct, confids)
+    np.testing.assert_allclose(stats.roc_curve_stats[0], fpr)
+    np.testing.assert_allclose(stats.roc_curve_stats[1], tpr)
+    assert failauc(stats) == pytest.approx(skm.auc(fpr, tpr))
+    assert fpr_at_95_tpr(stats) == pytest.approx(
+        np.min(fpr[np.argwhere(tpr >= 0.9495)])
+    )
+
+    assert failap_suc(stats) == pytest.approx(
+        skm.average_precision_score(correct, confids, pos_label=1)
+    )
+    assert failap_err(stats) == pytest.approx(
+        skm.average_precision_score(correct, -confids, pos_label=0)
+    )
+
+
+@pytest.mark.parametrize("n_samples", [3, 100, 2000])
+@pytest.mark.parametrize("n_unique_confids", [None, 2, 17])
+def test_batched_metrics_match_stats_cache(n_samples, n_unique_confids):
+    from fd_shifts.analysis.batched_metrics import batched_confid_metrics
+    from fd_shifts.analysis.metrics import get_metric_function
+
+    rng = np.random.default_rng(n_samples)
+    n_confids = 4
+    if n_unique_confids is None:
+        confids = rng.uniform(size=(n_samples, n_confids))
+    else:
+        confids = (
+            rng.integers(n_unique_confids, size=(n_samples, n_confids))
+            / n_unique_confids
+        )
+    correct = np.r_[0, 1, rng.integers(2, size=n_samples - 2)]
+    labels = rng.integers(5, size=n_samples)
+    names = [f"confid_{i}" for i in range(n_confids)]
+    query_metrics = [
+        "failauc",
+        "fpr@95tpr",
+        "failap_suc",
+        "failap_err",
+        "aurc",
+        "e-aurc",
+        "mce",
+        "ece",
+        "fail-NLL",
+    ]
+
+    df = batched_confid_metrics(confids, correct, names, query_metrics, n_bins=20)
+
+    assert list(df["confid"]) == names
+    for i, name in enumerate(names):
+        stats = StatsCache(
+            confids=confids[:, i], correct=correct, n_bins=20, labels=labels
+        )
+        for metric in query_metrics:
+            expected = get_metric_function(metric)(stats)
+            assert df.loc[i, metric] == pytest.approx(expected), (name, metric)
+
+
+def test_bootstrap_matches_per_resample_metrics():
+    from fd_shifts.analysis import bootstrap
+    from fd_shifts.analysis.metrics import get_metric_function
+
+    rng = np.random.default_rng(0)
+    confids = rng.uniform(size=300)
+    correct = (rng.uniform(size=300) < confids).astype(int)
+    labels = rng.integers(3, size=300)
+    query_metrics = ["failauc", "aurc", "b-aurc", "ece", "risk@95cov"]
+
+    samples = bootstrap.bootstrap_metric_samples(
+        confids, correct, query_metrics, labels, n_bootstrap=20, chunk_size=7
+    )
+
+    assert set(samples.keys()) == {"failauc", "aurc", "b-aurc", "ece"}
+    indices = bootstrap.draw_bootstrap_indices(300, 20)
+    for metric, values in samples.items():
+        expected = [
+            get_metric_function(metric)(
+                StatsCache(confids[idx], correct[idx], 20, labels[idx])
+            )
+            for idx in indices
+        ]
+        np.testing.assert_allclose(values, expected)
+
+    cis = bootstrap.percentile_ci(samples)
+    assert cis["aurc_ci_low"] <= cis["aurc_ci_high"]
+    assert list(cis.keys())[:2] == bootstrap.ci_metric_names(query_metrics)[:2]
+
+
+def _val_risk_scores_reference(confids, residuals, rstar, delta):
+    """Bisection-based implementation the closed-form search has to reproduce"""
+    import math
+
+    import scipy.stats
+
+    def calculate_bound(delta, m, erm):
+        def func(b):
+            return (-1 * delta) + scipy.stats.binom.cdf(int(m * erm), m, b)
+
+        a, c = erm, 1
+        b = (a + c) / 2
+        funcval = func(b)
+        while abs(funcval) > 1e-9:
+            if a == 1.0 and c == 1.0:
+                b = 1.0
+                break
+            elif funcval > 0:
+                a = b
+            else:
+                c = b
+            b = (a + c) / 2
+            funcval = func(b)
+        return b
+
+    m = len(residuals)
+    idx_sorted = np.argsort(confids)
+    a, b = 0, m - 1
+    deltahat = delta / math.ceil(math.log2(m))
+    for _ in range(math.ceil(math.log2(m)) + 1):
+        mid = math.ceil((a + b) / 2)
+        mi = len(residuals[idx_sorted[mid:]])
+        theta = confids[idx_sorted[mid]]
+        risk = sum(residuals[idx_sorted[mid:]]) / mi
+        bound = calculate_bound(deltahat, mi, risk)
+        if bound > rstar:
+            a = mid
+        else:
+            b = mid
+    return {"theta": theta, "val_risk": risk, "val_cov": mi / m, "bound": bound}
+
+
+@pytest.mark.parametrize("rstar", [0.05, 0.25])
+def test_selective_risk_thresholds_match_bisection(rstar):
+    from fd_shifts.analysis.metrics import selective_risk_thresholds
+
+    rng = np.random.default_rng(0)
+    confids = rng.uniform(size=2000)
+    residuals = (rng.uniform(size=2000) > confids).astype(int)
+    deltas = [0.001, 0.05, 0.1]
+
+    thresholds = selective_risk_thresholds(confids, residuals, rstar, deltas)
+
+    for ix, delta in enumerate(deltas):
+        expected = _val_risk_scores_reference(confids, residuals, rstar, delta)
+        assert thresholds["theta"][ix] == expected["theta"]
+        assert thresholds["val_risk"][ix] == pytest.approx(expected["val_risk"])
+        assert thresholds["val_cov"][ix] == pytest.approx(expected["val_cov"])
+        assert thresholds["bound"][ix] == pytest.approx(expected["bound"], abs=1e-6)
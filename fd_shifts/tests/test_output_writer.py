@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from omegaconf import OmegaConf
+
+from fd_shifts import analysis
+from fd_shifts.utils.output_writer import ArrayStreamWriter, close_all
+
+
+def _batches(shape, sizes, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.uniform(size=(n, *shape)) for n in sizes]
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_stream_writer_matches_concatenation(tmp_path, compressed):
+    batches = _batches((4, 3), [5, 1, 0, 17])
+    path = tmp_path / ("out.npz" if compressed else "out.npy")
+    writer = ArrayStreamWriter(path, compressed=compressed, chunk_bytes=100)
+    for batch in batches:
+        writer.append(batch)
+
+    assert writer.close()
+    assert len(writer) == 23
+    assert not (tmp_path / "out.npz.part").exists()
+    if compressed:
+        with np.load(path) as npz:
+            actual = npz.f.arr_0
+    else:
+        actual = np.load(path, mmap_mode="r")
+        assert isinstance(actual, np.memmap)
+    np.testing.assert_array_equal(actual, np.concatenate(batches))
+
+
+def test_stream_writer_casts_and_checks_shape(tmp_path):
+    writer = ArrayStreamWriter(tmp_path / "out.npy", dtype="float16")
+    writer.append(np.ones((2, 3)))
+    with pytest.raises(ValueError):
+        writer.append(np.ones((2, 4)))
+    writer.close()
+
+    assert np.load(tmp_path / "out.npy").dtype == np.float16
+
+
+def test_close_all_compresses_concurrently(tmp_path):
+    writers = [
+        ArrayStreamWriter(tmp_path / f"{name}.npz", compressed=True)
+        for name in ["a", "b", "c"]
+    ]
+    writers.append(ArrayStreamWriter(tmp_path / "d.npy"))
+    writers.append(ArrayStreamWriter(tmp_path / "empty.npz", compressed=True))
+    batches = _batches((2,), [3, 4], seed=1)
+    for writer in writers[:-1]:
+        for batch in batches:
+            writer.append(batch)
+
+    written = close_all(writers, num_workers=3)
+
+    assert written == writers[:-1]
+    assert not (tmp_path / "empty.npz").exists()
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "a.npz",
+        "b.npz",
+        "c.npz",
+        "d.npy",
+    ]
+    with np.load(tmp_path / "c.npz") as npz:
+        np.testing.assert_array_equal(npz.f.arr_0, np.concatenate(batches))
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_streamed_outputs_load_in_analysis(tmp_path, compressed):
+    rng = np.random.default_rng(0)
+    suffix = ".npz" if compressed else ".npy"
+    raw_output = ArrayStreamWriter(
+        tmp_path / f"raw_output{suffix}", dtype="float32", compressed=compressed
+    )
+    raw_output_dist = ArrayStreamWriter(
+        tmp_path / f"raw_output_dist{suffix}", dtype="float32", compressed=compressed
+    )
+    for dataset_idx in range(2):
+        softmax_dist = rng.dirichlet(np.ones(3), size=(8, 5)).transpose(0, 2, 1)
+        labels = rng.integers(0, 3, size=8)
+        raw_output.append(
+            np.concatenate(
+                [
+                    softmax_dist.mean(axis=2),
+                    labels[:, None],
+                    np.full((8, 1), dataset_idx),
+                ],
+                axis=1,
+            )
+        )
+        raw_output_dist.append(softmax_dist)
+    close_all([raw_output, raw_output_dist])
+
+    data = analysis.ExperimentData.from_experiment(tmp_path, config=OmegaConf.create())
+
+    assert data.softmax_output.shape == (16, 3)
+    assert data.mcd_softmax_dist.shape == (16, 3, 5)
+    np.testing.assert_array_equal(data.dataset_idx, np.repeat([0, 1], 8))
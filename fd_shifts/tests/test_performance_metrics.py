@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from fd_shifts.analysis import performance_metrics as performance
+
+
+@pytest.fixture(params=[2, 10, 1000])
+def predictions(request):
+    rng = np.random.default_rng(request.param)
+    n_samples, n_classes = 500, request.param
+    softmax = rng.dirichlet(np.ones(n_classes), size=n_samples)
+    labels = rng.integers(0, n_classes, size=n_samples).astype(float)
+    correct = (np.argmax(softmax, axis=1) == labels).astype(int)
+    return softmax, labels, correct
+
+
+def test_nll_matches_one_hot(predictions):
+    softmax, labels, _ = predictions
+    y_one_hot = np.eye(softmax.shape[1])[labels.astype("int")]
+
+    np.testing.assert_allclose(
+        performance.nll(softmax, labels),
+        np.mean(-np.log(softmax + 1e-7) * y_one_hot),
+        rtol=1e-12,
+    )
+
+
+def test_brier_score_matches_one_hot(predictions):
+    softmax, labels, _ = predictions
+    y_one_hot = np.eye(softmax.shape[1])[labels.astype("int")]
+
+    np.testing.assert_allclose(
+        performance.brier_score(softmax, labels),
+        np.mean(np.sum((softmax - y_one_hot) ** 2, axis=1)),
+        rtol=1e-12,
+    )
+
+
+@pytest.mark.parametrize("with_new_class", [False, True])
+def test_balanced_accuracy_matches_class_loop(predictions, with_new_class):
+    _, labels, correct = predictions
+    if with_new_class:
+        labels = labels.copy()
+        labels[::7] = -99
+        correct = np.where(labels == -99, 0, correct)
+
+    expected = np.mean([np.mean(correct[labels == c]) for c in np.unique(labels)])
+
+    np.testing.assert_allclose(
+        performance.balanced_accuracy(labels, correct), expected, rtol=1e-12
+    )
+    assert performance.accuracy(correct) == np.sum(correct) / correct.size
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+import torch
+
+from fd_shifts.analysis.eval_utils import monitor_eval
+from fd_shifts.utils.tensor_buffer import TensorBuffer
+
+
+def test_tensor_buffer_grows_and_matches_concatenation():
+    rng = np.random.default_rng(0)
+    batches = [torch.from_numpy(rng.uniform(size=n)) for n in [3, 1, 7, 0, 30, 2]]
+    buffer = TensorBuffer(initial_capacity=4)
+    for batch in batches:
+        buffer.append(batch)
+
+    assert len(buffer) == 43
+    np.testing.assert_array_equal(buffer.numpy(), torch.cat(batches).numpy())
+
+    copy = buffer.numpy()
+    buffer.clear()
+    buffer.append(torch.zeros(5, dtype=torch.float64))
+    assert len(buffer) == 5
+    np.testing.assert_array_equal(copy, torch.cat(batches).numpy())
+
+
+def test_tensor_buffer_keeps_trailing_dims():
+    buffer = TensorBuffer(initial_capacity=1)
+    buffer.append(torch.ones(2, 3, 4))
+    buffer.append(torch.zeros(5, 3, 4))
+
+    assert buffer.tensor().shape == (7, 3, 4)
+    assert buffer.numpy()[:2].all() and not buffer.numpy()[2:].any()
+
+
+@pytest.mark.parametrize("confid", ["det_mcp", "det_pe"])
+def test_monitor_eval_buffer_matches_sample_lists(confid):
+    rng = np.random.default_rng(0)
+    batches = [
+        (
+            torch.from_numpy(rng.uniform(size=32)),
+            torch.from_numpy((rng.uniform(size=32) > 0.3).astype(np.uint8)),
+        )
+        for _ in range(5)
+    ]
+    lists = {"confids": [], "correct": []}
+    buffers = {"confids": TensorBuffer(), "correct": TensorBuffer()}
+    for confids, correct in batches:
+        lists["confids"].extend(confids)
+        lists["correct"].extend(correct)
+        buffers["confids"].append(confids)
+        buffers["correct"].append(correct)
+
+    metrics = ["failauc", "failap_err", "aurc", "ece"]
+    from_lists, _ = monitor_eval({confid: lists}, {}, metrics, [], do_plot=False)
+    from_buffers, _ = monitor_eval({confid: buffers}, {}, metrics, [], do_plot=False)
+
+    assert from_lists == from_buffers
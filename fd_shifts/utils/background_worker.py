@@ -0,0 +1,87 @@
+"""Running slow side jobs, like rendering monitor plots, off the training loop.
+
+Jobs run one after another on a daemon thread and are fed through a bounded
+queue. When jobs come in faster than they finish, the queue does not grow but
+drops jobs, so a slow job can never hold up or exhaust the memory of training.
+"""
+
+from __future__ import annotations
+
+import queue
+import threading
+from typing import Callable
+
+from loguru import logger
+
+_DROP_POLICIES = ("oldest", "newest")
+
+
+class BackgroundWorker:
+    def __init__(self, max_pending: int = 2, drop: str = "oldest"):
+        """
+        Args:
+            max_pending: Number of jobs waiting to run before jobs get dropped
+            drop: Which job to drop when the queue is full, the ``"oldest"``
+                waiting job or the ``"newest"`` one being submitted
+        """
+        if drop not in _DROP_POLICIES:
+            raise ValueError(f"drop has to be one of {_DROP_POLICIES}, got {drop}")
+        self.drop = drop
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                func, args, kwargs = job
+                try:
+                    func(*args, **kwargs)
+                except Exception:
+                    logger.exception("background job {} failed", func)
+            finally:
+                self._queue.task_done()
+
+    def submit(self, func: Callable, *args, **kwargs) -> bool:
+        """Queue ``func(*args, **kwargs)`` to run in the background
+
+        Returns:
+            False if a job had to be dropped for this one
+        """
+        job = (func, args, kwargs)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            try:
+                self._queue.put_nowait(job)
+                return True
+            except queue.Full:
+                self.dropped += 1
+                if self.drop == "newest":
+                    return False
+            # only the worker takes jobs out meanwhile, so there is room after
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+            except queue.Empty:
+                pass
+            self._queue.put_nowait(job)
+            return False
+
+    def join(self):
+        """Wait until all queued jobs have run"""
+        self._queue.join()
+
+    def close(self):
+        """Run the queued jobs and stop the thread, a later submit restarts it"""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
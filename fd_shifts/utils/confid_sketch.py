@@ -0,0 +1,126 @@
+"""Mergeable histogram of confids and correctness for online failure metrics.
+
+Confids are bucketed by the leading bits of their float32 representation,
+which orders the buckets like the values and gives every bucket the same
+relative width over the whole float range, so no value range has to be known
+upfront. Updates are O(batch) scatter-adds on the device of the batch and
+sketches of different batches, dataloaders or ranks merge by summation.
+"""
+
+from __future__ import annotations
+
+import torch
+
+from fd_shifts.analysis.binned_metrics import BinnedStats
+
+
+class FailureSketch:
+    def __init__(self, mantissa_bits: int = 7):
+        """
+        Args:
+            mantissa_bits: Mantissa bits of a confid kept in its bucket, the
+                relative bucket width is ``2**-mantissa_bits`` and the sketch
+                has ``2**(mantissa_bits + 9)`` buckets
+        """
+        self.shift = 23 - mantissa_bits
+        self.num_buckets = 2 ** (32 - self.shift)
+        self._counts: torch.Tensor | None = None
+        self._confid_sums: torch.Tensor | None = None
+        self._extrema: torch.Tensor | None = None
+
+    def __len__(self) -> int:
+        if self._counts is None:
+            return 0
+        return int(self._counts.sum())
+
+    def _allocate(self, device: torch.device):
+        # counts of incorrect and correct predictions per bucket
+        self._counts = torch.zeros(
+            2 * self.num_buckets, dtype=torch.int64, device=device
+        )
+        self._confid_sums = torch.zeros(
+            self.num_buckets, dtype=torch.float64, device=device
+        )
+        # -min and max, so both reduce with a maximum
+        self._extrema = torch.full(
+            (2,), -float("inf"), dtype=torch.float64, device=device
+        )
+
+    def _buckets(self, confids: torch.Tensor) -> torch.Tensor:
+        bits = confids.to(torch.float32).contiguous().view(torch.int32)
+        # negative floats are stored as sign and magnitude, flip their order
+        ordered = torch.where(bits < 0, -(bits & 0x7FFFFFFF) - 1, bits)
+        return (ordered >> self.shift).long() + self.num_buckets // 2
+
+    def update(self, confids: torch.Tensor, correct: torch.Tensor):
+        """Add a batch of confids and whether their predictions were correct"""
+        confids = confids.detach().reshape(-1)
+        if self._counts is None:
+            self._allocate(confids.device)
+        buckets = self._buckets(confids)
+        correct = correct.detach().reshape(-1).long()
+
+        self._counts.index_add_(
+            0,
+            correct * self.num_buckets + buckets,
+            torch.ones_like(buckets),
+        )
+        confids = confids.to(torch.float64)
+        self._confid_sums.index_add_(0, buckets, confids)
+        if len(confids) > 0:
+            self._extrema = torch.maximum(
+                self._extrema, torch.stack([-confids.min(), confids.max()])
+            )
+
+    def merge(self, other: FailureSketch):
+        """Add the counts of another sketch with the same bucketing"""
+        if other.shift != self.shift:
+            raise ValueError("Cannot merge sketches with different bucket widths")
+        if other._counts is None:
+            return
+        if self._counts is None:
+            self._allocate(other._counts.device)
+        self._counts += other._counts.to(self._counts.device)
+        self._confid_sums += other._confid_sums.to(self._confid_sums.device)
+        self._extrema = torch.maximum(
+            self._extrema, other._extrema.to(self._extrema.device)
+        )
+
+    def sync(self):
+        """Sum the sketches of all distributed ranks in place
+
+        Has to be called on every rank, and only once per accumulation.
+        """
+        if not (
+            torch.distributed.is_available() and torch.distributed.is_initialized()
+        ):
+            return
+        if self._counts is None:
+            self._allocate(
+                torch.device("cuda", torch.cuda.current_device())
+                if torch.cuda.is_available()
+                else torch.device("cpu")
+            )
+        torch.distributed.all_reduce(self._counts)
+        torch.distributed.all_reduce(self._confid_sums)
+        torch.distributed.all_reduce(self._extrema, op=torch.distributed.ReduceOp.MAX)
+
+    def clear(self):
+        """Reset all counts, keeping the memory for the next epoch"""
+        if self._counts is not None:
+            self._counts.zero_()
+            self._confid_sums.zero_()
+            self._extrema.fill_(-float("inf"))
+
+    def binned_stats(self, n_bins: int = 20) -> BinnedStats:
+        """Non-empty buckets on the host, for computing failure metrics"""
+        counts = self._counts.view(2, -1).cpu().numpy()
+        extrema = self._extrema.cpu().numpy()
+        return BinnedStats.from_sums(
+            self._confid_sums.cpu().numpy(),
+            n_correct=counts[1],
+            n_incorrect=counts[0],
+            min_confid=-extrema[0],
+            max_confid=extrema[1],
+            n_bins=n_bins,
+        )
@@ -0,0 +1,73 @@
+"""Gathering per-sample outputs of distributed evaluation in dataset order.
+
+An unshuffled ``DistributedSampler`` hands the ``k``-th sample of rank ``r``
+the dataset index ``r + k * world_size`` and pads the last round with samples
+from the start of the dataset. Knowing this, every rank can drop its padding
+and tag its samples with their dataset index. The gathered samples of all ranks
+are then sorted back into the order of a single-process run.
+"""
+
+from __future__ import annotations
+
+import torch
+import torch.distributed as dist
+from torch.utils.data import DistributedSampler
+
+
+def is_distributed() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def sample_indices(
+    dataloader, start: int, size: int, device=None
+) -> torch.Tensor | None:
+    """Dataset indices of the next ``size`` samples this rank draws
+
+    Args:
+        dataloader: Dataloader the samples come from
+        start: Number of samples this rank already drew from it
+        size: Number of samples in the batch
+
+    Returns:
+        the indices, padding samples are marked with ``-1``, or None if the
+        dataloader does not shard the dataset in a known order
+    """
+    sampler = getattr(dataloader, "sampler", None)
+    if not isinstance(sampler, DistributedSampler) or sampler.shuffle:
+        return None
+    positions = torch.arange(start, start + size, device=device)
+    indices = sampler.rank + positions * sampler.num_replicas
+    return torch.where(indices < len(sampler.dataset), indices, -1)
+
+
+def all_gather_rows(tensor: torch.Tensor) -> torch.Tensor:
+    """Rows of the tensors of all ranks, concatenated in rank order
+
+    Ranks may hold different numbers of rows, they are padded to the longest
+    for the gather and the padding is removed again.
+    """
+    if not is_distributed():
+        return tensor
+    world_size = dist.get_world_size()
+    size = torch.tensor([len(tensor)], device=tensor.device)
+    sizes = [torch.zeros_like(size) for _ in range(world_size)]
+    dist.all_gather(sizes, size)
+    sizes = [int(s) for s in sizes]
+
+    padded = tensor.new_zeros((max(sizes), *tensor.shape[1:]))
+    padded[: len(tensor)] = tensor
+    gathered = [torch.empty_like(padded) for _ in range(world_size)]
+    dist.all_gather(gathered, padded)
+    return torch.cat([rows[:n] for rows, n in zip(gathered, sizes)], dim=0)
+
+
+def sample_order(keys: torch.Tensor) -> torch.Tensor:
+    """Permutation sorting rows by dataloader and dataset index
+
+    Args:
+        keys: Dataloader index and dataset index per row, shape ``(n, 2)``
+    """
+    if len(keys) == 0:
+        return torch.arange(0, device=keys.device)
+    composite = keys[:, 0] * (keys[:, 1].max() + 1) + keys[:, 1]
+    return torch.argsort(composite)
@@ -0,0 +1,152 @@
+"""Stream per-batch test outputs to disk instead of holding them in memory.
+
+Every output is appended batch by batch to an uncompressed ``.npy`` file whose
+header reserves room for the row count and is rewritten on close, so host
+memory stays at one batch independent of the size of the test set. Outputs
+stored as ``.npz`` are spooled to a ``.part`` file next to the target first and
+deflated into the archive on close, several outputs at a time if requested.
+"""
+
+from __future__ import annotations
+
+import os
+import struct
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Iterable
+
+import numpy as np
+import numpy.typing as npt
+
+# enough digits for any row count, the header is padded back to this length
+_PLACEHOLDER_ROWS = 10**19
+_HEADER_ALIGN = 64
+
+
+def _npy_header(dtype: np.dtype, shape: tuple[int, ...], size: int = 0) -> bytes:
+    """Version 1.0 ``.npy`` header padded with spaces to at least ``size`` bytes"""
+    header = repr(
+        {
+            "descr": np.lib.format.dtype_to_descr(dtype),
+            "fortran_order": False,
+            "shape": shape,
+        }
+    )
+    prefix = len(np.lib.format.magic(1, 0)) + 2
+    total = max(size, prefix + len(header) + 1)
+    total = -(-total // _HEADER_ALIGN) * _HEADER_ALIGN
+    header = header.ljust(total - prefix - 1) + "\n"
+    return (
+        np.lib.format.magic(1, 0)
+        + struct.pack("<H", len(header))
+        + header.encode("latin1")
+    )
+
+
+class ArrayStreamWriter:
+    def __init__(
+        self,
+        path: str | Path,
+        dtype: npt.DTypeLike | None = None,
+        compressed: bool = False,
+        chunk_bytes: int = 2**26,
+    ):
+        """
+        Args:
+            path: Target file, a ``.npz`` archive if compressed and ``.npy``
+                otherwise
+            dtype: Rows are cast to this dtype, defaults to the dtype of the
+                first batch
+            compressed: Deflate the output into a ``.npz`` archive on close
+            chunk_bytes: Bytes read from the spool at a time while compressing
+        """
+        self.path = Path(path)
+        self.dtype = np.dtype(dtype) if dtype is not None else None
+        self.compressed = compressed
+        self.chunk_bytes = chunk_bytes
+        self._file = None
+        self._row_shape: tuple[int, ...] | None = None
+        self._header_size = 0
+        self._rows = 0
+
+    def __len__(self) -> int:
+        return self._rows
+
+    @property
+    def spool_path(self) -> Path:
+        if self.compressed:
+            return self.path.with_name(self.path.name + ".part")
+        return self.path
+
+    def _open(self, rows: npt.NDArray[Any]):
+        if self.dtype is None:
+            self.dtype = rows.dtype
+        self._row_shape = rows.shape[1:]
+        header = _npy_header(self.dtype, (_PLACEHOLDER_ROWS, *self._row_shape))
+        self._header_size = len(header)
+        self._file = open(self.spool_path, "wb")
+        self._file.write(header)
+
+    def append(self, rows: npt.NDArray[Any]):
+        """Append a batch of rows, all batches need the same trailing shape"""
+        rows = np.asarray(rows)
+        if self._file is None:
+            self._open(rows)
+        elif rows.shape[1:] != self._row_shape:
+            raise ValueError(
+                f"Expected rows of shape {self._row_shape}, got {rows.shape[1:]}"
+            )
+        self._file.write(np.ascontiguousarray(rows, dtype=self.dtype).data)
+        self._rows += len(rows)
+
+    def _finish_spool(self) -> bool:
+        """Write the final header, returns whether anything was written"""
+        if self._file is None:
+            return False
+        self._file.seek(0)
+        self._file.write(
+            _npy_header(
+                self.dtype, (self._rows, *self._row_shape), size=self._header_size
+            )
+        )
+        self._file.close()
+        self._file = None
+        return True
+
+    def _deflate(self):
+        # same archive layout as np.savez_compressed, so np.load reads it
+        with zipfile.ZipFile(self.path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            with zf.open("arr_0.npy", "w", force_zip64=True) as member:
+                with open(self.spool_path, "rb") as spool:
+                    while chunk := spool.read(self.chunk_bytes):
+                        member.write(chunk)
+        os.remove(self.spool_path)
+
+    def close(self) -> bool:
+        """Finish the output file, returns whether it was written at all"""
+        written = self._finish_spool()
+        if written and self.compressed:
+            self._deflate()
+        return written
+
+
+def close_all(
+    writers: Iterable[ArrayStreamWriter], num_workers: int = 1
+) -> list[ArrayStreamWriter]:
+    """Close writers, compressing up to ``num_workers`` outputs concurrently
+
+    zlib releases the GIL, so threads compress in parallel.
+
+    Returns:
+        the writers that wrote a file
+    """
+    written = [writer for writer in writers if writer._finish_spool()]
+    compressed = [writer for writer in written if writer.compressed]
+    if num_workers > 1 and len(compressed) > 1:
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            list(pool.map(ArrayStreamWriter._deflate, compressed))
+    else:
+        for writer in compressed:
+            writer._deflate()
+    return written
@@ -0,0 +1,67 @@
+"""Growable tensor buffer for accumulating per-sample outputs of an epoch.
+
+Batches are copied into one preallocated tensor on the device they arrive
+on, which grows geometrically when full. Reading the buffer back is a
+single contiguous device-to-host copy instead of stacking one 0-d tensor per
+sample.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import torch
+
+
+class TensorBuffer:
+    def __init__(self, initial_capacity: int = 1024, growth: float = 2.0):
+        """
+        Args:
+            initial_capacity: Rows allocated on the first append
+            growth: Factor the capacity grows by when the buffer is full
+        """
+        self.initial_capacity = initial_capacity
+        self.growth = growth
+        self._data: torch.Tensor | None = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _reserve(self, size: int, like: torch.Tensor):
+        if self._data is None:
+            capacity = max(self.initial_capacity, size)
+            self._data = like.new_empty((capacity, *like.shape[1:]))
+            return
+
+        capacity = len(self._data)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity = int(capacity * self.growth) + 1
+        data = self._data.new_empty((capacity, *self._data.shape[1:]))
+        data[: self._size] = self._data[: self._size]
+        self._data = data
+
+    def append(self, batch: torch.Tensor):
+        """Append the rows of a batch, a 0-d tensor counts as one row"""
+        batch = batch.detach()
+        if batch.dim() == 0:
+            batch = batch.unsqueeze(0)
+        size = self._size + len(batch)
+        self._reserve(size, batch)
+        self._data[self._size : size] = batch
+        self._size = size
+
+    def tensor(self) -> torch.Tensor:
+        """View of the filled rows, on the device of the appended batches"""
+        if self._data is None:
+            return torch.empty(0)
+        return self._data[: self._size]
+
+    def numpy(self) -> np.ndarray:
+        """Copy of the filled rows on the host, safe to keep after clear"""
+        return self.tensor().to("cpu", copy=True).numpy()
+
+    def clear(self):
+        """Empty the buffer, keeping its memory for the next epoch"""
+        self._size = 0
@@ -0,0 +1,299 @@
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+from loguru import logger
+from omegaconf import OmegaConf
+from rich.console import Console
+from rich.table import Table
+
+from fd_shifts import analysis
+from fd_shifts.analysis import metrics
+from fd_shifts.analysis.confid_scores import (
+    ConfidScore,
+    get_confid_feature,
+    prediction_feature,
+)
+from fd_shifts.analysis.eval_utils import ConfidEvaluator
+from fd_shifts.analysis.studies import get_study_iterator
+
+# Times the analysis pipeline on synthetic runs and tracks peak memory
+# python -m scripts.benchmark_analysis --preset small --out baseline.json
+# python -m scripts.benchmark_analysis --preset small --compare baseline.json
+
+CONFIG_PATH = (
+    Path(__file__).absolute().parent.parent
+    / "fd_shifts"
+    / "tests"
+    / "data"
+    / "cifar10_modeldg_bbvit_lr0.01_bs128_run0_do0_rew6"
+    / "config.yaml"
+)
+
+# (n_samples, n_classes, n_mcd_samples)
+PRESETS = {
+    "small": [(10_000, 10, 0), (10_000, 10, 10)],
+    "medium": [(100_000, 10, 0), (100_000, 100, 20), (100_000, 1000, 0)],
+    "large": [(1_000_000, 10, 0), (200_000, 1000, 0), (100_000, 100, 50)],
+}
+
+QUERY_STUDIES = {
+    "iid_study": "cifar10_384",
+    "noise_study": ["corrupt_cifar10_384"],
+    "new_class_study": ["cifar100_384"],
+}
+
+QUERY_CONFID_METRICS = [
+    "failauc",
+    "failap_suc",
+    "failap_err",
+    "fail-NLL",
+    "mce",
+    "ece",
+    "e-aurc",
+    "b-aurc",
+    "aurc",
+    "fpr@95tpr",
+    "risk@95cov",
+]
+QUERY_PLOTS = ["calibration", "overconfidence", "roc_curve", "prc_curve", "rc_curve"]
+
+
+def _set_sizes(n_samples: int) -> list[int]:
+    """val_tuning, iid, noise and new class set, noise is 15 x 5 intensities"""
+    n_noise = max(75, int(0.45 * n_samples) // 75 * 75)
+    n_val = n_samples // 10
+    n_iid = (n_samples - n_noise - n_val) // 2
+    return [n_val, n_iid, n_noise, n_samples - n_noise - n_val - n_iid]
+
+
+def write_synthetic_run(
+    root: Path, n_samples: int, n_classes: int, n_mcd: int, seed: int = 0
+):
+    """Write raw outputs of a run and return its config"""
+    rng = np.random.default_rng(seed)
+    dataset_idx = np.repeat(np.arange(4), _set_sizes(n_samples))
+    labels = rng.integers(0, n_classes, size=n_samples)
+
+    test_dir = root / "run" / "test_results"
+    test_dir.mkdir(parents=True)
+
+    def _softmax(logits, axis):
+        logits = np.exp(logits - logits.max(axis=axis, keepdims=True))
+        return logits / logits.sum(axis=axis, keepdims=True)
+
+    logits = rng.normal(size=(n_samples, n_classes)).astype(np.float32)
+    logits[np.arange(n_samples), labels] += 2
+    if n_mcd > 0:
+        mcd_softmax = np.empty((n_samples, n_classes, n_mcd))
+        # written in blocks to keep the float32 temporaries small
+        for start in range(0, n_samples, 10_000):
+            rows = slice(start, start + 10_000)
+            noise = rng.normal(size=(*logits[rows].shape, n_mcd)).astype(np.float32)
+            mcd_softmax[rows] = _softmax(logits[rows, :, None] + noise, axis=1)
+        # same predictions with and without MCD, new class studies assume this
+        softmax = mcd_softmax.mean(axis=2)
+        np.savez_compressed(test_dir / "raw_output_dist.npz", mcd_softmax)
+        del mcd_softmax
+        np.savez_compressed(
+            test_dir / "external_confids_dist.npz",
+            rng.uniform(size=(n_samples, n_mcd)),
+        )
+    else:
+        softmax = _softmax(logits.astype(np.float64), axis=1)
+
+    np.savez_compressed(
+        test_dir / "raw_output.npz",
+        np.concatenate([softmax, labels[:, None], dataset_idx[:, None]], axis=1),
+    )
+    np.savez_compressed(test_dir / "external_confids.npz", rng.uniform(size=n_samples))
+
+    os.environ["EXPERIMENT_ROOT_DIR"] = str(root)
+    os.environ.setdefault("DATASET_ROOT_DIR", "")
+    cf = OmegaConf.load(CONFIG_PATH)
+    cf.exp.group_name = ""
+    cf.test.dir = str(test_dir)
+    cf.data.num_classes = n_classes
+    cf.eval.query_studies = QUERY_STUDIES
+    cf.eval.confidence_measures.test = ["det_mcp", "det_pe", "ext"] + (
+        ["mcd_mcp", "mcd_pe", "mcd_ee", "mcd_mi", "mcd_sv", "mcd_waic"]
+        if n_mcd > 0
+        else []
+    )
+    return cf
+
+
+def measure(func, repeat: int) -> dict[str, float]:
+    """Wall time of ``repeat`` calls and peak allocations of one more call"""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "min_s": min(seconds),
+        "median_s": statistics.median(seconds),
+        "peak_mib": peak / 2**20,
+    }
+
+
+def benchmark_run(cf, out_dir: Path, repeat: int, plot_mode: str):
+    """Time the stages of the analysis of one run"""
+    data = analysis.ExperimentData.from_experiment(Path(cf.test.dir), config=cf)
+    confids = list(cf.eval.confidence_measures.test)
+    stub = SimpleNamespace(experiment_data=data, query_studies=cf.eval.query_studies)
+    iid = data.filter_dataset_by_name(cf.eval.query_studies.iid_study)
+    score = ConfidScore(iid, "det_mcp", analysis=None)
+
+    stages = {
+        "from_experiment": lambda: analysis.ExperimentData.from_experiment(
+            Path(cf.test.dir), config=cf
+        ),
+        "extract_features": lambda: analysis.ExperimentData.from_experiment(
+            Path(cf.test.dir), config=cf
+        ).extract_features(
+            [
+                f
+                for c in confids
+                for f in [prediction_feature(c), get_confid_feature(c)]
+                if f is not None
+            ]
+        ),
+        "study_filtering": lambda: [
+            study
+            for query_study in ["val_tuning", *cf.eval.query_studies]
+            for study in get_study_iterator(query_study)(query_study, stub)
+        ],
+    }
+    for name in QUERY_CONFID_METRICS:
+        if not metrics.has_metric_function(name):
+            continue
+        stages[f"metric:{name}"] = lambda name=name: metrics.get_metric_function(name)(
+            metrics.StatsCache(score.confids, score.correct, 20, score.labels)
+        )
+    stages["ConfidEvaluator"] = lambda: _evaluate(score)
+    stages["analysis.main"] = lambda: analysis.main(
+        in_path=cf.test.dir,
+        out_path=str(out_dir),
+        query_studies=cf.eval.query_studies,
+        add_val_tuning=cf.eval.val_tuning,
+        threshold_plot_confid=None,
+        cf=cf,
+        plot_mode=plot_mode,
+    )
+
+    results = {}
+    for name, func in stages.items():
+        logger.info("benchmarking {}", name)
+        results[name] = measure(func, 1 if name == "analysis.main" else repeat)
+    return results
+
+
+def _evaluate(score: ConfidScore):
+    evaluator = ConfidEvaluator(
+        confids=score.confids,
+        correct=score.correct,
+        labels=score.labels,
+        query_metrics=QUERY_CONFID_METRICS,
+        query_plots=QUERY_PLOTS,
+        bins=20,
+    )
+    evaluator.get_metrics_per_confid()
+    evaluator.get_plot_stats_per_confid()
+
+
+def compare(results, baseline, threshold: float) -> list[str]:
+    """Stages whose median time or peak memory grew beyond the threshold"""
+    regressions = []
+    for run, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(run, {}).get(stage)
+            if base is None:
+                continue
+            for key in ["median_s", "peak_mib"]:
+                if base[key] > 0 and result[key] / base[key] > threshold:
+                    regressions.append(
+                        f"{run} {stage} {key}: {base[key]:.4f} -> {result[key]:.4f}"
+                    )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--preset", choices=PRESETS, default="small")
+    parser.add_argument(
+        "--run",
+        type=lambda s: tuple(int(v) for v in s.split(",")),
+        action="append",
+        help="n_samples,n_classes,n_mcd instead of a preset, can be repeated",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--plot-mode", choices=analysis.PLOT_MODES, default="none")
+    parser.add_argument("--out", type=Path, default=None)
+    parser.add_argument("--compare", type=Path, default=None)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="report stages slower or bigger than this factor of the baseline",
+    )
+    parser.add_argument("-l", "--log-level", type=str, default="warning")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(lambda m: print(m, end=""), level=args.log_level.upper())
+    analysis.logger = logger
+
+    console = Console()
+    results = {}
+    for n_samples, n_classes, n_mcd in args.run or PRESETS[args.preset]:
+        run = f"n{n_samples}_c{n_classes}_mcd{n_mcd}"
+        console.print(f"[cyan]{run}")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cf = write_synthetic_run(Path(tmp_dir), n_samples, n_classes, n_mcd)
+            results[run] = benchmark_run(
+                cf, Path(tmp_dir) / "analysis", args.repeat, args.plot_mode
+            )
+
+        table = Table(title=run)
+        for column in ["stage", "min (s)", "median (s)", "peak (MiB)"]:
+            table.add_column(column, justify="left" if column == "stage" else "right")
+        for stage, result in results[run].items():
+            table.add_row(
+                stage,
+                f"{result['min_s']:.4f}",
+                f"{result['median_s']:.4f}",
+                f"{result['peak_mib']:.1f}",
+            )
+        console.print(table)
+
+    if args.out is not None:
+        args.out.write_text(json.dumps(results, indent=2))
+
+    if args.compare is not None:
+        regressions = compare(
+            results, json.loads(args.compare.read_text()), args.threshold
+        )
+        for regression in regressions:
+            console.print(f"[red]regression[/red] {regression}")
+        if len(regressions) > 0:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,30 @@
 import argparse
-from multiprocessing import Pool, set_start_method
+import csv
+import threading
+import time
+from collections import deque
+from dataclasses import astuple, dataclass, fields
+from multiprocessing import get_context, set_start_method
+from multiprocessing.connection import wait
 from pathlib import Path
 from random import shuffle
 
+import psutil
 import torch
 from loguru import logger
 from omegaconf import OmegaConf
 from rich.console import Console
 from rich.progress import Progress
+from rich.table import Table
 from threadpoolctl import threadpool_limits
 
 from fd_shifts import analysis
+from fd_shifts.analysis.manifest import INPUT_FILES
+from fd_shifts.analysis.profiling import (
+    PROFILE_NAME,
+    load_profiles,
+    summarize_profiles,
+)
 
 # EXPERIMENT_ROOT_DIR=/home/t974t/Experiments/ DATASET_ROOT_DIR=/home/t974t/Data python -W ignore -m scripts.do_analysis -l debug -p /home/t974t/Experiments/vit/
 # EXPERIMENT_ROOT_DIR=/home/t974t/Experiments/fd-shifts DATASET_ROOT_DIR=/home/t974t/Data python -W ignore -m scripts.do_analysis -l debug -p /home/t974t/Experiments/fd-shifts/
@@ -24,7 +38,12 @@ def set_logger(logger_):
     logger = logger_
 
 
-def run_analysis(path: Path):
+def run_analysis(
+    path: Path,
+    plot_mode: str = "render",
+    incremental: bool = False,
+    profile: bool = False,
+):
     analysis.logger = logger
     analysis.eval_utils.logger = logger
     analysis.studies.logger = logger
@@ -46,10 +65,12 @@ def run_analysis(path: Path):
             add_val_tuning=config.eval.val_tuning,
             threshold_plot_confid=None,
             cf=config,
+            plot_mode=plot_mode,
+            incremental=incremental,
+            profile=profile,
         )
 
         logger.info("Finished analysis in {}", path)
-        logger.complete()
         return 0
     except KeyboardInterrupt:
         logger.warning("keyboard interrupt")
@@ -58,13 +79,211 @@ def run_analysis(path: Path):
         logger.info("Abnormally finished analysis in {}", path)
     finally:
         logger.complete()
-        return 1
+    return 1
 
 
 def get_all_experiments(path: Path):
     return path.expanduser().glob("**/test_results")
 
 
+def raw_output_size(path: Path) -> int:
+    return sum(
+        (path / name).stat().st_size for name in INPUT_FILES if (path / name).is_file()
+    )
+
+
+def schedule_experiments(paths, done: set[str]) -> list[Path]:
+    """Pending runs, largest raw outputs first so huge runs do not straggle"""
+    paths = [p for p in paths if str(p) not in done]
+    return sorted(paths, key=raw_output_size, reverse=True)
+
+
+def read_done_list(path: Path) -> set[str]:
+    if not path.is_file():
+        return set()
+    return set(path.read_text().split())
+
+
+@dataclass
+class RunReport:
+    path: str
+    status: int
+    seconds: float
+    start_rss: int
+    peak_rss: int
+
+
+class PeakRSS:
+    """Sample the resident set size of this process in a background thread
+
+    Workers are reused across runs, so ``start`` is recorded as well to tell
+    the memory of a run apart from what the worker already held.
+    """
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.start = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while True:
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        self.start = self.peak = self.process.memory_info().rss
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+def worker(conn, logger_, max_rss: int, analysis_kwargs: dict):
+    """Run the analyses the scheduler sends over ``conn`` until it sends None
+
+    Workers are kept alive between runs, so imports and warm caches are
+    reused. A worker exits after a run that leaves it above ``max_rss`` bytes
+    and is replaced by the scheduler.
+    """
+    set_logger(logger_)
+    torch.set_num_threads(1)
+    process = psutil.Process()
+    with threadpool_limits(limits=1, user_api="blas"):
+        while (path := conn.recv()) is not None:
+            start = time.perf_counter()
+            with PeakRSS() as rss:
+                status = run_analysis(path, **analysis_kwargs)
+            report = RunReport(
+                str(path), status, time.perf_counter() - start, rss.start, rss.peak
+            )
+            restart = process.memory_info().rss > max_rss
+            conn.send((report, restart))
+            if restart:
+                logger.info(
+                    "Restarting worker {} above memory limit after {}",
+                    process.pid,
+                    path,
+                )
+                return
+
+
+def run_scheduler(
+    paths: list[Path],
+    num_proc: int,
+    max_rss: int,
+    analysis_kwargs: dict,
+    on_finished,
+):
+    """Distribute runs over warm worker processes
+
+    Every worker gets its runs over its own pipe, so the scheduler always
+    knows which run a worker is busy with, even if it dies without a word.
+
+    Args:
+        paths: Runs in the order they should be started
+        num_proc: Number of worker processes
+        max_rss: Memory limit in bytes above which a worker is restarted
+        analysis_kwargs: Passed on to :func:`run_analysis`
+        on_finished: Called with the :class:`RunReport` of every run
+    """
+    ctx = get_context("spawn")
+    pending = deque(paths)
+    workers: dict[int, tuple] = {}
+    assigned: dict[int, str] = {}
+
+    def start_worker():
+        conn, child_conn = ctx.Pipe()
+        process = ctx.Process(
+            target=worker,
+            args=(child_conn, logger, max_rss, analysis_kwargs),
+        )
+        process.start()
+        child_conn.close()
+        workers[process.pid] = (process, conn)
+        return process.pid
+
+    def assign(pid: int):
+        path = pending.popleft()
+        assigned[pid] = str(path)
+        workers[pid][1].send(path)
+
+    def collect(pid: int):
+        process, conn = workers[pid]
+        try:
+            if pid in assigned and conn.poll():
+                report, restart = conn.recv()
+                del assigned[pid]
+                on_finished(report)
+                if restart:
+                    del workers[pid]
+                    process.join()
+                    conn.close()
+                    return
+        except EOFError:
+            process.join()
+        if process.is_alive():
+            return
+        del workers[pid]
+        conn.close()
+        if pid in assigned:
+            path = assigned.pop(pid)
+            logger.error("Worker {} died while analysing {}", pid, path)
+            on_finished(RunReport(path, 1, float("nan"), 0, 0))
+
+    try:
+        while pending or assigned:
+            for pid in [pid for pid in workers if pid not in assigned]:
+                if pending:
+                    assign(pid)
+            # replace workers that exited above the memory limit or crashed
+            while pending and len(workers) < num_proc:
+                assign(start_worker())
+
+            ready = {}
+            for pid, (process, conn) in workers.items():
+                ready[process.sentinel] = pid
+                if pid in assigned:
+                    ready[conn] = pid
+            for pid in {ready[obj] for obj in wait(list(ready))}:
+                collect(pid)
+    finally:
+        for process, conn in workers.values():
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for process, _ in workers.values():
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+
+
+def report_profiles(paths: list[Path], console: Console):
+    """Print and save the stage timings of all runs, slowest stage first"""
+    profile_paths = [p / PROFILE_NAME for p in paths if (p / PROFILE_NAME).is_file()]
+    if len(profile_paths) == 0:
+        return
+
+    summary = summarize_profiles(load_profiles(profile_paths))
+    summary.to_csv(
+        f"{time.strftime('%Y-%m-%dT%H-%M-%S')}_do-analysis-profile.csv", index=False
+    )
+
+    table = Table(title=f"Analysis stages of {len(profile_paths)} runs")
+    for column in summary.columns:
+        table.add_column(column, justify="left" if column == "stage" else "right")
+    for row in summary.itertuples(index=False):
+        table.add_row(*[f"{v:.2f}" if isinstance(v, float) else str(v) for v in row])
+    console.print(table)
+
+
 def main():
     set_start_method("spawn")
     torch.set_num_threads(1)
@@ -83,31 +302,93 @@ def main():
     logger.add("{time}_do-analysis.log", enqueue=True, level="INFO")
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("--continue", action="store_true")
+    parser.add_argument(
+        "--continue",
+        action="store_true",
+        help="skip runs listed in the done list",
+    )
+    parser.add_argument(
+        "--done-list",
+        type=Path,
+        default=None,
+        help="successfully analysed runs, defaults to PATH/do_analysis_done.txt",
+    )
     parser.add_argument("-n", "--num-proc", type=int, default=None)
     parser.add_argument("-p", "--path", type=Path, default=VIT_PATH)
     parser.add_argument("-l", "--log-level", type=str, default="info")
+    parser.add_argument(
+        "--max-rss",
+        type=float,
+        default=16,
+        help="restart a worker when its memory exceeds this many GiB after a run",
+    )
+    parser.add_argument(
+        "--plot-mode",
+        choices=analysis.PLOT_MODES,
+        default="render",
+        help="deferred only saves plot stats, see scripts/render_master_plots.py",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only compute metrics missing from each run's analysis manifest",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="record stage timings per run and print a summary over all runs",
+    )
     args = parser.parse_args()
 
-    try:
-        with Progress(console=console) as progress:
-            task_id = progress.add_task(
-                "[cyan]Working...", total=len(list(get_all_experiments(args.path)))
-            )
-            with threadpool_limits(limits=1, user_api="blas"):
-                with Pool(
-                    processes=args.num_proc,
-                    initializer=set_logger,
-                    initargs=(logger,),
-                    maxtasksperchild=1,
-                ) as pool:
-                    for _ in pool.imap_unordered(
-                        run_analysis, get_all_experiments(args.path),
-                    ):
-                        progress.advance(task_id)
-    except KeyboardInterrupt:
-        logger.error("keyboard interrupt")
-        return
+    path = args.path.expanduser()
+    done_list = args.done_list or path / "do_analysis_done.txt"
+    done = read_done_list(done_list) if getattr(args, "continue") else set()
+    paths = schedule_experiments(get_all_experiments(path), done)
+    logger.info("Scheduling {} runs, {} already done", len(paths), len(done))
+
+    report_path = Path(f"{time.strftime('%Y-%m-%dT%H-%M-%S')}_do-analysis-report.csv")
+    with open(report_path, "w", newline="") as report_file, open(
+        done_list, "a"
+    ) as done_file:
+        writer = csv.writer(report_file)
+        writer.writerow([f.name for f in fields(RunReport)])
+        try:
+            with Progress(console=console) as progress:
+                task_id = progress.add_task("[cyan]Working...", total=len(paths))
+
+                def on_finished(report: RunReport):
+                    logger.info(
+                        "{} {} in {:.1f}s, peak memory {:.0f} MiB (+{:.0f} MiB)",
+                        "Analysed" if report.status == 0 else "Failed",
+                        report.path,
+                        report.seconds,
+                        report.peak_rss / 2**20,
+                        (report.peak_rss - report.start_rss) / 2**20,
+                    )
+                    writer.writerow(astuple(report))
+                    report_file.flush()
+                    if report.status == 0:
+                        done_file.write(f"{report.path}\n")
+                        done_file.flush()
+                    progress.advance(task_id)
+
+                run_scheduler(
+                    paths,
+                    args.num_proc or psutil.cpu_count(),
+                    int(args.max_rss * 2**30),
+                    {
+                        "plot_mode": args.plot_mode,
+                        "incremental": args.incremental,
+                        "profile": args.profile,
+                    },
+                    on_finished,
+                )
+        except KeyboardInterrupt:
+            logger.error("keyboard interrupt")
+            return
+
+    if args.profile:
+        report_profiles(paths, console)
 
 
 if __name__ == "__main__":
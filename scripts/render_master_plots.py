@@ -0,0 +1,36 @@
+import argparse
+from pathlib import Path
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+from rich.progress import track
+
+from fd_shifts.analysis.eval_utils import render_master_plots
+
+# Renders master plots for analyses that were run with --plot-mode deferred
+# python -m scripts.render_master_plots -p ~/Experiments/vit/
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--path", type=Path, required=True)
+    parser.add_argument("--overwrite", action="store_true")
+    args = parser.parse_args()
+
+    paths = sorted(args.path.expanduser().glob("**/test_results/plot_stats_*.npz"))
+    if not args.overwrite:
+        paths = [
+            p
+            for p in paths
+            if not p.with_name(p.name.replace("plot_stats_", "master_plot_", 1))
+            .with_suffix(".png")
+            .is_file()
+        ]
+
+    render_master_plots(track(paths, description="Rendering..."))
+
+
+if __name__ == "__main__":
+    main()